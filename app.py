@@ -1,26 +1,54 @@
+import functools
+import html
+import io
+import os
+import time
 import traceback
 from datetime import datetime
 
 import altair as alt
 import matplotlib.pyplot as plt
 import pandas as pd
-import requests
 import sqlalchemy
 import streamlit as st
 
-from config import db_name
-from config import db_user as user
-from config import ip_server as ip
-from config import pwd_postgres as pwd
+from config import data_version_ttl, export_max_age, result_cache_dir
 from info import (
     explainer,
     limit_warning,
     months_conversion,
     party_colors,
     party_colors_lighten,
-    select_columns,
     css,
 )
+import person_mirror
+from corpus_stats import read_stats
+from db import pool_status
+from dimensions import Dimensions
+from event_log import EventWriter
+from export import export, export_formats, export_name, remove_old_exports
+from facets import FacetIndex
+from fetch import QueryHandle, ResultLoader, fetch_full_texts, keyset_pages, stream_frames
+from query import parse_query, speaker_query
+from result_cache import ResultCache
+from result_schema import memory_report
+from riksdagen import RiksdagenClient
+from search_backends import get_backend
+from snippets import SnippetMatcher, highlight
+from telemetry import SlowQueryLog, create_telemetry_tables, timing_row
+from speakers import SpeakerIndex
+from stages import (
+    count_speeches,
+    decode_speeches,
+    filter_rows,
+    party_counts,
+    prepare_data,
+    short_table,
+    year_bars,
+    year_lines,
+)
+from sync import data_version
+from timing import StageTimer
 
 
 class Params:
@@ -78,79 +106,6 @@ def datestring_to_date(x):
     return f"{date_list[2]}-{months_conversion[date_list[1]]}-{date_list[0]}"
 
 
-def make_snippet(text, search_terms, long=False):
-    """Find the word searched for and give it some context."""
-
-    text = text.replace("Fru talman! ", "").replace("Herr talman! ", "")
-    if search_terms == "speaker":
-        if long:
-            snippet = str(text[:300])
-            if len(text) > 300:
-                snippet += "..."
-        else:
-            snippet = str(text[:80]) + "..."
-            if len(text) > 80:
-                snippet += "..."
-    else:
-        snippet = []
-        text_lower = text.lower()
-        snippet_lenght = int(8 / len(search_terms))  # * Change to another value?
-        if long:
-            snippet_lenght = snippet_lenght * 4
-        # Make the whole text to a list in lower cases.
-        text_list = text.split(" ")
-        text_list_lower = text_lower.split(" ")
-        # Try to find each for searched for and add to the snippet.
-        for word in search_terms:
-            word = word.replace("*", "").strip().lower()
-            if word in text_list_lower:
-                position = text_list_lower.index(word)
-
-                position_start = position - snippet_lenght
-                if position_start < 0:
-                    position_start = 0
-
-                position_end = position + int(snippet_lenght / 2)
-                if position_end > len(text_list_lower):
-                    position_end = len(text_list_lower) - 1
-                word_context_list = text_list[position_start:position_end]
-
-                snippet.append(" ".join(word_context_list))
-
-            elif word in text_lower:
-                position = text_lower.find(word)
-                # Find start position.
-                if position - snippet_lenght * 5 < 0:
-                    start_snippet = 0
-                else:
-                    start_snippet = text_lower.find(" ", position - snippet_lenght * 5)
-                # Find end position.
-                if position + len(word) + snippet_lenght * 4 > len(text):
-                    end_snippet = len(text)
-                else:
-                    end_snippet = text_lower.find(
-                        " ", position + len(word) + snippet_lenght * 4
-                    )
-                text = text[start_snippet:end_snippet]
-                snippet.append(text)
-
-            else:
-                position = 0
-                for listword in text_list:
-                    position += 1
-                    if word in listword.lower():
-                        word_context_list = text_list[
-                            position
-                            - snippet_lenght : position
-                            + int(snippet_lenght / 2)
-                        ]
-                        snippet.append(" ".join(word_context_list))
-
-        snippet = "|".join(snippet)
-        snippet = f"...{snippet}..."
-    return snippet
-
-
 def build_style_parties(parties):
     """Build a CSS styl for party names buttons."""
     style = "<style> "
@@ -162,24 +117,16 @@ def build_style_parties(parties):
 
 def build_style_mps(mps):
     """Build a CSS styl for party names buttons."""
+    dimensions = get_dimensions(get_engine())
     style = "<style> "
     for mp in mps:
-        party = mp[mp.find("(") + 1 : mp.find(")")].upper()
-        party = fix_party(party)
-        try:
-            style += f' span[data-baseweb="tag"][aria-label="{mp}, close by backspace"]{{ background-color: {party_colors[party]};}} .st-eg {{min-width: 14px;}} '  # max-width: 328px;
-        except KeyError:
-            style += f' span[data-baseweb="tag"][aria-label="{mp}, close by backspace"]{{ background-color: {party_colors["-"]};}} .st-eg {{min-width: 14px;}} '
+        party = dimensions.speaker_party(mp.rsplit(" - ", 1)[0])
+        color = party_colors.get(party, party_colors["-"])
+        style += f' span[data-baseweb="tag"][aria-label="{mp}, close by backspace"]{{ background-color: {color};}} .st-eg {{min-width: 14px;}} '  # max-width: 328px;
     style += "</style>"
     return style
 
 
-def fix_party(party):
-    """Replace old party codes with new ones."""
-    party = party.upper().replace("KDS", "KD").replace("FP", "L")
-    return party
-
-
 def build_style_debate_types(debates):
     """Build a CSS style for debate type buttons."""
     style = "<style> "
@@ -190,224 +137,577 @@ def build_style_debate_types(debates):
     return style
 
 
-def highlight_cells(party):
-    if party in party_colors.keys():
-        color = party_colors[party]
-        return f"background-color: {color}; font-weight: 'bold'"
+# The stages after the fetch are cached on a handle of the result, (query,
+# data version, loader, number of rows loaded), and their own inputs instead of on the content of
+# the DataFrame, which would have to be hashed on every rerun. Only results
+# that are completely loaded are cached, while pages are loading the handle
+# is new on every rerun and the entries would never be used again.
+
 
+def cached_stage(max_entries):
+    """Decorate a stage to be cached with st.cache_resource once its result is loaded.
 
-@st.cache_data
-def options_persons(df):
-    d = {}
-    for i in df.groupby("Talare"):
-        d[i[0]] = i[1].shape[0]
-    return [f"{key} - {value}" for key, value in d.items()]
+    The decorated function takes the keyword argument done, whether the
+    loader is done, and is run without the cache if it is not.
+    """
 
+    def decorator(func):
+        cached = st.cache_resource(max_entries=max_entries)(func)
+
+        @functools.wraps(func)
+        def stage(*args, done=True, **kwargs):
+            return cached(*args, **kwargs) if done else func(*args, **kwargs)
+
+        stage.clear = cached.clear
+        return stage
+
+    return decorator
+
+
+@cached_stage(max_entries=5)
+def get_facets(_df, handle):
+    """Build the facet index of a result."""
+    return FacetIndex(_df)
+
+
+def freeze(selections):
+    """Return the filter selections as a hashable key for the stage caches."""
+    return tuple(sorted((k, tuple(v)) for k, v in selections.items()))
+
+
+@cached_stage(max_entries=5)
+def filter_stage(_df, _facets, handle, selections):
+    """Return the speeches that pass the filters, numbered and in the order they are shown."""
+    return filter_rows(_df, _facets, dict(selections))
+
+
+@cached_stage(max_entries=5)
+def person_options_stage(_facets, handle, selections):
+    """Return the options for the person filter, with speeches per person given the other filters, and their style."""
+    person_counts = _facets.counts("Talare", dict(selections))
+    options = [f"{k} - {v}" for k, v in person_counts.items() if v > 0]
+    return options, build_style_mps(options)
+
+
+@cached_stage(max_entries=5)
+def table_stage(_df, handle, selections):
+    """Return the table with short snippets and its CSS, made for all cells at once."""
+    return short_table(_df)
+
+
+@cached_stage(max_entries=5)
+def chart_stage(counts, _stats, selections, speaker, normalized):
+    """Return the pie chart of parties (as PNG, None for speakers) and the chart of years.
+
+    Cached on the counts themselves, they are small, so filters giving the
+    same counts share the charts. If normalized the chart of years shows
+    hits per 1 000 speeches of each party, from the corpus statistics
+    (_stats) with the same filters.
+    """
+    # The counts are of distinct speeches, so talks from the same party within
+    # the same session are only counted once.
+    pie = None
+    if not speaker:
+        party_talks = party_counts(counts)
+        party_labels = party_talks.index.to_list()
+        fig, ax1 = plt.subplots()
+        total = party_talks.sum()
+        mentions = party_talks
+        ax1.pie(
+            mentions,
+            labels=party_labels,
+            autopct=lambda p: "{:.0f}".format(p * total / 100),
+            colors=[party_colors[key] for key in party_labels],
+            startangle=90,
+        )
+        # Render once, the image is shared by all sessions.
+        image = io.BytesIO()
+        fig.savefig(image, format="png", bbox_inches="tight", dpi=200)
+        plt.close(fig)
+        pie = image.getvalue()
+
+    if normalized:
+        df_years = year_lines(counts, _stats, selections)
+        chart = (
+            alt.Chart(df_years)
+            .mark_line(point=True)
+            .encode(
+                x="År",
+                y=alt.Y("Per 1000", title="Per 1 000 anföranden"),
+                color=alt.Color("color", scale=None),
+                detail="Parti",
+                tooltip=["Parti", "År", "Antal", "Per 1000"],
+            )
+        )
+        return pie, chart
+
+    # Make bars per year.
+    df_years = year_bars(counts)
+    chart = (
+        alt.Chart(df_years)
+        .mark_bar()
+        .encode(
+            x="År",
+            y="Antal",
+            color=alt.Color("color", scale=None),
+            tooltip=["Parti", "Antal"],
+        )
+    )
+    return pie, chart
 
-@st.cache_data
-def get_data(sql):
-    """Get data from SQL database.
+
+def export_stage(engine, query, version, selections, file_format):
+    """Write all speeches matching the search and the filters to a file, if not done already.
+
+    The file is served by Streamlit's static file serving, so it is never
+    held in memory. The version of the data is part of its name, so a file
+    written before a sync is not served after it.
+
+    Returns:
+        str: The URL of the file.
+    """
+    os.makedirs(export_dir, exist_ok=True)
+    remove_old_exports(export_dir, export_max_age)
+    backend = get_search_backend()
+    name = export_name(
+        query, file_format, selections=selections, backend=backend.name, version=version
+    )
+    path = os.path.join(export_dir, name)
+    if not os.path.exists(path):
+        prepare = functools.partial(prepare_export, engine=engine, selections=selections)
+        export(engine, backend, query, path, file_format, prepare)
+    return f"app/static/exports/{name}"
+
+
+def prepare_export(df, engine, selections):
+    """Decode and filter a chunk of exported speeches."""
+    df = decode_keys(engine, df)
+    for column, values in selections:
+        df = df.loc[df[column].isin(values)]
+    return df.assign(url_session="https://riksdagen.se" + df["url_session"].astype(str))
+
+
+@st.cache_resource
+def get_dimensions(_engine):
+    """Read the tables of parties, debate types and speakers once per process."""
+    with _engine.connect() as conn:
+        return Dimensions.load(conn)
+
+
+def dimensions_for(engine, df):
+    """Return the dimension tables, read again if the frame has keys added since they were read, e.g. by sync.py."""
+    dimensions = get_dimensions(engine)
+    if not dimensions.knows(df):
+        get_dimensions.clear()
+        dimensions = get_dimensions(engine)
+    return dimensions
+
+
+def decode_keys(engine, df):
+    """Turn the keys of party, debate type and speaker into categoricals and keep the known parties."""
+    return decode_speeches(df, dimensions_for(engine, df))
+
+
+def prepare_page(df, engine, search_terms):
+    """Decode a page of data from the DB and add snippets, see stages.prepare_data."""
+    return prepare_data(df, dimensions_for(engine, df), search_terms)
+
+
+def long_snippet_rows(page, first=0):
+    """Make the HTML for a page of long snippets, with vectorized string operations.
 
     Args:
-        sql (str): A SQL query string.
+        page (DataFrame): The speeches to show, sorted by date and debate.
+        first (int): Number of speeches on the pages before, to number the rows.
 
     Returns:
-        DataFrame: Dataframe with some adjustments to the data fetched from the DB.
+        tuple: Series with a date heading where a new debate starts (else
+            ""), and Series with the HTML of each row, both indexed like page.
     """
-    df = pd.read_sql(sql, engine)
-
-    if df.shape[0] not in [0, return_limit]:
-        # Clean the data and change some column names.
-        df["Parti"].replace("FP", "L", inplace=True)
-        df["Parti"].replace("KDS", "Kd", inplace=True)
-        df["debatetype"].replace("", "inte angiven debattyp", inplace=True)
-        df["debatetype"].replace("-", "inte angiven debattyp", inplace=True)
-        df["Anförande"] = df["Text"].apply(
-            lambda x: x.replace("</p>", "").replace("</p>", " ").replace("-\n", " ")
-        )
-        df = df.loc[df["Parti"].isin(parties)]
-        df["url_session"] = df["url_session"].apply(
-            lambda x: "https://riksdagen.se" + str(x)
-        )  # Add domain to url.
+    if len(page) == 0:
+        return pd.Series(dtype=str), pd.Series(dtype=str)
+    # Remove title for ministers. #TODO Remove "statsråd" etc.
+    speakers = page["Talare"].str.replace(r"^.*?minister", "", regex=True).str.strip()
+    snippets = (
+        page["Utdrag_long"]
+        .str.replace("<p>", "", regex=False)
+        .str.replace("</p>", "", regex=False)
+        .map(html.escape)
+        .str.replace(":", "&#58;", regex=False)  # Not emoji shortcodes.
+    )
+    colors = page["Parti"].astype(str).map(party_colors_lighten).fillna("white")
+    new_debate = page["dok_id"] != page["dok_id"].shift()
+    headings = "<p style='font-weight: bold; margin: 1em 0 0.2em;'>" + page["Datum"].dt.strftime("%Y-%m-%d") + "</p>"
+    headings = headings.where(new_debate, "")
+    numbers = pd.Series(range(first + 1, first + len(page) + 1), index=page.index)
+    rows = (
+        "<div style='display: flex; gap: 1em;'><div style='flex: 2;'>"
+        + numbers.astype(str)
+        + ". "
+        + speakers.map(html.escape)
+        + "</div><div style='flex: 7;'><span style='color: black; background-color: "
+        + colors
+        + ";'>"
+        + snippets
+        + "</span></div></div>"
+    )
+    return headings, rows
 
-        df.sort_values(["Datum", "number"], axis=0, ascending=True, inplace=True)
 
-        # Make snippets from the text field (short and long).
-        df["Utdrag"] = df["Text"].apply(lambda x: make_snippet(x, search_terms))
-        df["Utdrag_long"] = df["Text"].apply(
-            lambda x: make_snippet(x, search_terms, long=True)
+def show_full_text(row, engine, search_terms):
+    """Show a speech in full with links to the speaker, debate, audio and protocol."""
+    url_person = get_person_url(engine, row["intressent_id"])
+    st.markdown(
+        f""" <span class="{row['Parti']}" style="font-weight: bold;">[ {row['Talare']} ]({url_person})</span> """,
+        unsafe_allow_html=True,
+    )
+    st.markdown(
+        f""" <span style="font-style: italic;">{row["Datum"]:%Y-%m-%d} - {row['debatetype']}</span> """,
+        unsafe_allow_html=True,
+    )
+    text = get_full_text(engine, row["talk_id"])
+    matches = SnippetMatcher(search_terms).matches(text)
+    st.write(
+        highlight(text, matches).replace(":", "\\:"),
+        unsafe_allow_html=True,
+    )
+    if row["url_session"] != "https://riksdagen.se":
+        st.markdown(f'📺 [Se debatten i Riksdagen]({row["url_session"]})')
+    if row["url_audio"] != "":
+        h = str(int(int(row["start"]) / 3600))
+        m = str(int((int(row["start"]) % 3600) / 60))
+        if len(m) == 1:
+            m = "0" + m
+        s = str(int((int(row["start"]) % 3600) % 60))
+        if len(s) == 1:
+            s = "0" + s
+        start_time = ""
+        if h != "0":
+            start_time += f"{h}:"
+        start_time += f"{m}:{s}"
+        st.markdown(
+            f'💬 [Ladda ner ljudet]({row["url_audio"]}) (Anförandet börjar vid {start_time})'
         )
 
-    df.drop_duplicates(ignore_index=True, inplace=True)
+    url_protocol = get_riksdagen_client().protocol_url(row["dok_id"])
+    st.markdown(f"📝 [Ladda ner protokollet]({url_protocol})")
+
+
+@st.cache_resource
+def get_result_cache():
+    """Open the result cache in config.py once per process, or return None if there is none."""
+    if result_cache_dir is None:
+        return None
+    return ResultCache()
+
+
+def store_result(cache, key, query, engine, version, loader):
+    """Write the speeches of a finished loader to the result cache.
+
+    The query is stored with them, so sync.py can tell which results new
+    speeches make stale. Results read while a sync ran are not stored, since
+    sync.py may already have removed the stale entries.
+    """
+    try:
+        current = data_version(engine)
+        if current != version or current[0] != current[1]:
+            return
+        df = loader.frame()
+        memory = memory_report(df)["bytes"]
+        cache.put(key, df, truncated=loader.truncated, memory_bytes=memory, query=query.to_json())
+    except Exception:  # The result is still shown, only not cached.
+        print(traceback.format_exc())
+
+
+def valid_loader(loader):
+    """Keep loaders in the caches unless they failed or were cancelled."""
+    return loader.error is None and not loader.cancelled
 
-    return df
 
+@st.cache_data(ttl=data_version_ttl)
+def get_data_version(_engine):
+    """Return the version of the data (see sync.py), read at most every data_version_ttl seconds."""
+    return data_version(_engine)
 
-@st.cache_data
-def define_search_terms(user_input):
-    """ Takes user input and make them into search terms for SQL.
+
+def current_data_version(engine):
+    """Return the version of the data, and reload the search backend if a sync has finished since it was read."""
+    version = get_data_version(engine)
+    backend = get_search_backend()
+    if backend.data_version is None:  # Read at start.
+        backend.data_version = version
+    elif version != backend.data_version and version[0] == version[1]:
+        backend.reload(version)
+    return version
+
+
+@st.cache_resource(max_entries=20, validate=valid_loader)
+def get_loader(_engine, query, version):
+    """Start loading the speeches matching a query, shared by all sessions.
+
+    Results from the result cache are returned as a finished loader, new
+    results are written to it when they are loaded. The version of the data
+    is part of the key, so results loaded before a sync are not used after it.
+    """
+    backend = get_search_backend()
+    cache = get_result_cache()
+    if cache is not None:
+        key = cache.key(query, backend=backend.name, table=backend.table, max_rows=max_rows)
+        cached = cache.get(key)
+        if cached is not None:
+            df, metadata = cached
+            return ResultLoader.finished(df, metadata.get("truncated") == "True")
+    timer = StageTimer()
+    handle = QueryHandle(_engine)
+    pages = keyset_pages(_engine, backend, query, page_size, timer, handle)
+    prepare = functools.partial(prepare_page, engine=_engine, search_terms=query.snippet_terms())
+    on_complete = None
+    if cache is not None:
+        on_complete = functools.partial(store_result, cache, key, query, _engine, version)
+    return ResultLoader(pages, prepare, max_rows, on_complete, timer, handle).start()
+
+
+def search_loaders(engine, query, version):
+    """Return the loaders a search needs: the speeches and, if they are truncated, the counts."""
+    loader = get_loader(engine, query, version)
+    if loader.done and loader.truncated:
+        return [loader, get_counts_loader(engine, query, version)]
+    return [loader]
+
+
+def switch_search(loaders):
+    """Make loaders the ones this session shows, and let go of those it showed before and doesn't now.
+
+    Loaders that no session shows any more are stopped and their statements
+    cancelled in the DB, so typing in the search box doesn't leave a scan
+    running for every version of the search.
+
+    Returns:
+        bool: False if one of the loaders was cancelled by another session just now.
+    """
+    previous = st.session_state.get("loaders", [])
+    acquired = [i.acquire() for i in loaders if not any(i is j for j in previous)]
+    for loader in previous:
+        if not any(loader is i for i in loaders):
+            loader.release()
+    st.session_state["loaders"] = loaders
+    return all(acquired)
+
+
+def get_data(engine, query, version):
+    """Get data from SQL database.
+
+    The speeches are loaded page by page in the background, this waits at most
+    first_page_timeout seconds for the first page.
 
     Args:
-        user_input (str): The string resulting from user input (input()).
+        engine (Engine): The engine from get_engine.
+        query (Query): A normalized query, as returned by parse_query.
+        version (tuple): The version of the data, from current_data_version.
 
     Returns:
-        list: List of search terms.
-    """    
-    # Search for quated phrases.
-    search_terms = []
-    while '"' in user_input:
-        q1 = user_input.find('"')
-        q2 = user_input.find('"', q1 + 1)
-        quoted_term = user_input[q1 + 1 : q2]
-        search_terms.append(quoted_term.lower())
-        user_input = user_input.replace(f'"{quoted_term}"', "")
-    while "  " in user_input:
-        user_input = user_input.replace(
-            "  ", " "
-        ).strip()  # Remove double and trailing blanks.
-
-    # Add non-quoted terms.
-    if len(user_input) > 0:
-        search_terms += [i.lower() for i in user_input.strip().split(" ")]
-    return search_terms
-
-
-def user_input_to_db(user_input, engine):
-    """Writes user input to db for debugging."""
-    sql = f"INSERT INTO  searches (id, search) VALUES ({datetime.timestamp(datetime.now())}, '{user_input}')"
-
-    with engine.connect() as conn:
-        conn.execute(sql)
-
-
-def create_sql_query(search_terms):
-    """Returns a valid sql query."""
-    word_list = []
-    years = ""
-    for word in search_terms:
-        
-        # Check if years are specified.
-        if "år:" in word:
-            start = int(word[3:7])
-            end = int(word[-4:])
-            if start == end:
-                years = [start]
-            else:
-                years = [str(i) for i in range(start, end + 1)]
-            years_string = f"({', '.join(years)})"
+        tuple: DataFrame with the speeches loaded so far, and the ResultLoader.
+    """
+    loader = get_loader(engine, query, version)
+    loader.wait(first_page_timeout)
+    return loader.frame(), loader
 
-        elif "*" not in word: #Searching for the exact word.
-            word_list.append(f" {word} ")
-        else:
-            if word[0] == "*" and word[-1] == "*":
-                word_list.append(word.replace("*", ""))
-            elif word[0] == "*":
-                word_list.append(f"{word.replace('*', '')} ")
-            elif word[-1] == "*":
-                word_list.append(f" {word.replace('*', '')}")
-    
-    # Format for SQL.
-    search_list = [f"'%%{i}%%'" for i in word_list]
-
-    n = 0
-    for i in search_list:
-        if " or " in i:
-            search_list[n] = "OR"
-        n += 1
-
-    # Handle searches with OR.
-    or_terms = []
-    while "OR" in search_list:
-        n_or = search_list.count("OR")
-        or_terms.append(search_list.pop(search_list.index("OR") - 1))
-        if n_or == 1:
-            or_terms.append(search_list.pop(search_list.index("OR") + 1))
-        search_list.remove("OR")
-    or_sql = f"( text_lower LIKE {' OR text_lower LIKE '.join(or_terms)})"
-    # Handle searches with -.
-    not_terms = []
-    for term in search_list:
-        if "-" in term:  # TODO Make this not include words with hyphen.
-            not_terms.append(search_list.pop(search_list.index(term)).replace("-", ""))
-
-    # Create SQL query.
-    search_sql = ''
-    if search_list != []:
-        search_sql = f'(text_lower LIKE {" AND text_lower LIKE ".join(search_list)}) '
-    
-    if or_terms != []:
-        if search_sql == '':
-            search_sql = or_sql
-        else:
-            search_sql = search_sql + " AND " + or_sql
 
-    if len(not_terms) > 0:
-        search_sql += (
-            f' AND (text_lower NOT LIKE {" AND text_lower NOT LIKE ".join(not_terms)})'
-        )
-    if years != "": # Search for years.
-        search_sql = f"({search_sql}) AND year in {years_string}"
-    sql = f"SELECT {select_columns} FROM {db_name} WHERE {search_sql} LIMIT {return_limit}"
-    
-    return sql
+@st.cache_data(max_entries=256)
+def get_full_text(_engine, talk_id):
+    """Get the full text of one speech from the DB."""
+    return fetch_full_texts(_engine, get_search_backend(), [talk_id]).get(talk_id, "")
+
 
+@st.cache_resource(max_entries=100, validate=valid_loader)
+def get_counts_loader(_engine, query, version):
+    """Start counting the speeches matching a query per party, year and debate type.
 
-def protocol_url(id):
-    """Returns the url of the protocol."""
-    url = f"https://data.riksdagen.se/dokument/{id}.json"
+    The counting is done in the DB, in the background, so the counts are for
+    all hits even if not all speeches have been fetched. The counts are kept
+    in the result cache, next to the speeches.
+
+    Args:
+        _engine (Engine): The engine from get_engine.
+        query (Query): A normalized query, as returned by parse_query.
+        version (tuple): The version of the data, from current_data_version.
+
+    Returns:
+        ResultLoader: Its frame has the columns Parti, År, debatetype and
+            Antal (number of speeches).
+    """
+    backend = get_search_backend()
+    cache = get_result_cache()
+    if cache is not None:
+        key = cache.key(query, backend=backend.name, table=backend.table, counts=True)
+        cached = cache.get(key)
+        if cached is not None:
+            return ResultLoader.finished(cached[0])
+    plan = backend.compile_aggregate(query)
+    handle = QueryHandle(_engine)
+    frames = stream_frames(_engine, plan, 100000, handle)
+    prepare = functools.partial(decode_counts, _engine)
+    on_complete = None
+    if cache is not None:
+        on_complete = functools.partial(store_result, cache, key, query, _engine, version)
+    return ResultLoader(frames, prepare, on_complete=on_complete, handle=handle).start()
+
+
+def get_counts(engine, query, version, loader, df):
+    """Return the speeches per party, year and debate type, or None while they are counted.
+
+    A complete result is counted as it is, also while it loads. Only the
+    hits of a truncated result are counted in the DB.
+
+    Args:
+        engine (Engine): The engine from get_engine.
+        query (Query): A normalized query, as returned by parse_query.
+        version (tuple): The version of the data, from current_data_version.
+        loader (ResultLoader): The loader of the speeches.
+        df (DataFrame): The speeches loaded so far.
+
+    Returns:
+        DataFrame: Columns Parti, År, debatetype and Antal (number of speeches).
+    """
+    if not (loader.done and loader.truncated):
+        return count_speeches(df)
+    counts_loader = get_counts_loader(engine, query, version)
+    counts_loader.wait(first_page_timeout)
+    counts = counts_loader.frame()
+    if len(counts) == 0 and not counts_loader.done:
+        return None
+    return counts
+
+
+def decode_counts(engine, counts):
+    """Decode counts per party, year and debate type the same way as in prepare_page."""
+    counts = decode_keys(engine, counts)
+    # Plain columns, to not group on unused categories.
+    return counts.astype({"Parti": str, "debatetype": str})
+
+
+@st.cache_data(ttl=3600)
+def get_corpus_stats(_engine):
+    """Get speeches per party, year and debate type in the whole corpus, or None if not built."""
     try:
-        documents = requests.get(url).json()["dokumentlista"]["dokument"]
-        for document in documents:
-            print(document)
-            if document["dok_id"] == id:
-                for file in document["filbilaga"]["fil"]:
-                    if "prot" in file["namn"]:
-                        url = file["url"]
-    except:  # If there is no url to PDF.
-        url = f"https://data.riksdagen.se/dokument/{id}"
-    
+        return decode_counts(_engine, read_stats(_engine))
+    except sqlalchemy.exc.DBAPIError:  # Run corpus_stats.py to build it.
+        return None
+
+
+def user_input_to_db(user_input, writer):
+    """Writes user input to db for debugging."""
+    writer.log("searches", id=datetime.timestamp(datetime.now()), search=user_input)
+
+
+@st.cache_resource
+def get_search_backend():
+    """Set up the search backend from config.py once per process."""
+    return get_backend()
+
+
+@st.cache_resource
+def get_engine():
+    """Create the engine, and its connection pool, once per process."""
+    return get_search_backend().create_engine()
+
+
+@st.cache_resource
+def get_event_writer():
+    """Start the writer of searches, errors and feedback once per process."""
+    return EventWriter(get_engine()).start()
+
+
+@st.cache_resource
+def get_riksdagen_client():
+    """One client for data.riksdagen.se per process, sharing its session and cache."""
+    return RiksdagenClient()
+
+
+@st.cache_data(max_entries=1000)
+def get_person_url(_engine, intressent_id):
+    """Return the URL of a speaker's page, from person_metadata if it is imported there."""
+    url = person_mirror.person_url(_engine, intressent_id)
+    if url is None:
+        url = get_riksdagen_client().person_url(intressent_id)
     return url
 
 
-def error2db(error, user_input, engine):
+@st.cache_resource
+def get_slow_query_log():
+    """Create the timing tables and start the slow query log once per process.
+
+    If the tables can't be created this raises, and is tried again next time.
+    """
+    create_telemetry_tables(get_engine())
+    return SlowQueryLog(get_engine(), get_event_writer())
+
+
+def log_search_timing(search, loaders, timer, writer):
+    """Log the timings of a search, and the query plans of its slow statements.
+
+    Args:
+        search (str): The search as typed.
+        loaders (list): The loaders of the search, from search_loaders, the
+            speeches first.
+        timer (StageTimer): The stages of the app run that showed the result.
+        writer (EventWriter): Writer of the rows.
+    """
+    try:
+        slow_query_log = get_slow_query_log()
+    except Exception as e:  # E.g. no CREATE privilege, the search is shown anyway.
+        print(f"Could not create the timing tables: {e}")
+        return
+    backend = get_search_backend()
+    writer.log("search_timings", **timing_row(search, backend, loaders[0], timer))
+    for loader in loaders:
+        if loader.done and loader.handle is not None:
+            slow_query_log.log(search, backend, loader.handle)
+
+
+def error2db(error, user_input, writer):
     """ Write error to DB for debugging."""
-    df = pd.DataFrame(
-        {
-            "error": error,
-            "time": datetime.date(datetime.now()),
-            "user_input": str(user_input),
-        },
-        index=[0],
+    writer.log(
+        "errors",
+        error=error,
+        time=datetime.date(datetime.now()),
+        user_input=str(user_input),
     )
-    df.to_sql("errors", engine, if_exists="append", index=False)
 
 
-@st.cache_data
-def get_speakers():
-    """ Get all """
-    return pd.read_sql("select * from persons", engine)
+@st.cache_resource
+def get_speaker_index(_engine):
+    """Build the index of speakers' names once per process."""
+    with _engine.connect() as conn:
+        df = pd.read_sql(sqlalchemy.text("select name, speaker from persons"), conn)
+    return SpeakerIndex.from_frame(df)
 
 
-def search_person(user_input, df_persons):
-    """ Returns SQL query made for searching everything a defined speaker has said.
+def search_person(user_input, speakers, exact):
+    """ Returns query made for searching everything a defined speaker has said.
 
     Args:
         user_input (str): The string resulting from user input (input()).
+        speakers (list): The speakers the user may be looking for.
+        exact (bool): If the input is a speaker's full name. If not the
+            speakers are only suggested and the normal search is run.
 
     Returns:
-        list: List of search terms.
+        Query: The query to search with.
     """    
     # List all alternatives.
-    options = df_persons.loc[df_persons["name"] == user_input.lower()][
-        "speaker"
-    ].tolist()
-    options = [f"Ja, sök på {i.title()}" for i in options]
+    options = [f"Ja, sök på {i.title()}" for i in speakers]
     no_option = f"Nej, jag vill söka på vad soms sagts om {user_input.title()}."
-    options += [no_option, "Välj ett alternativ"]
+    options += [no_option]
+    if exact:
+        options += ["Välj ett alternativ"]
     preselected_option = len(options) - 1
     # Let the user select a person or no_alternative.
+    label = ":red[Vill du söka efter vad en specifik ledamot sagt?]"
+    if not exact:
+        label = "Menade du någon av de här ledamöterna?"
     speaker = st.selectbox(
-        ":red[Vill du söka efter vad en specifik ledamot sagt?]",
+        label,
         options,
         index=preselected_option,
     )
@@ -415,12 +715,11 @@ def search_person(user_input, df_persons):
     if speaker == "Välj ett alternativ":
         st.stop()
     if speaker == no_option:
-        search_terms = define_search_terms(user_input) # Return "normal" query if no_alternative.
-        sql = create_sql_query(search_terms)
+        query = parse_query(user_input) # Return "normal" query if no_alternative.
     else:
         speaker = speaker.replace("Ja, sök på ", "")
-        sql = f"SELECT {select_columns} FROM {db_name} WHERE talare = '{speaker.title()}' LIMIT {return_limit}"
-    return sql
+        query = speaker_query(speaker.title())
+    return query
 
 
 # Title and explainer for streamlit
@@ -431,14 +730,32 @@ st.set_page_config(
 )
 st.title("Vad säger de i Riksdagen?")
 st.markdown(css, unsafe_allow_html=True)
+# Time the stages of this run.
+timer = StageTimer()
+
 # Get params from url.
-params = Params(st.experimental_get_query_params())
+url_params = st.experimental_get_query_params()
+params = Params(url_params)
 
-# The official colors of the parties
-parties = list(party_colors.keys())  # List of partycodes
+# Exports are written here, and served at app/static/exports.
+export_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "exports")
 
-# Max hits returned by db.
-return_limit = 10000
+# Speeches fetched from the DB per page, and max speeches kept for one search.
+page_size = 2000
+max_rows = 200000
+
+# Seconds to wait for the first page, and between reruns while the rest loads.
+first_page_timeout = 3
+refresh_interval = 1
+
+# Speeches per page in the view with long snippets, the first is the default.
+long_page_sizes = [20, 50, 100]
+
+# Shown for searches without a word to search for, e.g. only "-ord" or "år:2020".
+no_terms_message = "Skriv minst ett ord som ska finnas med i anförandena."
+
+# Max members to suggest for a search that looks like a name.
+max_suggestions = 10
 
 # Ask for word to search for.
 user_input = st.text_input(
@@ -452,51 +769,75 @@ params.q = user_input
 
 if len(user_input) > 2:
     try:
-        engine = sqlalchemy.create_engine(
-            f"postgresql://{user}:{pwd}@{ip}:5432/riksdagen"
-        )
-        user_input = user_input.replace("'", '"')
+        engine = get_engine()
+        writer = get_event_writer()
 
         # Put user input in session state (first run).
         if "user_input" not in st.session_state:
             st.session_state["user_input"] = user_input
-            user_input_to_db(user_input, engine)
+            user_input_to_db(user_input, writer)
         else:
             if st.session_state["user_input"] != user_input:
                 # Write user input to DB.
                 st.session_state["user_input"] = user_input
-                user_input_to_db(user_input, engine)
+                user_input_to_db(user_input, writer)
                 # Reser url parameters.
                 params.reset(q=user_input)
 
         params.update()
 
         # Check if user has searched for a specific politician.
-        if len(user_input.split(" ")) in [2, 3, 4]: #TODO Better way of telling if name?
-            df_persons = get_speakers() #TODO Get only unique values.
-            list_persons = df_persons["name"].tolist()
-            if user_input.lower() in list_persons:
-                sql = search_person(user_input, df_persons)
-                search_terms = "speaker"
+        if len(user_input.split()) <= 4:
+            speakers, exact = get_speaker_index(engine).find(user_input)
+            if speakers != []:
+                query = search_person(user_input, speakers[:max_suggestions], exact)
+
+        if "query" not in globals():
+            query = parse_query(user_input)
+        if not query.has_terms():
+            st.write(no_terms_message)
+            st.stop()
+        search_terms = query.snippet_terms()
 
-        if "sql" not in globals():
-            search_terms = define_search_terms(user_input)
-            sql = create_sql_query(search_terms)
+        # Start the search and the counts in the background, and stop the
+        # previous search of this session if no other session shows it.
+        version = current_data_version(engine)
+        if not switch_search(search_loaders(engine, query, version)):
+            st.experimental_rerun()
 
         # Fetch data from DB.
-        df = get_data(sql)
+        with timer.stage("fetch"):
+            df, loader = get_data(engine, query, version)
 
-        if len(df) == 0:  # If no hits.
-            st.write("Inga träffar. Försök igen!")
-            st.stop()
-        elif df.shape[0] == 10000:
-            st.write(limit_warning)
-            st.stop()
-
-        party_talks = pd.DataFrame(df["Parti"].value_counts())
-        party_labels = party_talks.index.to_list()  # List with active parties.
-        if type(party_labels) == "list":
-            party_labels.sort()
+        if len(df) == 0:
+            if loader.done:  # If no hits.
+                st.write("Inga träffar. Försök igen!")
+                st.stop()
+            with st.spinner("Söker..."):
+                time.sleep(refresh_interval)
+            st.experimental_rerun()
+
+        # Counts for all hits, used for the filter options and the charts.
+        with timer.stage("counts"):
+            counts = get_counts(engine, query, version, loader, df)
+        if counts is None:
+            with st.spinner("Räknar träffar..."):
+                time.sleep(refresh_interval)
+            st.experimental_rerun()
+
+        if not loader.done:
+            st.caption(f"Hämtar fler träffar ({loader.rows} hittills)...")
+        elif loader.truncated:
+            st.write(limit_warning.format(max_rows=f"{max_rows:,}".replace(",", " ")))
+
+        party_labels = party_counts(counts).index.to_list()  # List with active parties.
+
+        # Values to keep per column of df, applied with the facet index.
+        # The loader tells results of the same version apart, e.g. after a reload.
+        handle = (query, version, id(loader), len(df))
+        with timer.stage("facets"):
+            facets = get_facets(df, handle, done=loader.done)
+        selections = {}
 
         if search_terms != "speaker":
             # Let the user select parties to be included.
@@ -512,14 +853,15 @@ if len(user_input) > 2:
                     default=party_labels,
                 )
             if params.parties != []:
-                df = df.loc[df["Parti"].isin(params.parties)]
-                if len(df) == 0:
+                selections["Parti"] = params.parties
+                counts = counts.loc[counts["Parti"].isin(params.parties)]
+                if not facets.mask(selections).any():
                     st.stop()
 
         # Let the user select type of debate.
         container_debate = st.container()
         with container_debate:
-            debates = df["debatetype"].unique().tolist()
+            debates = counts["debatetype"].unique().tolist()
             debates.sort()
 
             style = build_style_debate_types(debates)
@@ -530,36 +872,35 @@ if len(user_input) > 2:
                 default=debates,
             )
         if params.debates != []:
-            df = df.loc[df["debatetype"].isin(params.debates)]
-            if len(df) == 0:
+            selections["debatetype"] = params.debates
+            counts = counts.loc[counts["debatetype"].isin(params.debates)]
+            if not facets.mask(selections).any():
                 st.stop()
         params.update()
 
         # Let the user select a range of years.
-        from_year = int(params.from_year)
-        to_year = int(params.to_year)
-        df_ = df.loc[
-            df["År"].isin([i for i in range(from_year, to_year)])
-        ]  # TODO Ugly.
-        years = list(range(int(df["År"].min()), int(df["År"].max()) + 1))
+        years = list(range(int(counts["År"].min()), int(counts["År"].max()) + 1))
         if len(years) > 1:
             params.from_year, params.to_year = st.select_slider(
                 "Välj tidsspann",
-                list(range(int(df["År"].min()), int(df["År"].max()) + 1)),
+                years,
                 value=(years[0], years[-1]),
             )
-            df = df.loc[
-                df["År"].isin(list(range(params.from_year, params.to_year + 1)))
-            ]
+            selections["År"] = range(params.from_year, params.to_year + 1)
+            counts = counts.loc[counts["År"].between(params.from_year, params.to_year)]
         elif len(years) == 1:
-            df = df.loc[df["År"] == years[0]]
+            selections["År"] = years
 
         params.update()
 
         if search_terms != "speaker":
             # Let the user select talkers.
-            options = options_persons(df)
-            style_mps = build_style_mps(options)  # Make the options the right colors.
+            # Speeches per person given the other filters, colored by party.
+            with timer.stage("person options"):
+                options, style_mps = person_options_stage(
+                    facets, handle, freeze(selections), done=loader.done
+                )
+            options = list(options)
             st.markdown(style_mps, unsafe_allow_html=True)
             col1_persons, col2_persons = st.columns([5, 2])
             # Sort alternatives in column to the right.
@@ -584,193 +925,128 @@ if len(user_input) > 2:
                         options=options,
                         default=[],
                     )
-            # Filter df.
             if params.persons != []:
                 params.persons = [i[: i.find(")") + 1] for i in params.persons]
-                df = df.loc[df["Talare"].isin(params.persons)]
+                selections["Talare"] = params.persons
         params.update()
 
-        # Give df an index.
-        df.index = range(1, df.shape[0] + 1)
+        # Filter df on all selections at once.
+        with timer.stage("filter"):
+            df = filter_stage(df, facets, handle, freeze(selections), done=loader.done)
+        if search_terms != "speaker" and params.persons != []:
+            # The counts from the DB are not per person, count the fetched speeches.
+            counts = count_speeches(df)
 
         ##* Start render. *##
 
         st.markdown("---")  # Draw line after filtering.
-        st.write(f"**Träffar: {df.shape[0]}**")
+        st.write(f"**Träffar: {counts['Antal'].sum()}**")
 
         ## Short snippets,
         expand_short = st.expander("Visa tabell med korta utdrag", expanded=False)
         with expand_short:
-            st.dataframe(df[["Utdrag", "Parti"]].style.applymap(highlight_cells))
+            with timer.stage("table"):
+                table, css = table_stage(df, handle, freeze(selections), done=loader.done)
+                st.dataframe(table.style.apply(lambda _: css, axis=None))
 
         ## Long snippets.
         expand_long = st.expander(
-            "Visa tabell med längre utdrag (kan ta lång tid om många träffar).",
+            "Visa längre utdrag",
             expanded=False,
         )
         with expand_long:
-            n = 0
-
-            # st.markdown(style, unsafe_allow_html=True)
-            # df["date"] = df["Datum"].apply(lambda x: datestring_to_date(x))
-            df.sort_values(["Datum", "dok_id", "number"], axis=0, inplace=True)
-            new_debate = True
-            dok_id = None
-
-            for row in df.iterrows():
-                n += 1
-                row = row[1]
-
-                # Find out if it's a new debate.
-                if row["dok_id"] == dok_id:
-                    new_debate = False
-                else:
-                    new_debate = True
-                dok_id = row["dok_id"]
-
-                # Remove title for ministers. #TODO Remove "statsråd" etc.
-                if "minister" in row["Talare"]:
-                    row["Talare"] = row["Talare"][
-                        row["Talare"].find("minister") + len("minister") :
-                    ]
-
-                # Write to table.
-
-                if new_debate:
-                    # st.write("---", unsafe_allow_html=True)
-                    st.markdown(
-                        f""" <span style="font-weight: bold;">{row['Datum']}</span> """,
-                        unsafe_allow_html=True,
-                    )
-                col1, col2, col3 = st.columns([2, 7, 2])
-                with col1:
-                    st.write(f"{row['Talare']}", unsafe_allow_html=True)
-                with col2:
-                    snippet = (
-                        row["Utdrag_long"]
-                        .replace(":", "\:")
-                        .replace("<p>", "")
-                        .replace("</p>", "")
-                    )
-                    st.markdown(
-                        f""" <span style="background-color:{party_colors_lighten[row['Parti']]}; color:black;">{snippet}</span> """,
-                        unsafe_allow_html=True,
-                    )
-                with col3:
-                    full_text = st.button("Fulltext", key=n)
-                    if full_text:
-                        with st.sidebar:
-                            data_person = requests.get(
-                                f'https://data.riksdagen.se/personlista/?iid={row["intressent_id"]}&utformat=json'
-                            ).json()["personlista"]["person"]  
-                            name_person = data_person["sorteringsnamn"].lower().replace(",", "-").replace(' ', '-')
-                            url_person = f'https://www.riksdagen.se/sv/ledamoter-partier/ledamot/{name_person}_{row["intressent_id"]}'
-                            st.markdown(
-                                f""" <span class="{row['Parti']}" style="font-weight: bold;">[ {row['Talare']} ]({url_person})</span> """,
-                                unsafe_allow_html=True,
-                            )
-                            st.markdown(
-                                f""" <span style="font-style: italic;">{row["Datum"]} - {row['debatetype']}</span> """,
-                                unsafe_allow_html=True,
-                            )
-                            st.write(
-                                row["Text"].replace(":", "\:"), unsafe_allow_html=True
-                            )
-                            if row["url_session"] != "https://riksdagen.se":
-                                st.markdown(
-                                    f'📺 [Se debatten i Riksdagen]({row["url_session"]})'
-                                )
-                            if row["url_audio"] != "":
-                                h = str(int(int(row["start"]) / 3600))
-                                m = str(int((int(row["start"]) % 3600) / 60))
-                                if len(m) == 1:
-                                    m = "0" + m
-                                s = str(int((int(row["start"]) % 3600) % 60))
-                                if len(s) == 1:
-                                    s = "0" + s
-                                start_time = ""
-                                if h != "0":
-                                    start_time += f"{h}:"
-                                start_time += f"{m}:{s}"
-                                st.markdown(
-                                    f'💬 [Ladda ner ljudet]({row["url_audio"]}) (Anförandet börjar vid {start_time})'
-                                )
-
-                            url_protocol = protocol_url(dok_id)
-                            st.markdown(f"📝 [Ladda ner protokollet]({url_protocol})")
-
-        # Download all data in df.
-        st.download_button(
-            "Ladda ner datan som CSV",
-            data=df.to_csv(
-                index=False,
-                sep=";",
-                columns=[
-                    "talk_id",
-                    "Anförande",
-                    "Parti",
-                    "Talare",
-                    "Datum",
-                    "url_session",
-                ],
-            ).encode("utf-8"),
-            file_name=f"{user_input}.csv",
-            mime="text/csv",
-        )
-
-        # Remove talks from same party within the same session to make the
-        # statistics more representative.
-        df_ = df[["talk_id", "Parti", "År"]].drop_duplicates()
-
-        if search_terms != "speaker":
-            ## Make pie chart.
-            party_talks = pd.DataFrame(df_["Parti"].value_counts())
-            party_labels = party_talks.index.to_list()
-            fig, ax1 = plt.subplots()
-            total = party_talks["Parti"].sum()
-            mentions = party_talks["Parti"]
-            ax1.pie(
-                mentions,
-                labels=party_labels,
-                autopct=lambda p: "{:.0f}".format(p * total / 100),
-                colors=[party_colors[key] for key in party_labels],
-                startangle=90,
+            col1, col2 = st.columns([2, 5])
+            with col2:
+                rows_per_page = st.selectbox(
+                    "Anföranden per sida", long_page_sizes, index=0
+                )
+            n_pages = max(-(-len(df) // rows_per_page), 1)
+            # Keep the page while more hits load or the filters change, start over on a new search.
+            page_key = f"long_page_{hash((query, rows_per_page))}"
+            if st.session_state.get(page_key, 1) > n_pages:
+                st.session_state[page_key] = n_pages
+            with col1:
+                page_number = st.number_input(
+                    f"Sida (av {n_pages})",
+                    min_value=1,
+                    max_value=n_pages,
+                    key=page_key,
+                )
+            first = (page_number - 1) * rows_per_page
+            page = df.iloc[first : first + rows_per_page]
+
+            # Have the protocols ready when someone clicks "Fulltext". Once per
+            # page shown, not on every rerun while more hits load.
+            prefetched = (query, first, rows_per_page)
+            if st.session_state.get("prefetched") != prefetched:
+                st.session_state["prefetched"] = prefetched
+                get_riksdagen_client().prefetch(page["dok_id"])
+
+            with timer.stage("long snippets"):
+                headings, rows = long_snippet_rows(page, first)
+                # The page is one block, only the buttons are elements of their own.
+                st.markdown("".join(headings + rows), unsafe_allow_html=True)
+                st.caption("Fulltext för anförande nummer:")
+                buttons = st.columns(10)
+                clicked = None
+                for n, (index, talk_id) in enumerate(page["talk_id"].items()):
+                    with buttons[n % 10]:
+                        if st.button(str(first + n + 1), key=f"full_text_{talk_id}"):
+                            clicked = index
+                if clicked is not None:
+                    with st.sidebar:
+                        show_full_text(page.loc[clicked], engine, search_terms)
+
+        # Export all speeches matching the search and the filters, also those
+        # over max_rows, with the full texts. Only made when asked for.
+        col1, col2 = st.columns([1, 3])
+        with col1:
+            file_format = st.selectbox("Format", export_formats)
+        with col2:
+            st.write("")  # Align the button with the select box.
+            prepare_download = st.button("Förbered nedladdning")
+        if prepare_download:
+            with timer.stage("export"), st.spinner("Hämtar alla anföranden..."):
+                url = export_stage(engine, query, version, freeze(selections), file_format)
+            st.markdown(
+                f'<a href="{url}" download="{html.escape(user_input)}.{file_format}">Ladda ner datan som {file_format.upper()}</a>',
+                unsafe_allow_html=True,
             )
 
-        # Make bars per year.
-        years = set(df["År"].tolist())
-
-        df_years = pd.DataFrame(columns=["Parti", "År"])
-        for i in df.groupby("År"):
-            dff = pd.DataFrame(data=i[1]["Parti"].value_counts())
-            dff["År"] = str(i[0])
-            df_years = pd.concat([df_years, dff])
-        df_years["party_code"] = df_years.index
-        df_years["color"] = df_years["party_code"].apply(lambda x: party_colors[x])
-        df_years.rename(columns={"Parti": "Antal", "party_code": "Parti"}, inplace=True)
-
-        chart = (
-            alt.Chart(df_years)
-            .mark_bar()
-            .encode(
-                x="År",
-                y="Antal",
-                color=alt.Color("color", scale=None),
-                tooltip=["Parti", "Antal"],
+        # Raw counts, or hits relative to all speeches if the statistics are built.
+        stats = get_corpus_stats(engine)
+        normalized = False
+        if stats is not None:
+            normalized = (
+                st.radio(
+                    "Visa per år",
+                    ["Antal anföranden", "Per 1 000 anföranden"],
+                    horizontal=True,
+                )
+                == "Per 1 000 anföranden"
+            )
+        with timer.stage("charts"):
+            pie, chart = chart_stage(
+                counts,
+                stats,
+                freeze(selections),
+                search_terms == "speaker",
+                normalized,
+                done=loader.done,
             )
-        )
-
-        if search_terms == "speaker":
-            st.altair_chart(chart, use_container_width=True)
 
-        else:
-            # Put the charts in a table.
-            fig1, fig2 = st.columns(2)
-            with fig1:
-                st.pyplot(fig)
-            with fig2:
+        with timer.stage("render charts"):
+            if search_terms == "speaker":
                 st.altair_chart(chart, use_container_width=True)
 
+            else:
+                # Put the charts in a table.
+                fig1, fig2 = st.columns(2)
+                with fig1:
+                    st.image(pie, use_column_width=True)
+                with fig2:
+                    st.altair_chart(chart, use_container_width=True)
+
         # Get feedback.
         st.empty()
         feedback_container = st.empty()
@@ -781,13 +1057,21 @@ if len(user_input) > 2:
             )
             send = st.button("Skicka")
             if len(feedback) > 2 and send:
-                df = pd.DataFrame(
-                    {"feedback": feedback, "time": datetime.date(datetime.now())},
-                    index=[0],
+                writer.log(
+                    "feedback", feedback=feedback, time=datetime.date(datetime.now())
                 )
-                df.to_sql("feedback", engine, if_exists="append", index=False)
                 feedback_container.write("*Tack!*")
         params.update()
+
+        # Log the timings once per search, when all speeches are loaded.
+        if loader.done and st.session_state.get("timed_search") != (user_input, query):
+            st.session_state["timed_search"] = (user_input, query)
+            log_search_timing(user_input, st.session_state["loaders"], timer, writer)
+
+        # Show more results when the next pages have loaded.
+        if not loader.done:
+            time.sleep(refresh_interval)
+            st.experimental_rerun()
         # st.markdown("##")
 
     except Exception as e:
@@ -797,11 +1081,25 @@ if len(user_input) > 2:
             pass
         else:
             print(traceback.format_exc())
-            error2db(traceback.format_exc(), user_input, engine)
+            try:
+                error2db(traceback.format_exc(), user_input, get_event_writer())
+            except Exception:  # E.g. the database is down, the error is printed above.
+                pass
             st.markdown(
                 ":red[Något har blivit fel, jag försöker lösa det så snart som möjligt. Testa gärna att söka på något annat.]"
             )
 
+if "debug" in url_params:  # Show how the connection pool is used.
+    st.sidebar.json(pool_status(get_engine()))
+    st.sidebar.json(get_event_writer().status())
+    if get_result_cache() is not None:
+        st.sidebar.json(get_result_cache().status())
+    if "df" in globals():  # Memory used by the result shown.
+        st.sidebar.json(memory_report(df))
+    st.sidebar.json(timer.timings)
+    if "loader" in globals():  # Time spent loading the result, in the background.
+        st.sidebar.json({"rows": loader.rows, "bytes": loader.bytes, **loader.timer.timings})
+
 expand_explainer = st.expander("*Vad är det här? Var kommer datan ifrån? Hur gör jag?*")
 with expand_explainer:
     st.markdown(explainer)
@@ -0,0 +1,53 @@
+""" Benchmark of the snippet engine against the original make_snippet.
+
+Run from the repository root with `python benchmarks/bench_snippets.py`.
+"""
+
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from snippets import make_snippet, make_snippets  # noqa: E402
+
+words = """och att det som en på är av för med till den har de inte om ett men
+    vi jag energi energikris energikrisen kärnkraft baskraft vindkraft elpris
+    regeringen riksdagen förslag fossilfria energikällor klimat skatt""".split()
+
+
+def make_texts(n, length=400, seed=1):
+    """Make n random speeches of about length words each."""
+    rng = random.Random(seed)
+    return [
+        "Fru talman! " + " ".join(rng.choice(words) for _ in range(rng.randint(length // 2, length * 2)))
+        for _ in range(n)
+    ]
+
+
+def run(name, function, repeat=3):
+    best = min(timing(function) for _ in range(repeat))
+    print(f"{name:<45} {best * 1000:8.1f} ms")
+    return best
+
+
+def timing(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    texts = make_texts(2000)
+    for search_terms in [["energikris*"], ["kärnkraft", "*kraft", "fossilfria energikällor"]]:
+        print(f"{len(texts)} speeches, search terms {search_terms}")
+        old = run(
+            "make_snippet, short and long per row",
+            lambda: [
+                (make_snippet(i, search_terms), make_snippet(i, search_terms, long=True))
+                for i in texts
+            ],
+        )
+        new = run("make_snippets, batch", lambda: make_snippets(texts, search_terms))
+        print(f"{'speedup':<45} {old / new:8.1f} x\n")
@@ -0,0 +1,196 @@
+""" Benchmarks of the steps of a search, with stored baselines.
+
+A synthetic corpus (see corpus.py) is loaded into a SQLite file, which
+stands in for the database, and every step from parsing the search box to
+the data for the chart of years is timed on it, with the functions the app
+runs (see stages.py):
+
+    python benchmarks/bench_suite.py            # Run and print the timings.
+    python benchmarks/bench_suite.py --save     # Store them as the baselines.
+    python benchmarks/bench_suite.py --check    # Fail if a step got slower.
+
+--check exits with status 1 if a benchmark takes more than --threshold
+times its baseline, or if the FTS backend is slower than LIKE scans on
+rare words, which is what its index is for. On words in most speeches the
+FTS backend is expected to be slower, the list of matches costs more than
+it saves, and --check only warns about it. Baselines depend on the machine,
+save them on the machine that runs the checks.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from corpus import make_database, make_vocabulary  # noqa: E402
+from corpus_stats import read_stats  # noqa: E402
+from dimensions import Dimensions  # noqa: E402
+from facets import FacetIndex  # noqa: E402
+from fetch import keyset_pages  # noqa: E402
+from query import parse_query  # noqa: E402
+from result_schema import concat  # noqa: E402
+from search_backends import LikeBackend, SQLiteBackend  # noqa: E402
+from snippets import make_snippet, make_snippets  # noqa: E402
+from stages import count_speeches, filter_rows, prepare_data, year_bars, year_lines  # noqa: E402
+
+baselines_path = Path(__file__).resolve().parent / "baselines.json"
+searches = ["energi", "*kraft", "skola -vård", "klimat or miljö år:2000-2010", "fru talman"]
+# Ranks in the vocabulary of corpus.py of words in few speeches.
+rare_ranks = [1000, 2000, 3000, 4000]
+# Rows per search the snippet benchmarks are run on.
+snippet_rows = 500
+# Pairs of (benchmark, benchmark it must not be slower than) for --check.
+faster_than = [("search fts (rare words)", "search like (rare words)")]
+# Pairs where --check only warns if the first is slower.
+compared = [("search fts", "search like")]
+
+
+def fetch(engine, backend, query, page_size=1000):
+    """Fetch all pages of a search."""
+    return concat(list(keyset_pages(engine, backend, query, page_size)))
+
+
+def year_charts(df, stats, selections=()):
+    """The data for both charts of years, as chart_stage in app.py makes it."""
+    counts = count_speeches(df)
+    return year_bars(counts), year_lines(counts, stats, selections)
+
+
+def make_benchmarks(engine, seed):
+    """Return name -> function to time, with the inputs they need made beforehand."""
+    queries = [parse_query(i) for i in searches]
+    # The vocabulary is the first thing corpus.py makes with its random numbers.
+    vocabulary = make_vocabulary(5000, random.Random(seed))
+    rare_queries = [parse_query(vocabulary[i]) for i in rare_ranks]
+    like, fts = LikeBackend(dialect="sqlite"), SQLiteBackend()
+    with engine.connect() as conn:
+        dimensions = Dimensions.load(conn)
+    stats = dimensions.decode(read_stats(engine)).astype({"Parti": str, "debatetype": str})
+    pages = {i: fetch(engine, fts, i) for i in queries}
+    excerpts = {i: pages[i]["excerpt"][:snippet_rows] for i in queries}
+    results = {i: prepare_data(pages[i], dimensions, i.snippet_terms()) for i in queries}
+    largest = max(results.values(), key=len)
+    selections = {
+        "Parti": ["S", "M", "SD", "V"],
+        "debatetype": ["debatt", "interpellationsdebatt"],
+        "År": list(range(1995, 2020)),
+    }
+
+    def compile_pages():
+        for _ in range(50):
+            for backend in (like, fts):
+                backend.clear_plans()
+                for query in queries:
+                    backend.compile_page(query, 1000)
+                    backend.compile_aggregate(query)
+
+    def filter_chain():
+        facets = FacetIndex(largest)
+        for _ in range(20):  # Reruns with other filters on the same result.
+            filter_rows(largest, facets, selections)
+            for column in ("Parti", "debatetype", "Talare"):
+                facets.counts(column, selections)
+
+    def one_row_snippets():
+        # Short and long, like make_snippets makes them.
+        for query in queries:
+            for text in excerpts[query]:
+                make_snippet(text, query.snippet_terms())
+                make_snippet(text, query.snippet_terms(), long=True)
+
+    frozen = [(k, tuple(v)) for k, v in selections.items()]
+    return {
+        "parse_query": lambda: [parse_query(i) for i in searches * 200],
+        "compile_page": compile_pages,
+        "search like": lambda: [fetch(engine, like, i) for i in queries],
+        "search fts": lambda: [fetch(engine, fts, i) for i in queries],
+        "search like (rare words)": lambda: [fetch(engine, like, i) for i in rare_queries],
+        "search fts (rare words)": lambda: [fetch(engine, fts, i) for i in rare_queries],
+        f"make_snippet ({snippet_rows} rows)": one_row_snippets,
+        f"make_snippets ({snippet_rows} rows)": lambda: [
+            make_snippets(excerpts[i], i.snippet_terms()) for i in queries
+        ],
+        "prepare": lambda: [prepare_data(pages[i], dimensions, i.snippet_terms()) for i in queries],
+        "filter chain": filter_chain,
+        "year charts": lambda: [year_charts(i, stats, frozen) for i in results.values()],
+    }
+
+
+def timing(function, repeat):
+    """Return the best time of repeat runs, in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return round(min(times) * 1000, 2)
+
+
+def run(speeches, seed, repeat):
+    """Make the corpus and return name -> milliseconds for every benchmark."""
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        engine = make_database(os.path.join(directory, "corpus.db"), speeches, seed)
+        print(f"{speeches} speeches made in {time.perf_counter() - start:.1f} s")
+        results = {}
+        for name, function in make_benchmarks(engine, seed).items():
+            results[name] = timing(function, repeat)
+            print(f"{name:<30} {results[name]:10.2f} ms")
+        engine.dispose()
+    return results
+
+
+def check(results, baselines, threshold):
+    """Return the names of the benchmarks slower than threshold times their baselines, or than those in faster_than.
+
+    The pairs in compared are only warned about.
+    """
+    regressions = []
+    for name, ms in results.items():
+        baseline = baselines.get(name)
+        if baseline is not None and ms > baseline * threshold:
+            print(f"{name} regressed: {ms:.2f} ms, baseline {baseline:.2f} ms")
+            regressions.append(name)
+    for name, other in faster_than:
+        if results[name] > results[other]:
+            print(f"{name} is slower than {other}: {results[name]:.2f} ms, {results[other]:.2f} ms")
+            regressions.append(name)
+    for name, other in compared:
+        if results[name] > results[other]:
+            print(f"Warning: {name} is {results[name] / results[other]:.2f} times slower than {other}.")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the steps of a search.")
+    parser.add_argument("--speeches", type=int, default=5000, help="Speeches in the corpus.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per benchmark, the best is kept.")
+    parser.add_argument("--save", action="store_true", help="Store the timings as baselines.")
+    parser.add_argument("--check", action="store_true", help="Fail if slower than the baselines.")
+    parser.add_argument("--threshold", type=float, default=1.3, help="Allowed slowdown for --check.")
+    args = parser.parse_args()
+
+    results = run(args.speeches, args.seed, args.repeat)
+    for name, other in faster_than + compared:
+        print(f"{name} / {other}: {results[name] / results[other]:.2f}")
+    corpus = {"speeches": args.speeches, "seed": args.seed}
+    if args.save:
+        with open(baselines_path, "w", encoding="utf-8") as f:
+            json.dump({"corpus": corpus, "results": results}, f, indent=2)
+            f.write("\n")
+        print(f"Baselines saved to {baselines_path}.")
+    if args.check:
+        with open(baselines_path, encoding="utf-8") as f:
+            baselines = json.load(f)
+        if baselines["corpus"] != corpus:
+            sys.exit(f"The baselines are for another corpus, {baselines['corpus']}.")
+        if check(results, baselines["results"], args.threshold):
+            sys.exit(1)
+        print(f"No benchmark is more than {args.threshold} times slower than its baseline.")
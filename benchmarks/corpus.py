@@ -0,0 +1,182 @@
+""" Seeded generator of a synthetic corpus of speeches, for benchmarks and tests.
+
+The speeches look like those in the archives of data.riksdagen.se: debates of
+a few to some tens of speeches, lengths with a long tail, the parties of each
+period with their old codes (FP, KDS), debate types including missing ones,
+and words drawn from a Zipf distribution with the usual political topics.
+The same seed always gives the same corpus.
+
+make_database loads a corpus into a SQLite file, with the indexes of the
+"sqlite" backend and corpus_stats, as a stand-in for the real database.
+"""
+
+import json
+import math
+import random
+import sys
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db  # noqa: E402
+from config import db_name  # noqa: E402
+from corpus_stats import refresh_stats  # noqa: E402
+from dimensions import Dimensions, create_tables  # noqa: E402
+from ingest import create_table, insert_rows, parse_speech  # noqa: E402
+from search_backends import SQLiteBackend  # noqa: E402
+
+years = range(1993, 2024)
+# Party code -> (first year, last year, share of the speeches).
+parties = {
+    "S": (1993, 2023, 30),
+    "M": (1993, 2023, 20),
+    "C": (1993, 2023, 7),
+    "FP": (1993, 2014, 7),
+    "L": (2015, 2023, 6),
+    "KDS": (1993, 1996, 6),
+    "KD": (1997, 2023, 6),
+    "V": (1993, 2023, 7),
+    "MP": (1993, 2023, 6),
+    "NYD": (1993, 1994, 3),
+    "SD": (2010, 2023, 12),
+    "": (1993, 2023, 3),  # The speaker of the house.
+}
+debate_types = {
+    "debatt": 45,
+    "interpellationsdebatt": 25,
+    "frågestund": 10,
+    "budgetdebatt": 8,
+    "aktuell debatt": 5,
+    "": 4,
+    "-": 3,
+}
+first_names = "Anna Erik Maria Lars Karin Per Eva Johan Lena Anders Sara Magnus Ulla Jonas Ebba".split()
+last_names = "Andersson Johansson Karlsson Nilsson Eriksson Larsson Olsson Persson Svensson Lindberg".split()
+topics = """skola vård energi kärnkraft vindkraft elpris klimat migration brottslighet
+    polis försvar bistånd budget skatt pension bostäder jobb arbetslöshet järnväg
+    landsbygd sjukvård äldreomsorg integration miljö""".split()
+common = """och att det som en på är av för med till den har de inte om ett men
+    vi jag fru talman herr regeringen riksdagen förslag ministern frågan""".split()
+
+
+def make_vocabulary(size, rng):
+    """Return size words, the common ones and topics first, the rest made of syllables."""
+    syllables = "ba be bo da de di fa fö ga gi ka ko la li ma mo na ni ra ri sa so ta ti va vi".split()
+    words = list(dict.fromkeys(common + topics))
+    seen = set(words)
+    while len(words) < size:
+        word = "".join(rng.choice(syllables) for _ in range(rng.randint(2, 5)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def make_speakers(rng, per_party=40):
+    """Return party -> list of names of its members."""
+    speakers = {}
+    for party in parties:
+        if party == "":
+            speakers[party] = ["Talmannen", "Förste vice talmannen"]
+            continue
+        names = {f"{rng.choice(first_names)} {rng.choice(last_names)}" for _ in range(per_party)}
+        speakers[party] = [f"{i} ({party})" for i in sorted(names)]
+    return speakers
+
+
+def make_speeches(n, seed=1, vocabulary_size=5000):
+    """Yield n speeches as dicts in the JSON format of the archives.
+
+    Args:
+        n (int): Number of speeches.
+        seed (int): Seed of the random numbers.
+        vocabulary_size (int): Number of different words.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rng)
+    cum_weights = []
+    total = 0
+    for rank in range(1, len(vocabulary) + 1):
+        total += 1 / rank
+        cum_weights.append(total)
+    speakers = make_speakers(rng)
+    made = 0
+    debate = 0
+    while made < n:
+        debate += 1
+        year = rng.choice(years)
+        date = f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        debate_type = rng.choices(list(debate_types), list(debate_types.values()))[0]
+        active = [k for k, (first, last, _) in parties.items() if first <= year <= last]
+        weights = [parties[i][2] for i in active]
+        for number in range(1, min(rng.randint(3, 40), n - made) + 1):
+            party = rng.choices(active, weights)[0]
+            # Lengths in words have a long tail, median about 350.
+            length = min(max(int(rng.lognormvariate(math.log(350), 0.8)), 20), 6000)
+            words = rng.choices(vocabulary, cum_weights=cum_weights, k=length)
+            paragraphs = [" ".join(words[i : i + 80]) for i in range(0, length, 80)]
+            text = "".join(f"<p>{i.capitalize()}.</p>" for i in paragraphs)
+            yield {
+                "anforande": {
+                    "anforande_id": f"{seed}-{debate}-{number}",
+                    "dok_id": f"H{year % 100:02d}{debate:05d}",
+                    "dok_datum": f"{date} 00:00:00",
+                    "anforande_nummer": str(number),
+                    "kammaraktivitet": debate_type,
+                    "talare": rng.choice(speakers[party]),
+                    "parti": party,
+                    "intressent_id": str(rng.randint(100000, 999999)),
+                    "anforandetext": f"<p>Fru talman!</p>{text}",
+                }
+            }
+            made += 1
+
+
+def write_archive(path, n, seed=1):
+    """Write n speeches to a zip archive like those of data.riksdagen.se, e.g. for ingest.py."""
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for speech in make_speeches(n, seed):
+            name = f"{speech['anforande']['anforande_id']}.json"
+            archive.writestr(name, json.dumps(speech, ensure_ascii=False))
+
+
+def make_database(path, n, seed=1, table=db_name, batch_size=5000):
+    """Load n speeches into a new SQLite file, with the sqlite backend's indexes and corpus_stats.
+
+    Returns:
+        Engine: Engine for the file.
+    """
+    engine = db.create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {table}")
+        conn.exec_driver_sql(create_table.format(table=table))
+        for statement in create_tables:
+            conn.exec_driver_sql(statement)
+    rows = []
+    for speech in make_speeches(n, seed):
+        rows.append(parse_speech(speech))
+        if len(rows) == batch_size:
+            with engine.begin() as conn:
+                Dimensions.load(conn).encode(conn, rows)
+                insert_rows(conn, table, rows)
+            rows = []
+    with engine.begin() as conn:
+        Dimensions.load(conn).encode(conn, rows)
+        insert_rows(conn, table, rows)
+        for statement in SQLiteBackend(table).migrations():
+            conn.exec_driver_sql(statement)
+    refresh_stats(engine, table)
+    return engine
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        sys.exit("Usage: python benchmarks/corpus.py corpus.db|corpus.json.zip number_of_speeches [seed]")
+    path, n = sys.argv[1], int(sys.argv[2])
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    if path.endswith(".zip"):
+        write_archive(path, n, seed)
+    else:
+        make_database(path, n, seed)
+    print(f"{n} speeches written to {path}.")
@@ -3,3 +3,44 @@ pwd_postgres = PWD
 ip_server = IP_ADRESS
 db_name = DB_NAME
 db_user = DB_USER
+
+# Search backend, one of "like", "postgres", "sqlite" and "index" (see search_backends.py).
+search_backend = "like"
+
+# Path to a search index built with search_index.py, used by the "index" backend.
+index_path = None
+
+# Path to a SQLite copy of the database, used instead of Postgres if set.
+sqlite_path = None
+
+# Connection pool for the database (see db.py).
+pool_size = 5
+max_overflow = 10
+pool_timeout = 30  # Seconds to wait for a free connection.
+pool_recycle = 1800  # Seconds before a connection is replaced.
+statement_timeout = 30000  # Milliseconds before Postgres cancels a statement.
+
+# Logging of searches, errors and feedback (see event_log.py).
+log_queue_size = 1000  # Events waiting to be written, more are dropped.
+log_batch_size = 100
+log_flush_interval = 2  # Seconds between writes.
+
+# The open data API of the Riksdag (see riksdagen.py).
+riksdagen_url = "https://data.riksdagen.se"
+riksdagen_cache_dir = ".riksdagen_cache"  # None for no cache.
+riksdagen_cache_ttl = 7 * 24 * 3600  # Seconds.
+riksdagen_timeout = 10  # Seconds.
+
+# Cache of search results as Parquet files (see result_cache.py), None for no cache.
+result_cache_dir = ".result_cache"
+result_cache_max_entries = 500
+result_cache_max_bytes = 2 * 1024**3
+result_cache_ttl = 24 * 3600  # Seconds.
+data_version_ttl = 60  # Seconds between checks in the app for speeches added by sync.py.
+
+# Exports of search results (see export.py).
+export_chunksize = 5000  # Speeches read from the DB at a time.
+export_max_age = 3600  # Seconds an export file is kept.
+
+# Timing of searches and the slow query log (see telemetry.py).
+slow_search_ms = 5000  # Statements of a search slower than this get their query plan logged, None for never.
@@ -0,0 +1,89 @@
+""" Statistics of the whole corpus, for charts of hits relative to all speeches.
+
+The table corpus_stats has the number of speeches and words per party, year
+and debate type. It is small and read once by the app, so charts of hits per
+1 000 speeches cost nothing extra when searching.
+
+Run `python corpus_stats.py` to build or refresh it after data is loaded.
+"""
+
+import pandas as pd
+import sqlalchemy
+
+import db
+from config import db_name
+
+stats_table = "corpus_stats"
+
+
+def stats_select(table, where="1 = 1"):
+    """Return the SQL counting speeches and words per party, year and debate type."""
+    # Words are counted as blanks + 1, the same way search_index.py tokenizes.
+    return f"""SELECT party_id, year, debate_type_id, COUNT(DISTINCT talk_id) AS speeches,
+        SUM(length(text_lower) - length(replace(text_lower, ' ', '')) + 1) AS tokens
+        FROM {table} WHERE {where} GROUP BY party_id, year, debate_type_id"""
+
+
+def refresh_stats(engine, table=db_name):
+    """Count speeches and words per party, year and debate type into corpus_stats."""
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {stats_table}")
+        conn.exec_driver_sql(f"CREATE TABLE {stats_table} AS {stats_select(table)}")
+
+
+def update_stats(engine, years, table=db_name):
+    """Recount the statistics of some years in place, after speeches of those years changed."""
+    if not sqlalchemy.inspect(engine).has_table(stats_table):
+        refresh_stats(engine, table)
+        return
+    # Speeches without a date have no year, and are not in the statistics.
+    years = sorted({i for i in years if i is not None})
+    if years == []:
+        return
+    years = sqlalchemy.bindparam("years", years, expanding=True)
+    with engine.begin() as conn:
+        conn.execute(
+            sqlalchemy.text(f"DELETE FROM {stats_table} WHERE year IN :years").bindparams(years)
+        )
+        conn.execute(
+            sqlalchemy.text(
+                f"INSERT INTO {stats_table} {stats_select(table, 'year IN :years')}"
+            ).bindparams(years)
+        )
+
+
+def read_stats(engine):
+    """Return corpus_stats with the columns Parti, År, debatetype, speeches and tokens.
+
+    Parti and debatetype are keys, decode them with dimensions.Dimensions.
+    """
+    sql = f"""SELECT party_id AS "Parti", year AS "År", debate_type_id AS debatetype, speeches, tokens
+        FROM {stats_table}"""
+    with engine.connect() as conn:
+        return pd.read_sql(sqlalchemy.text(sql), conn)
+
+
+def per_thousand(counts, stats):
+    """Return hits per 1 000 speeches per year and party.
+
+    Args:
+        counts (DataFrame): Hits, with the columns Parti, År, debatetype and Antal.
+        stats (DataFrame): From read_stats, limited to the same parties and
+            debate types as the counts.
+
+    Returns:
+        DataFrame: Columns År, Parti, Antal and Per 1000.
+    """
+    hits = counts.pivot_table(index="År", columns="Parti", values="Antal", aggfunc="sum")
+    totals = stats.pivot_table(index="År", columns="Parti", values="speeches", aggfunc="sum")
+    hits, totals = hits.align(totals, join="left")
+    rates = (hits / totals * 1000).round(2)
+    result = pd.concat(
+        [hits.stack().rename("Antal"), rates.stack().rename("Per 1000")], axis=1
+    ).reset_index()
+    return result.dropna(subset=["Per 1000"])
+
+
+if __name__ == "__main__":
+    refresh_stats(db.create_engine())
+    print(f"{stats_table} refreshed.")
@@ -0,0 +1,161 @@
+""" The database engine and its connection pool.
+
+create_engine sets up the pool from the settings in config.py. The app makes
+one engine per process and passes it to the functions that read or write.
+pool_status tells how the pool is used, to help sizing it, and
+cancel_statement stops a statement that another thread is waiting for.
+SQLite connections get find_words, which the search backends use to find
+hits in the original text.
+"""
+
+import functools
+import re
+import threading
+import time
+
+import sqlalchemy
+from sqlalchemy.pool import QueuePool
+
+from config import db_user as user
+from config import ip_server as ip
+from config import (
+    max_overflow,
+    pool_recycle,
+    pool_size,
+    pool_timeout,
+    sqlite_path,
+    statement_timeout,
+)
+from config import pwd_postgres as pwd
+
+
+def postgres_url():
+    """Return the URL of the Postgres database."""
+    return f"postgresql://{user}:{pwd}@{ip}:5432/riksdagen"
+
+
+def database_url():
+    """Return the URL of the database to use, the SQLite copy if there is one."""
+    if sqlite_path is not None:
+        return f"sqlite:///{sqlite_path}"
+    return postgres_url()
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that keeps track of how long it takes to get a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+
+
+@functools.lru_cache(maxsize=256)
+def words_pattern(words):
+    """Return a regex for words separated by blanks, without the word boundaries.
+
+    Starting with a literal lets the regex engine skip quickly to possible
+    matches, the boundaries are checked afterwards in find_words.
+    """
+    return re.compile(r"[\W_]+".join(re.escape(i) for i in words.split()), re.IGNORECASE)
+
+
+def find_words(text, words):
+    """Return the position (from 1) of words in a text, like instr(), or 0 if they are not there.
+
+    The words are in lower case and separated by blanks, as in text_lower
+    (see search_backends.term_text), where a blank at an end means a word
+    boundary. In the text they may be separated by anything that is not a word.
+    """
+    if text is None:
+        return None
+    for match in words_pattern(words).finditer(text):
+        start, end = match.span()
+        if words.startswith(" ") and start > 0 and text[start - 1].isalnum():
+            continue
+        if words.endswith(" ") and end < len(text) and text[end].isalnum():
+            continue
+        return start + 1
+    return 0
+
+
+def add_sqlite_functions(dbapi_connection, connection_record):
+    """Add the functions of db.py to a new SQLite connection."""
+    dbapi_connection.create_function("find_words", 2, find_words, deterministic=True)
+
+
+def create_engine(url=None):
+    """Create an engine with a connection pool configured in config.py.
+
+    Args:
+        url (str): Database URL, default from database_url().
+
+    Returns:
+        Engine: The SQLAlchemy engine.
+    """
+    url = url or database_url()
+    connect_args = {}
+    if url.startswith("postgresql"):
+        # Let the server cancel statements that run for too long.
+        connect_args["options"] = f"-c statement_timeout={int(statement_timeout)}"
+    else:
+        # SQLite connections are used by the threads loading results.
+        connect_args["check_same_thread"] = False
+    engine = sqlalchemy.create_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=True,
+        connect_args=connect_args,
+    )
+    if engine.dialect.name == "sqlite":
+        sqlalchemy.event.listen(engine, "connect", add_sqlite_functions)
+    return engine
+
+
+def pool_status(engine):
+    """Return a dict with the current use of the engine's connection pool."""
+    pool = engine.pool
+    status = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": max_overflow,
+    }
+    if isinstance(pool, TimedQueuePool):
+        status["checkouts"] = pool.checkouts
+        status["wait_max_ms"] = round(pool.wait_max * 1000, 1)
+        status["wait_mean_ms"] = round(
+            pool.wait_total / max(pool.checkouts, 1) * 1000, 1
+        )
+    return status
+
+
+def cancel_statement(dbapi_connection):
+    """Cancel the statement running on a DBAPI connection, from another thread.
+
+    psycopg2 sends Postgres a cancel request on a connection of its own,
+    outside the pool, so it works when the pool is used up by the
+    statements to cancel. SQLite runs in the process and is interrupted.
+    """
+    if hasattr(dbapi_connection, "cancel"):
+        dbapi_connection.cancel()
+    else:
+        dbapi_connection.interrupt()
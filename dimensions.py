@@ -0,0 +1,179 @@
+""" Dimension tables for party, debate type and speaker.
+
+The values are normalized once, when speeches are loaded: old party codes
+become the current ones and missing debate types get a name. Each value is
+stored once, in a small table, and the speeches table has an integer key into
+each table. The keys are numbered from 0, so a column of keys in a result
+becomes a categorical with pd.Categorical.from_codes without touching a
+single string.
+
+Run `python dimensions.py` once to normalize a table loaded before the
+dimension tables existed and add the keys to it.
+"""
+
+import pandas as pd
+import sqlalchemy
+
+import db
+from config import db_name
+from corpus_stats import refresh_stats
+
+# Old party codes and the codes of the same parties now.
+party_codes = {"FP": "L", "KDS": "KD"}
+no_debate_type = "inte angiven debattyp"
+
+
+def normalize_party(party):
+    """Return the current code of a party, "-" for none."""
+    party = (party or "").strip().upper()
+    return party_codes.get(party, party) or "-"
+
+
+def normalize_debate_type(debate_type):
+    """Return the debate type, no_debate_type for none."""
+    debate_type = (debate_type or "").strip()
+    return no_debate_type if debate_type in ("", "-") else debate_type
+
+
+def normalize_speaker(speaker):
+    """Return the name of a speaker without surrounding blanks."""
+    return (speaker or "").strip()
+
+
+def clean_text(text):
+    """Remove the ends of paragraphs and the hyphenation at line breaks from a speech."""
+    return (text or "").replace("</p>", "").replace("-\n", " ")
+
+
+# Column of the speeches -> (dimension table, key column, normalization).
+dimension_tables = {
+    "parti": ("parties", "party_id", normalize_party),
+    "kammaraktivitet": ("debate_types", "debate_type_id", normalize_debate_type),
+    "talare": ("speakers", "speaker_id", normalize_speaker),
+}
+# Columns of results holding keys (see info.py) -> the dimension they are keys of.
+result_columns = {"Parti": "parti", "debatetype": "kammaraktivitet", "Talare": "talare"}
+
+create_tables = [
+    "CREATE TABLE IF NOT EXISTS parties (party_id SMALLINT PRIMARY KEY, parti VARCHAR UNIQUE)",
+    "CREATE TABLE IF NOT EXISTS debate_types (debate_type_id SMALLINT PRIMARY KEY, kammaraktivitet VARCHAR UNIQUE)",
+    # The party of a speaker is that of the first speech loaded.
+    "CREATE TABLE IF NOT EXISTS speakers (speaker_id INTEGER PRIMARY KEY, talare VARCHAR UNIQUE, party_id SMALLINT)",
+]
+
+
+class Dimensions:
+    """The values of the dimension tables, the key of a value is its position.
+
+    Args:
+        values (dict): Column of the speeches -> list of values.
+        speaker_parties (list): Key of the party of each speaker.
+    """
+
+    def __init__(self, values, speaker_parties):
+        self.values = values
+        self.keys = {c: {v: k for k, v in enumerate(i)} for c, i in values.items()}
+        self.speaker_parties = speaker_parties
+
+    @classmethod
+    def load(cls, conn):
+        """Read the dimension tables."""
+        values = {}
+        for column, (table, key, _) in dimension_tables.items():
+            sql = f"SELECT {column} FROM {table} ORDER BY {key}"
+            values[column] = [i for (i,) in conn.execute(sqlalchemy.text(sql))]
+        sql = "SELECT party_id FROM speakers ORDER BY speaker_id"
+        speaker_parties = [i for (i,) in conn.execute(sqlalchemy.text(sql))]
+        return cls(values, speaker_parties)
+
+    def encode(self, conn, rows):
+        """Normalize the party, debate type and speaker of rows and set their keys.
+
+        Values that are new are added to the dimension tables, in the
+        transaction of conn, so load one batch at a time.
+
+        Args:
+            conn (Connection): Connection in the transaction the rows are written in.
+            rows (list): Dicts with the columns of the speeches, changed in place.
+        """
+        new = {column: [] for column in dimension_tables}
+        for row in rows:
+            for column, (_, key, normalize) in dimension_tables.items():
+                value = row[column] = normalize(row[column])
+                if value not in self.keys[column]:
+                    self.keys[column][value] = len(self.values[column])
+                    self.values[column].append(value)
+                    new[column].append({key: self.keys[column][value], column: value})
+                    if column == "talare":
+                        self.speaker_parties.append(row["party_id"])
+                        new[column][-1]["party_id"] = row["party_id"]
+                row[key] = self.keys[column][value]
+        for column, (table, _, _) in dimension_tables.items():
+            if new[column]:
+                columns = [sqlalchemy.column(i) for i in new[column][0]]
+                conn.execute(sqlalchemy.table(table, *columns).insert(), new[column])
+
+    def knows(self, df):
+        """Return True if all keys in the result columns of df are in the tables as read."""
+        for column, dimension in result_columns.items():
+            if column in df.columns and len(df) > 0 and df[column].max() >= len(self.values[dimension]):
+                return False
+        return True
+
+    def decode(self, df):
+        """Return df with the keys in the result columns replaced by categoricals of the values."""
+        decoded = {
+            column: pd.Categorical.from_codes(
+                df[column].fillna(-1).astype("int32"), self.values[dimension]
+            )
+            for column, dimension in result_columns.items()
+            if column in df.columns
+        }
+        return df.assign(**decoded)
+
+    def speaker_party(self, speaker):
+        """Return the party of a speaker, "-" if the speaker is unknown."""
+        key = self.keys["talare"].get(speaker)
+        if key is None or self.speaker_parties[key] is None:
+            return "-"
+        return self.values["parti"][self.speaker_parties[key]]
+
+
+def migrate(engine, table=db_name):
+    """Normalize a table of speeches loaded before the dimension tables and add the keys."""
+    columns = {i["name"] for i in sqlalchemy.inspect(engine).get_columns(table)}
+    with engine.begin() as conn:
+        for statement in create_tables:
+            conn.exec_driver_sql(statement)
+        for column, (_, key, normalize) in dimension_tables.items():
+            if key not in columns:
+                conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {key} INTEGER")
+            # Few distinct values change, so they are updated one by one.
+            for (value,) in conn.execute(sqlalchemy.text(f"SELECT DISTINCT {column} FROM {table}")):
+                if normalize(value) == value:
+                    continue
+                where = f"{column} IS NULL" if value is None else f"{column} = :old"
+                conn.execute(
+                    sqlalchemy.text(f"UPDATE {table} SET {column} = :new WHERE {where}"),
+                    {"new": normalize(value), "old": value},
+                )
+        sql = f"SELECT DISTINCT {', '.join(dimension_tables)} FROM {table}"
+        rows = [dict(i) for i in conn.execute(sqlalchemy.text(sql)).mappings()]
+        Dimensions.load(conn).encode(conn, rows)
+        for column, (dimension_table, key, _) in dimension_tables.items():
+            conn.exec_driver_sql(
+                f"""UPDATE {table} SET {key} = (SELECT {key} FROM {dimension_table}
+                WHERE {dimension_table}.{column} = {table}.{column})"""
+            )
+        conn.execute(
+            sqlalchemy.text(
+                f"UPDATE {table} SET anforandetext = replace(replace(anforandetext, '</p>', ''), :hyphen, ' ')"
+            ),
+            {"hyphen": "-\n"},
+        )
+    refresh_stats(engine, table)
+
+
+if __name__ == "__main__":
+    migrate(db.create_engine())
+    print("Dimension tables built and keys added.")
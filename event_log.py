@@ -0,0 +1,124 @@
+""" Logging of searches, errors and feedback to the database in the background.
+
+EventWriter puts events on a bounded queue and a thread writes them in
+batches, one multi-row INSERT per table. Logging never waits for the
+database: when the queue is full the event is dropped and counted instead.
+"""
+
+import atexit
+import queue
+import threading
+import time
+
+import sqlalchemy
+
+from config import log_batch_size, log_flush_interval, log_queue_size
+
+
+class EventWriter:
+    """Writes rows to the database in batches from a background thread.
+
+    Args:
+        engine (Engine): The engine to write with.
+        max_queue (int): Max events waiting to be written, more are dropped.
+        batch_size (int): Write when this many events are waiting.
+        flush_interval (float): Seconds between writes when there are fewer.
+    """
+
+    def __init__(
+        self,
+        engine,
+        max_queue=log_queue_size,
+        batch_size=log_batch_size,
+        flush_interval=log_flush_interval,
+    ):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        atexit.register(self.close)
+        return self
+
+    def log(self, table, **row):
+        """Queue a row for the table, returns False if it was dropped."""
+        try:
+            self._queue.put_nowait((table, row))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def _batch(self):
+        """Wait for events and return up to batch_size of them."""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        """Insert a batch of events, one statement per table."""
+        tables = {}
+        for table, row in batch:
+            tables.setdefault(table, []).append(row)
+        for table, rows in tables.items():
+            columns = sorted({i for row in rows for i in row})
+            statement = sqlalchemy.table(
+                table, *(sqlalchemy.column(i) for i in columns)
+            ).insert()
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(statement, [{i: row.get(i) for i in columns} for row in rows])
+                self.written += len(rows)
+            except Exception as e:  # The log is lost, the app goes on.
+                self.failed += len(rows)
+                print(f"Could not write {len(rows)} rows to {table}: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._batch()
+            if batch != []:
+                self._write(batch)
+
+    def flush(self):
+        """Write everything in the queue now."""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch != []:
+            self._write(batch)
+
+    def close(self):
+        """Stop the thread and write what is left."""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(self.flush_interval + 1)
+        self.flush()
+
+    def status(self):
+        """Return a dict with the number of events queued, written, dropped and failed."""
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
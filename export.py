@@ -0,0 +1,154 @@
+""" Export of all speeches matching a search to CSV, Parquet or JSONL.
+
+The speeches are read from a server-side cursor in chunks and each chunk is
+written to the file before the next is read, so memory use is flat whatever
+the number of speeches. Nothing is built until an export is asked for.
+
+Run `python export.py "sökord" speeches.parquet` to export without the app.
+"""
+
+import hashlib
+import os
+import sys
+import threading
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import db
+from config import export_chunksize
+from dimensions import Dimensions
+from fetch import stream_frames
+from query import parse_query
+from search_backends import get_backend
+
+
+class CSVWriter:
+    """Writes chunks to a CSV file separated by semicolons, with one header."""
+
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf-8", newline="")
+        self.header = True
+
+    def write(self, chunk):
+        chunk.to_csv(self.file, index=False, sep=";", header=self.header, date_format="%Y-%m-%d")
+        self.header = False
+
+    def close(self):
+        self.file.close()
+
+
+class JSONLWriter:
+    """Writes chunks to a file with one JSON object per line."""
+
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, chunk):
+        if len(chunk) > 0:
+            records = chunk.to_json(
+                orient="records", lines=True, force_ascii=False, date_format="iso"
+            )
+            self.file.write(records.rstrip("\n") + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """Writes chunks as row groups of a Parquet file, with the types of the first chunk."""
+
+    def __init__(self, path):
+        self.path = path
+        self.writer = None
+
+    def write(self, chunk):
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        else:  # Later chunks may have other types, e.g. all nulls.
+            table = table.cast(self.writer.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is None:  # No speeches, write an empty file.
+            pq.write_table(pa.table({}), self.path)
+        else:
+            self.writer.close()
+
+
+writers = {"csv": CSVWriter, "parquet": ParquetWriter, "jsonl": JSONLWriter}
+export_formats = list(writers)
+
+
+def export_name(query, file_format, **inputs):
+    """Return a file name for the export of a query, the same for the same inputs.
+
+    The inputs should include the version of the data, so exports made
+    before a sync get other names than those made after it.
+    """
+    text = repr((tuple(query), sorted(inputs.items())))
+    return f"{hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]}.{file_format}"
+
+
+def export(engine, backend, query, path, file_format=None, prepare=None, chunksize=export_chunksize):
+    """Write all speeches matching a query to a file.
+
+    Args:
+        engine (Engine): The database.
+        backend (SearchBackend): Backend that compiles the query.
+        query (Query): A query as returned by parse_query.
+        path (str): The file to write.
+        file_format (str): One of export_formats, default from the file extension.
+        prepare (function): Called with each chunk, returns the chunk to write,
+            e.g. to clean and filter it.
+        chunksize (int): Speeches read and written at a time.
+
+    Returns:
+        int: Number of speeches written.
+    """
+    file_format = file_format or os.path.splitext(path)[1].lstrip(".")
+    if file_format not in writers:
+        raise ValueError(f"Unknown export format {file_format}, use one of {list(writers)}.")
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    writer = writers[file_format](temporary)
+    rows = 0
+    try:
+        for chunk in stream_frames(engine, backend.compile_export(query), chunksize):
+            if prepare is not None:
+                chunk = prepare(chunk)
+            writer.write(chunk)
+            rows += len(chunk)
+        writer.close()
+        os.replace(temporary, path)
+    except BaseException:
+        writer.close()
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return rows
+
+
+def remove_old_exports(directory, max_age):
+    """Remove exports older than max_age seconds."""
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if time.time() - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except FileNotFoundError:  # Removed by another process.
+            pass
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        sys.exit('Usage: python export.py "sökord" speeches.csv|speeches.parquet|speeches.jsonl')
+    query = parse_query(sys.argv[1])
+    if not query.has_terms():
+        sys.exit("The search has no word that must be in the speeches.")
+    engine = db.create_engine()
+    with engine.connect() as conn:
+        dimensions = Dimensions.load(conn)
+    rows = export(engine, get_backend(), query, sys.argv[2], prepare=dimensions.decode)
+    print(f"{rows} speeches written to {sys.argv[2]}.")
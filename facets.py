@@ -0,0 +1,63 @@
+""" Facet index for filtering a result on party, debate type, year and speaker.
+
+The values of each facet column are turned into integer codes once per
+result. A filter on a column is then a lookup in a small table of allowed
+codes, which gives a boolean mask over the rows. Masks of different columns
+are combined with AND, so any mix of filters is applied without copying the
+frame, and the counts per value of one facet given the filters on the others
+are one np.bincount.
+"""
+
+import numpy as np
+import pandas as pd
+
+facet_columns = ["Parti", "debatetype", "År", "Talare"]
+
+
+class FacetIndex:
+    """Codes and masks for the facet columns of a result frame.
+
+    Args:
+        df (DataFrame): The result.
+        columns (list): The columns to filter and count on.
+    """
+
+    def __init__(self, df, columns=facet_columns):
+        self.rows = len(df)
+        self.codes = {}  # Column -> code of each row.
+        self.values = {}  # Column -> value of each code.
+        for column in columns:
+            codes, values = pd.factorize(df[column], sort=True)
+            self.codes[column] = codes
+            self.values[column] = pd.Index(np.asarray(values))
+
+    def __len__(self):
+        return self.rows
+
+    def column_mask(self, column, selected):
+        """Return a boolean array, True for the rows with one of the selected values."""
+        allowed = np.zeros(len(self.values[column]) + 1, dtype=bool)
+        allowed[self.values[column].get_indexer(list(selected))] = True
+        allowed[-1] = False  # Missing values and unknown selections get code -1.
+        return allowed[self.codes[column]]
+
+    def mask(self, selections, skip=None):
+        """Return a boolean array, True for the rows that pass all filters.
+
+        Args:
+            selections (dict): Column -> values to keep. Columns that are not
+                in the dict, or have None as values, are not filtered on.
+            skip (str): A column to leave out of the filters.
+        """
+        mask = np.ones(self.rows, dtype=bool)
+        for column, selected in selections.items():
+            if selected is None or column == skip:
+                continue
+            mask &= self.column_mask(column, selected)
+        return mask
+
+    def counts(self, column, selections):
+        """Return the number of rows per value of a column, given the filters on the other columns."""
+        codes = self.codes[column][self.mask(selections, skip=column)]
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.values[column]))
+        return pd.Series(counts, index=self.values[column])
@@ -0,0 +1,266 @@
+""" Fetching of search results in pages, in the background.
+
+Instead of one query with a hard LIMIT the results are read page by page,
+either with keyset pagination (one short query per page, no connection is
+held between pages) or from a server-side cursor. Pages carry excerpts of the
+speeches, full texts are fetched separately with fetch_full_texts. A ResultLoader reads the
+pages in a thread, so the first page can be shown while the rest loads.
+
+The connections of a search go through a QueryHandle, so when no session
+wants the result any more the loader is stopped and the statement it is
+waiting for is cancelled on the server, instead of running to the end.
+The handle also keeps the slowest statement of the search, for the slow
+query log (see telemetry.py).
+"""
+
+import contextlib
+import threading
+import time
+
+import pandas as pd
+
+from db import cancel_statement
+from result_schema import concat
+from timing import StageTimer
+
+# Names of order_columns in the result (see light_columns in info.py).
+order_aliases = ["Datum", "number", "talk_id"]
+
+
+class Cancelled(Exception):
+    """A search was cancelled before its next statement started."""
+
+
+class QueryHandle:
+    """Hands out the connections of one search, so its running statement can be cancelled.
+
+    Args:
+        engine (Engine): The engine to connect with.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.cancelled = False
+        self.slowest = None  # (milliseconds, Plan) of the slowest statement.
+        self._connection = None  # DBAPI connection of the running statement.
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connect(self):
+        """Return a connection, like engine.connect(), that cancel() can interrupt."""
+        with self.engine.connect() as conn:
+            with self._lock:
+                if self.cancelled:
+                    raise Cancelled()
+                self._connection = conn.connection.dbapi_connection
+            try:
+                yield conn
+            finally:
+                with self._lock:
+                    self._connection = None
+                    if self.cancelled:
+                        # A cancel may still be on its way, don't give the connection to anyone else.
+                        conn.invalidate()
+
+    def record(self, plan, ms):
+        """Keep the plan of a statement run through the handle if it is the slowest so far."""
+        with self._lock:
+            if self.slowest is None or ms > self.slowest[0]:
+                self.slowest = (round(ms, 1), plan)
+
+    def cancel(self):
+        """Cancel the running statement, and make the next connect() raise Cancelled.
+
+        The statement is cancelled in a thread, so the caller, usually the
+        rerun that replaced the search, doesn't wait for the database.
+        """
+        with self._lock:
+            self.cancelled = True
+            connection = self._connection
+        if connection is not None:
+            threading.Thread(target=self._cancel, args=(connection,), daemon=True).start()
+
+    def _cancel(self, connection):
+        try:
+            cancel_statement(connection)
+        except Exception:  # The statement ended and the connection was closed meanwhile.
+            pass
+
+
+def keyset_pages(engine, backend, query, page_size, timer=None, handle=None):
+    """Yield the speeches matching a query one page at a time.
+
+    Args:
+        engine (Engine): SQLAlchemy engine for the database.
+        backend (SearchBackend): Backend that compiles the query.
+        query (Query): A query as returned by parse_query.
+        page_size (int): Number of speeches per page.
+        timer (StageTimer): Gets the time spent in the stages compile and db.
+        handle (QueryHandle): Gives the connections, to be able to cancel them.
+
+    Yields:
+        DataFrame: One page of speeches, ordered by order_columns.
+    """
+    timer = timer or StageTimer()
+    handle = handle or QueryHandle(engine)
+    after = None
+    while True:
+        with timer.stage("compile"):
+            plan = backend.compile_page(query, page_size, after)
+        with timer.stage("db"), handle.connect() as conn:
+            start = time.perf_counter()
+            page = pd.read_sql(plan.statement(), conn, params=plan.parameters())
+            handle.record(plan, (time.perf_counter() - start) * 1000)
+        if len(page) > 0:
+            yield page
+        if len(page) < page_size:
+            return
+        # Use Python values, numpy integers are not understood by all drivers.
+        after = tuple(getattr(i, "item", lambda: i)() for i in page[order_aliases].iloc[-1])
+
+
+def fetch_full_texts(engine, backend, talk_ids, batch_size=1000):
+    """Return {talk_id: full text} for the given speeches, fetched by primary key."""
+    talk_ids = list(talk_ids)
+    texts = {}
+    with engine.connect() as conn:
+        for n in range(0, len(talk_ids), batch_size):
+            plan = backend.compile_full_texts(talk_ids[n : n + batch_size])
+            for talk_id, text in conn.execute(plan.statement(), plan.parameters()):
+                texts[talk_id] = text or ""
+    return texts
+
+
+def stream_frames(engine, plan, chunksize, handle=None):
+    """Yield the rows of a Plan in chunks, read from a server-side cursor.
+
+    The time until the last chunk is read is recorded in the handle, it
+    includes the time spent on the chunks by the caller.
+    """
+    handle = handle or QueryHandle(engine)
+    with handle.connect() as conn:
+        start = time.perf_counter()
+        conn = conn.execution_options(stream_results=True)
+        yield from pd.read_sql(
+            plan.statement(), conn, params=plan.parameters(), chunksize=chunksize
+        )
+        handle.record(plan, (time.perf_counter() - start) * 1000)
+
+
+class ResultLoader:
+    """Reads pages of results in a background thread.
+
+    Pages are passed through prepare (if given) as they arrive. At most
+    max_rows speeches are kept, after that the loader stops and sets truncated.
+    When all pages are read, on_complete (if given) is called with the loader.
+    The time spent in prepare is added to timer, and the bytes of the pages
+    as fetched are counted.
+
+    Sessions showing the result acquire() it and release() it when they
+    search for something else. When the last one lets go before all pages
+    are read, the loader stops and cancels the statement through handle.
+    """
+
+    def __init__(
+        self, pages, prepare=None, max_rows=None, on_complete=None, timer=None, handle=None
+    ):
+        self.pages = pages
+        self.prepare = prepare
+        self.max_rows = max_rows
+        self.on_complete = on_complete
+        self.timer = timer or StageTimer()
+        self.handle = handle
+        self.frames = []
+        self.rows = 0
+        self.bytes = 0
+        self.users = 0
+        self.cached = False
+        self.cancelled = False
+        self.done = False
+        self.truncated = False
+        self.error = None
+        self._lock = threading.Lock()
+        self._first_page = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @classmethod
+    def finished(cls, frame, truncated=False):
+        """Return a loader that is already done, e.g. for a result from a cache."""
+        loader = cls([])
+        loader.frames = [frame]
+        loader.rows = len(frame)
+        loader.truncated = truncated
+        loader.cached = True
+        loader.done = True
+        loader._first_page.set()
+        return loader
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            for page in self.pages:
+                if self._stop.is_set():
+                    break
+                if self.max_rows is not None and self.rows + len(page) > self.max_rows:
+                    page = page.iloc[: self.max_rows - self.rows]
+                    self.truncated = True
+                self.bytes += int(page.memory_usage(deep=True).sum())
+                if self.prepare is not None:
+                    with self.timer.stage("prepare"):
+                        page = self.prepare(page)
+                with self._lock:
+                    self.frames.append(page)
+                    self.rows += len(page)
+                self._first_page.set()
+                if self.truncated:
+                    break
+            if self.on_complete is not None and not self._stop.is_set():
+                self.on_complete(self)
+        except Exception as e:
+            if not self._stop.is_set():  # Errors from cancelling are expected.
+                self.error = e
+        finally:
+            if hasattr(self.pages, "close"):
+                self.pages.close()
+            self.done = True
+            self._first_page.set()
+
+    def wait(self, timeout=None):
+        """Wait until the first page is loaded (or all, if there is less), max timeout seconds."""
+        self._first_page.wait(timeout)
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        """Stop loading more pages and cancel the statement that is running, if any."""
+        with self._lock:
+            if self.done:
+                return
+            self.cancelled = True
+        self._stop.set()
+        if self.handle is not None:
+            self.handle.cancel()
+
+    def acquire(self):
+        """Count one more session using the result, returns False if it was already cancelled."""
+        with self._lock:
+            self.users += 1
+            return not self.cancelled
+
+    def release(self):
+        """Count one session less, and stop if none is left and pages are still loading."""
+        with self._lock:
+            self.users -= 1
+            unused = self.users <= 0
+        if unused:
+            self.stop()
+
+    def frame(self):
+        """Return all rows loaded so far as one DataFrame."""
+        with self._lock:
+            frames = list(self.frames)
+        return concat(frames)
@@ -14,22 +14,35 @@ party_colors = {
     '-': 'white'
 }
 
-select_columns = '''
+# Columns of a page of speeches, without the full text (see search_backends.py).
+# Parti, debatetype and Talare are keys into the dimension tables, see dimensions.py.
+light_columns = '''
                 talk_id,
                 dok_id,
-                "anforandetext" AS "Text", 
                 anforande_nummer AS number, 
-                kammaraktivitet as debatetype, 
-                talare AS "Talare", 
+                debate_type_id as debatetype, 
+                speaker_id AS "Talare", 
                 datum AS "Datum", 
                 year AS År, 
                 debateurl AS url_session, 
-                parti AS "Parti",
+                party_id AS "Parti",
                 audiofileurl as url_audio,
                 startpos as start,
                 intressent_id
                 '''
 
+# Columns of exported speeches (see export.py).
+export_columns = '''
+                talk_id,
+                anforandetext AS "Anförande",
+                party_id AS "Parti",
+                speaker_id AS "Talare",
+                datum AS "Datum",
+                year AS "År",
+                debate_type_id AS debatetype,
+                debateurl AS url_session
+                '''
+
 
 
 
@@ -129,7 +142,6 @@ debate_types = {
         }
 
 limit_warning = '''
-        Din sökning ger fler än 10 000 träffar. Försök gör den mer specifik, exempelvis genom att
+        Din sökning ger fler än {max_rows} träffar och bara de första {max_rows} visas. Försök gör den mer specifik, exempelvis genom att
         använda minustecken eller specificera årtal genom att skriva år\:yyyy-yyyy (ex. år:2019-2020, utan mellanrum efter kolon).
-        Gränsen på 10 000 träffar finns för att servern inte ska krascha och kommer att höjas när jag har en starkare server.
         '''
\ No newline at end of file
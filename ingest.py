@@ -0,0 +1,228 @@
+""" Loading of the speeches from the bulk archives of data.riksdagen.se.
+
+The archives (e.g. anforande-202223.json.zip from
+https://data.riksdagen.se/data/anforanden/) hold one JSON file per speech.
+They are read from local files and parsed in a process pool, one archive per
+process, and the rows are loaded with COPY in Postgres or multi-row INSERTs
+in other databases. Party, debate type and speaker are normalized into the
+dimension tables of dimensions.py on the way in.
+
+Run `python ingest.py anforande-*.json.zip` to load archives into the table
+in config.py, with --replace to rebuild it from scratch. Then build the
+indexes with search_backends.py and the statistics with corpus_stats.py.
+"""
+
+import argparse
+import csv
+import html
+import io
+import json
+import re
+import time
+import zipfile
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+import sqlalchemy
+
+import db
+from config import db_name
+from corpus_stats import refresh_stats
+from dimensions import Dimensions, clean_text, create_tables
+from query import split_words
+
+columns = [
+    "talk_id",
+    "dok_id",
+    "anforande_nummer",
+    "kammaraktivitet",
+    "talare",
+    "parti",
+    "intressent_id",
+    "party_id",
+    "debate_type_id",
+    "speaker_id",
+    "datum",
+    "year",
+    "anforandetext",
+    "text_lower",
+    "debateurl",
+    "audiofileurl",
+    "startpos",
+]
+create_table = """CREATE TABLE IF NOT EXISTS {table} (
+    talk_id VARCHAR PRIMARY KEY,
+    dok_id VARCHAR,
+    anforande_nummer INTEGER,
+    kammaraktivitet VARCHAR,
+    talare VARCHAR,
+    parti VARCHAR,
+    intressent_id VARCHAR,
+    party_id SMALLINT,
+    debate_type_id SMALLINT,
+    speaker_id INTEGER,
+    datum VARCHAR,
+    year INTEGER,
+    anforandetext TEXT,
+    text_lower TEXT,
+    debateurl VARCHAR,
+    audiofileurl VARCHAR,
+    startpos INTEGER
+)"""
+
+tag_pattern = re.compile(r"<[^>]+>")
+
+
+def normalize_text(text):
+    """Return the searchable form of a speech: lower case words with single blanks.
+
+    The text starts and ends with a blank, so every word, also the first and
+    the last, matches the LIKE patterns "% word %" in search_backends.py.
+    Words are split like the search terms, with query.split_words.
+    """
+    text = html.unescape(tag_pattern.sub(" ", text or ""))
+    return f" {' '.join(split_words(text))} "
+
+
+def to_int(value, default=0):
+    """Return the value as an int, or default if it is not a number."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_speech(data):
+    """Return the row for one speech from the JSON of the archives, or None if it has no id.
+
+    Party, debate type and speaker are normalized, and get their keys, in
+    Dimensions.encode. Speeches without a date get the year the riksmöte
+    started (2023 for 2023/24), or None if that is missing too.
+    """
+    speech = data.get("anforande", data)
+    talk_id = speech.get("anforande_id")
+    if not talk_id:
+        return None
+    datum = (speech.get("dok_datum") or "")[:10]
+    return {
+        "talk_id": talk_id,
+        "dok_id": speech.get("dok_id"),
+        "anforande_nummer": to_int(speech.get("anforande_nummer")),
+        "kammaraktivitet": speech.get("kammaraktivitet"),
+        "talare": speech.get("talare"),
+        "parti": speech.get("parti"),
+        "intressent_id": speech.get("intressent_id"),
+        "party_id": None,
+        "debate_type_id": None,
+        "speaker_id": None,
+        "datum": datum,
+        "year": to_int(datum[:4] or (speech.get("rm") or "")[:4], None),
+        "anforandetext": clean_text(speech.get("anforandetext")),
+        "text_lower": normalize_text(speech.get("anforandetext")),
+        # The archives have no links to the debate video and audio.
+        "debateurl": "",
+        "audiofileurl": "",
+        "startpos": 0,
+    }
+
+
+def parse_archive(path):
+    """Return the rows of all speeches in an archive, a .zip of JSON files or one JSON file."""
+    speeches = []
+    if path.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                if name.endswith(".json"):
+                    speeches.append(json.loads(archive.read(name).decode("utf-8-sig")))
+    else:
+        with open(path, encoding="utf-8-sig") as f:
+            speeches.append(json.load(f))
+    rows = {}  # One row per talk_id, the last one wins.
+    for speech in speeches:
+        row = parse_speech(speech)
+        if row is not None:
+            rows[row["talk_id"]] = row
+    return list(rows.values())
+
+
+def copy_rows(conn, table, rows):
+    """Load rows into a Postgres table with COPY."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["\\N" if row[i] is None else row[i] for i in columns])
+    buffer.seek(0)
+    cursor = conn.connection.dbapi_connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+        buffer,
+    )
+
+
+def insert_rows(conn, table, rows, batch_size=1000):
+    """Load rows into a table with multi-row INSERTs."""
+    statement = sqlalchemy.table(table, *(sqlalchemy.column(i) for i in columns)).insert()
+    for n in range(0, len(rows), batch_size):
+        conn.execute(statement, rows[n : n + batch_size])
+
+
+def delete_rows(conn, table, talk_ids, batch_size=1000):
+    """Delete the speeches with the given talk_ids."""
+    statement = sqlalchemy.text(f"DELETE FROM {table} WHERE talk_id IN :ids").bindparams(
+        sqlalchemy.bindparam("ids", expanding=True)
+    )
+    for n in range(0, len(talk_ids), batch_size):
+        conn.execute(statement, {"ids": talk_ids[n : n + batch_size]})
+
+
+def ingest(engine, paths, table=db_name, replace=False, workers=None):
+    """Parse archives in parallel and load the speeches into the table.
+
+    Args:
+        engine (Engine): The database.
+        paths (list): Paths to the archives.
+        table (str): Table to load into.
+        replace (bool): Drop the table first, for a full rebuild.
+        workers (int): Processes parsing archives, default one per CPU, 1
+            to parse them one by one in this process.
+
+    Returns:
+        int: Number of speeches loaded.
+    """
+    with engine.begin() as conn:
+        if replace:
+            conn.exec_driver_sql(f"DROP TABLE IF EXISTS {table}")
+        conn.exec_driver_sql(create_table.format(table=table))
+        for statement in create_tables:
+            conn.exec_driver_sql(statement)
+    load = copy_rows if engine.dialect.name == "postgresql" else insert_rows
+    start = time.perf_counter()
+    total = 0
+    with contextlib.ExitStack() as stack:
+        if workers == 1:
+            parsed = map(parse_archive, paths)
+        else:
+            parsed = stack.enter_context(ProcessPoolExecutor(workers)).map(parse_archive, paths)
+        for path, rows in zip(paths, parsed):
+            with engine.begin() as conn:
+                Dimensions.load(conn).encode(conn, rows)
+                if not replace:  # Speeches that are already loaded are replaced.
+                    delete_rows(conn, table, [i["talk_id"] for i in rows])
+                load(conn, table, rows)
+            total += len(rows)
+            elapsed = time.perf_counter() - start
+            print(f"{path}: {len(rows)} speeches, {total} in total, {total / elapsed:.0f} rows/s")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load speeches from data.riksdagen.se archives.")
+    parser.add_argument("paths", nargs="+", help="Archives, e.g. anforande-202223.json.zip")
+    parser.add_argument("--replace", action="store_true", help="Rebuild the table from scratch.")
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Processes parsing archives, 1 for none."
+    )
+    args = parser.parse_args()
+    engine = db.create_engine()
+    ingest(engine, args.paths, replace=args.replace, workers=args.workers)
+    refresh_stats(engine)
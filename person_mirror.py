@@ -0,0 +1,138 @@
+""" Local mirror of the person data at data.riksdagen.se.
+
+The app needs each speaker's sorting name to link to their page at
+riksdagen.se. Instead of asking the API on every click, the data is imported
+from the person dump (https://data.riksdagen.se/dataset/person/person.json.zip)
+into the table person_metadata, keyed by intressent_id, and looked up there.
+
+Run `python person_mirror.py person.json.zip` to import or refresh the table
+from a downloaded dump, no network is needed. Only persons that are new or
+have changed since the last import are written.
+"""
+
+import hashlib
+import json
+import sys
+import zipfile
+
+import sqlalchemy
+
+import db
+from riksdagen import member_url
+
+table_name = "person_metadata"
+columns = [
+    "intressent_id",
+    "sorteringsnamn",
+    "tilltalsnamn",
+    "efternamn",
+    "parti",
+    "url",
+    "party_history",
+    "checksum",
+]
+create_table = f"""CREATE TABLE IF NOT EXISTS {table_name} (
+    intressent_id VARCHAR PRIMARY KEY,
+    sorteringsnamn VARCHAR,
+    tilltalsnamn VARCHAR,
+    efternamn VARCHAR,
+    parti VARCHAR,
+    url VARCHAR,
+    party_history VARCHAR,
+    checksum VARCHAR
+)"""
+
+
+def read_dump(path):
+    """Return the list of persons in a dump, a .json file or a .zip with one."""
+    if path.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            name = next(i for i in archive.namelist() if i.endswith(".json"))
+            data = json.loads(archive.read(name).decode("utf-8-sig"))
+    else:
+        with open(path, encoding="utf-8-sig") as f:
+            data = json.load(f)
+    persons = data["personlista"]["person"]
+    return persons if isinstance(persons, list) else [persons]
+
+
+def party_history(person):
+    """Return [[party, from, to], ...] from the assignments of a person."""
+    assignments = (person.get("personuppdrag") or {}).get("uppdrag") or []
+    if isinstance(assignments, dict):
+        assignments = [assignments]
+    history = [
+        [i.get("organ_kod"), i.get("from"), i.get("tom")]
+        for i in assignments
+        if i.get("typ") == "partiuppdrag"
+    ]
+    return sorted(history, key=lambda i: i[1] or "")
+
+
+def person_row(person):
+    """Return the row of person_metadata for a person in the dump."""
+    row = {
+        "intressent_id": person["intressent_id"],
+        "sorteringsnamn": person.get("sorteringsnamn"),
+        "tilltalsnamn": person.get("tilltalsnamn"),
+        "efternamn": person.get("efternamn"),
+        "parti": person.get("parti"),
+        "url": member_url(person.get("sorteringsnamn") or "", person["intressent_id"]),
+        "party_history": json.dumps(party_history(person), ensure_ascii=False),
+    }
+    row["checksum"] = hashlib.sha1(
+        json.dumps(row, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return row
+
+
+def import_persons(engine, path):
+    """Import new and changed persons from a dump into person_metadata.
+
+    Args:
+        engine (Engine): The database to write to.
+        path (str): Path to the dump.
+
+    Returns:
+        int: Number of persons written.
+    """
+    rows = {}
+    for person in read_dump(path):
+        if person.get("intressent_id"):
+            row = person_row(person)
+            rows[row["intressent_id"]] = row
+    table = sqlalchemy.table(table_name, *(sqlalchemy.column(i) for i in columns))
+    with engine.begin() as conn:
+        conn.exec_driver_sql(create_table)
+        checksums = dict(
+            conn.execute(sqlalchemy.text(f"SELECT intressent_id, checksum FROM {table_name}")).all()
+        )
+        changed = [i for i in rows.values() if checksums.get(i["intressent_id"]) != i["checksum"]]
+        ids = tuple(i["intressent_id"] for i in changed if i["intressent_id"] in checksums)
+        if ids != ():
+            conn.execute(
+                sqlalchemy.text(f"DELETE FROM {table_name} WHERE intressent_id IN :ids").bindparams(
+                    sqlalchemy.bindparam("ids", expanding=True)
+                ),
+                {"ids": ids},
+            )
+        if changed != []:
+            conn.execute(table.insert(), changed)
+    return len(changed)
+
+
+def person_url(engine, intressent_id):
+    """Return the URL of a person's page from person_metadata, or None if not there."""
+    sql = sqlalchemy.text(f"SELECT url FROM {table_name} WHERE intressent_id = :id")
+    try:
+        with engine.connect() as conn:
+            return conn.execute(sql, {"id": intressent_id}).scalar()
+    except sqlalchemy.exc.DBAPIError:  # The table is not imported yet.
+        return None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python person_mirror.py person.json.zip")
+    written = import_persons(db.create_engine(), sys.argv[1])
+    print(f"{written} persons imported into {table_name}.")
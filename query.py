@@ -0,0 +1,151 @@
+""" Parsing of the search box into a normalized query.
+
+parse_query reads the user input in one pass and returns a Query, a tuple of
+sorted, lowercased terms. Inputs that only differ in spacing, case or term
+order give equal Query objects, so they share compiled SQL and cached results.
+Terms are split into words with split_words, like the speeches are when they
+are loaded (see ingest.py), so e.g. e-post is searched for as "e post".
+"""
+
+import json
+import re
+from typing import NamedTuple
+
+# One token: an optionally negated quoted phrase, or anything up to a blank.
+token_pattern = re.compile(r'(-?)"([^"]*)"?|(\S+)')
+years_pattern = re.compile(r"^år:(\d{4})(?:-(\d{4}))?$")
+# Characters between words, everything but letters and digits.
+non_word_pattern = re.compile(r"[\W_]+")
+
+
+def split_words(text):
+    """Return the words of a text in lower case, for the speeches and the search terms alike."""
+    return non_word_pattern.sub(" ", text.lower()).split()
+
+
+class Term(NamedTuple):
+    """A word or phrase to search for.
+
+    left_open/right_open tell if the term started/ended with an asterix, i.e.
+    if it may be the end/start of a longer word.
+    """
+
+    words: tuple
+    left_open: bool = False
+    right_open: bool = False
+
+    def __str__(self):
+        return f"{'*' if self.left_open else ''}{' '.join(self.words)}{'*' if self.right_open else ''}"
+
+
+class Query(NamedTuple):
+    """A normalized search.
+
+    required: terms that must all be in the speech.
+    any_of: groups of terms joined by OR, one of each group must be in the speech.
+    excluded: terms that must not be in the speech.
+    years: (first year, last year) or None.
+    speaker: name of a speaker to get all speeches from, instead of the terms.
+    """
+
+    required: tuple = ()
+    any_of: tuple = ()
+    excluded: tuple = ()
+    years: tuple = None
+    speaker: str = None
+
+    def has_terms(self):
+        """Return True if the query has a term that must be in the speeches, or a speaker.
+
+        Queries without, e.g. only excluded terms or years, match most of the corpus.
+        """
+        return self.speaker is not None or self.required != () or self.any_of != ()
+
+    def snippet_terms(self):
+        """Return the terms to make snippets from, or "speaker" for speaker searches."""
+        if self.speaker is not None:
+            return "speaker"
+        terms = list(self.required)
+        for group in self.any_of:
+            terms += group
+        return [str(i) for i in terms]
+
+    def to_json(self):
+        """Return the query as JSON, e.g. to store it with a cached result."""
+        return json.dumps(self, ensure_ascii=False)
+
+
+def make_term(text):
+    """Make a Term from a word or phrase, or return None if there are no words."""
+    text = text.strip()
+    words = tuple(split_words(text))
+    if words == ():
+        return None
+    return Term(words, text.startswith("*"), text.endswith("*"))
+
+
+def parse_query(user_input):
+    """Parse the user input into a normalized Query.
+
+    Args:
+        user_input (str): The string resulting from user input.
+
+    Returns:
+        Query: The normalized query.
+    """
+    groups = []  # Positive terms, terms joined by OR end up in the same group.
+    excluded = set()
+    years = None
+    join_next = False
+
+    for match in token_pattern.finditer(user_input):
+        negated, phrase, token = match.groups()
+        if token is not None:
+            if token.lower() == "or":
+                join_next = groups != []
+                continue
+            years_match = years_pattern.match(token.lower())
+            if years_match is not None:
+                start = int(years_match.group(1))
+                end = int(years_match.group(2) or start)
+                years = (min(start, end), max(start, end))
+                join_next = False
+                continue
+            negated = token.startswith("-") and len(token) > 1
+            phrase = token[1:] if negated else token
+
+        term = make_term(phrase)
+        if term is None:
+            continue
+        if negated:
+            excluded.add(term)
+        elif join_next:
+            groups[-1].add(term)
+        else:
+            groups.append({term})
+        join_next = False
+
+    required = sorted({i for group in groups if len(group) == 1 for i in group})
+    any_of = sorted({tuple(sorted(i)) for i in groups if len(i) > 1})
+    return Query(tuple(required), tuple(any_of), tuple(sorted(excluded)), years)
+
+
+def speaker_query(speaker):
+    """Return a Query for everything a speaker has said."""
+    return Query(speaker=speaker)
+
+
+def query_from_json(text):
+    """Return the Query that to_json() returned as JSON."""
+    required, any_of, excluded, years, speaker = json.loads(text)
+
+    def term(value):
+        return Term(tuple(value[0]), value[1], value[2])
+
+    return Query(
+        tuple(term(i) for i in required),
+        tuple(tuple(term(i) for i in group) for group in any_of),
+        tuple(term(i) for i in excluded),
+        None if years is None else tuple(years),
+        speaker,
+    )
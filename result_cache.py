@@ -0,0 +1,182 @@
+""" Cache of search results as Parquet files on local disk.
+
+Each result is one file named by a hash of the normalized query and every
+other input that changes the result (backend, table, max rows...). Files are
+written atomically, so several app processes can share the directory. The
+cache is bounded by number of entries and bytes, least recently used entries
+are evicted first, and entries older than ttl seconds are not used.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import (
+    result_cache_dir,
+    result_cache_max_bytes,
+    result_cache_max_entries,
+    result_cache_ttl,
+)
+
+# Change when the cached frames change shape, to not read old entries.
+cache_version = 2
+
+
+class ResultCache:
+    """A bounded, shared on-disk cache of DataFrames.
+
+    Args:
+        directory (str): Where to keep the files.
+        max_entries (int): Max number of results kept.
+        max_bytes (int): Max size of all files.
+        ttl (float): Seconds a result is used after it was written.
+    """
+
+    def __init__(
+        self,
+        directory=result_cache_dir,
+        max_entries=result_cache_max_entries,
+        max_bytes=result_cache_max_bytes,
+        ttl=result_cache_ttl,
+    ):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(query, **inputs):
+        """Return the key for a query and the other inputs of the result."""
+        text = repr((cache_version, tuple(query), sorted(inputs.items())))
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.parquet")
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key):
+        """Return (DataFrame, metadata dict) for a key, or None if it is not cached."""
+        path = self._path(key)
+        try:
+            written = os.path.getmtime(path)
+            if time.time() - written > self.ttl:
+                self._count("misses")
+                return None
+            table = pq.read_table(path)
+            # The access time orders entries for eviction, the write time is kept for the TTL.
+            os.utime(path, (time.time(), written))
+        except (OSError, pa.ArrowException):
+            self._count("misses")
+            return None
+        self._count("hits")
+        return table.to_pandas(), self._metadata(table.schema)
+
+    @staticmethod
+    def _metadata(schema):
+        """Return the metadata given to put() from the schema of a file."""
+        return {
+            k.decode("utf-8"): v.decode("utf-8")
+            for k, v in (schema.metadata or {}).items()
+            if not k.startswith(b"pandas")
+        }
+
+    def put(self, key, df, **metadata):
+        """Store a DataFrame, with string metadata, and evict entries if the cache is full."""
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        schema_metadata = dict(table.schema.metadata or {})
+        schema_metadata.update({k.encode("utf-8"): str(v).encode("utf-8") for k, v in metadata.items()})
+        table = table.replace_schema_metadata(schema_metadata)
+        path = self._path(key)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        pq.write_table(table, temporary)
+        os.replace(temporary, path)
+        self._count("writes")
+        self.evict()
+
+    def delete(self, key):
+        """Remove an entry."""
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def invalidate(self, stale):
+        """Remove the entries for which stale(metadata dict) is true, return how many.
+
+        Only the schema of each file is read, not the result.
+        """
+        removed = 0
+        for _, _, _, path in self.entries():
+            try:
+                schema = pq.read_schema(path)
+            except (OSError, pa.ArrowException):  # Removed by another process.
+                continue
+            if stale(self._metadata(schema)):
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def entries(self):
+        """Return (access time, write time, bytes, path) for every entry."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".parquet"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:  # Evicted by another process.
+                continue
+            entries.append((stat.st_atime, stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Remove expired entries and then the least recently used until within the limits."""
+        now = time.time()
+        entries = []
+        for entry in self.entries():
+            if now - entry[1] > self.ttl:
+                self._remove(entry[3])
+            else:
+                entries.append(entry)
+        entries.sort()
+        size = sum(i[2] for i in entries)
+        while entries and (len(entries) > self.max_entries or size > self.max_bytes):
+            _, _, bytes_, path = entries.pop(0)
+            self._remove(path)
+            size -= bytes_
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            self._count("evictions")
+        except FileNotFoundError:
+            pass
+
+    def status(self):
+        """Return a dict with the counters and the size of the cache."""
+        entries = self.entries()
+        return {
+            "entries": len(entries),
+            "bytes": sum(i[2] for i in entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
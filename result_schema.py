@@ -0,0 +1,59 @@
+""" Compact column types for search results.
+
+Results are kept in memory for every search that is shown, so the columns
+get types that take little space and are quick to filter: categoricals for
+columns with few different values, small integers for years and real dates.
+Years are nullable, since speeches without a date may have none.
+"""
+
+import pandas as pd
+
+# Columns with few different values, stored as categoricals.
+category_columns = ["Parti", "debatetype", "Talare", "dok_id"]
+
+
+def compact(df):
+    """Return a result frame with compact column types and one row per talk_id."""
+    df = df.drop_duplicates("talk_id", ignore_index=True)
+    types = {i: "category" for i in category_columns if i in df.columns}
+    if "År" in df.columns:
+        types["År"] = "Int16"
+    df = df.astype(types)
+    if "Datum" in df.columns:
+        df["Datum"] = pd.to_datetime(df["Datum"])
+    return df
+
+
+def concat(frames):
+    """Concatenate result frames, keeping the categorical columns categorical.
+
+    The frames are read page by page, so the same column has different
+    categories in each. They are given the union of them before concatenating.
+    """
+    frames = [i for i in frames if len(i.columns) > 0]
+    if frames == []:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0]
+    for column in category_columns:
+        if not all(
+            column in i.columns and isinstance(i[column].dtype, pd.CategoricalDtype)
+            for i in frames
+        ):
+            continue
+        categories = pd.api.types.union_categoricals(
+            [i[column] for i in frames], sort_categories=True
+        ).categories
+        frames = [i.assign(**{column: i[column].cat.set_categories(categories)}) for i in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def memory_report(df):
+    """Return the memory used by a result frame, in bytes per column and in total."""
+    usage = df.memory_usage(deep=True, index=True)
+    return {
+        "rows": len(df),
+        "bytes": int(usage.sum()),
+        "bytes_per_row": round(usage.sum() / max(len(df), 1), 1),
+        "columns": {str(i): int(v) for i, v in usage.items()},
+    }
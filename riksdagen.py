@@ -0,0 +1,224 @@
+""" Client for the open data API of the Riksdag, data.riksdagen.se.
+
+Answers are kept as JSON files in a cache directory for cache_ttl seconds,
+keyed by dok_id or intressent_id, so each protocol and person is only fetched
+once. One requests.Session with retries and timeouts is shared, and prefetch
+fetches protocols and persons for the rows on screen in background threads,
+at most one fetch per protocol or person at a time.
+
+The base URL can be changed, e.g. to run against a local stand-in server.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (
+    riksdagen_cache_dir,
+    riksdagen_cache_ttl,
+    riksdagen_timeout,
+    riksdagen_url,
+)
+
+
+def member_url(sorteringsnamn, intressent_id):
+    """Return the URL of a person's page at riksdagen.se."""
+    name = sorteringsnamn.lower().replace(",", "-").replace(" ", "-")
+    return f"https://www.riksdagen.se/sv/ledamoter-partier/ledamot/{name}_{intressent_id}"
+
+
+class RiksdagenClient:
+    """Fetches documents and persons from data.riksdagen.se.
+
+    Args:
+        base_url (str): URL of the API.
+        cache_dir (str): Directory for cached answers, None for no cache.
+        cache_ttl (float): Seconds an answer is kept in the cache.
+        timeout (float): Seconds to wait for the server.
+        retries (int): Times to retry failed requests.
+        workers (int): Threads (and pooled connections) for prefetching.
+    """
+
+    def __init__(
+        self,
+        base_url=riksdagen_url,
+        cache_dir=riksdagen_cache_dir,
+        cache_ttl=riksdagen_cache_ttl,
+        timeout=riksdagen_timeout,
+        retries=3,
+        workers=8,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.cache_dir = cache_dir
+        self.cache_ttl = cache_ttl
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="riksdagen")
+        self.pending = {}  # (kind, key) -> future of a prefetch that is not done.
+        # Reentrant, the callback of a fetch that is already done runs in _prefetch.
+        self._pending_lock = threading.RLock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_path(self, kind, key):
+        return os.path.join(self.cache_dir, f"{kind}_{re.sub(r'[^A-Za-z0-9-]', '_', key)}.json")
+
+    def _read_cache(self, kind, key):
+        if self.cache_dir is None:
+            return None
+        path = self._cache_path(kind, key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.cache_ttl:
+                return None
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _cached(self, kind, key):
+        """Return True if an answer is in the cache and not expired."""
+        if self.cache_dir is None:
+            return False
+        try:
+            return time.time() - os.path.getmtime(self._cache_path(kind, key)) <= self.cache_ttl
+        except OSError:
+            return False
+
+    def _write_cache(self, kind, key, data):
+        if self.cache_dir is None:
+            return
+        path = self._cache_path(kind, key)
+        # Write to a temporary file first, so other threads never read half a file.
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(temporary, path)
+
+    def get_json(self, kind, key, path, params=None):
+        """Return the JSON answer for a path, from the cache if it is there.
+
+        Args:
+            kind (str): Type of answer, e.g. "document", part of the cache key.
+            key (str): Id of what is fetched, e.g. a dok_id.
+            path (str): Path of the API, e.g. "/dokument/H90950.json".
+            params (dict): Query parameters.
+
+        Returns:
+            The parsed JSON.
+        """
+        data = self._read_cache(kind, key)
+        if data is None:
+            response = self.session.get(
+                f"{self.base_url}{path}", params=params, timeout=self.timeout
+            )
+            response.raise_for_status()
+            data = response.json()
+            self._write_cache(kind, key, data)
+        return data
+
+    def document(self, dok_id):
+        """Return the document list answer for a dok_id."""
+        return self.get_json("document", dok_id, f"/dokument/{dok_id}.json")
+
+    def person(self, intressent_id):
+        """Return the data about a person."""
+        data = self.get_json(
+            "person",
+            intressent_id,
+            "/personlista/",
+            {"iid": intressent_id, "utformat": "json"},
+        )
+        return data["personlista"]["person"]
+
+    def speeches(self, riksmote, size=100000, since=None):
+        """Return the speeches of a riksmöte, e.g. "2023/24".
+
+        The list grows during the riksmöte, so it is never cached. Speeches
+        listed without their text are fetched one by one, those are cached.
+
+        Args:
+            riksmote (str): The riksmöte.
+            size (int): Max speeches in the list.
+            since (str): Date (YYYY-MM-DD) to leave out the speeches before,
+                before any text is fetched. Speeches without a date are kept.
+        """
+        response = self.session.get(
+            f"{self.base_url}/anforandelista/",
+            params={"rm": riksmote, "sz": size, "utformat": "json"},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        speeches = response.json()["anforandelista"].get("anforande") or []
+        if isinstance(speeches, dict):  # A list of one is given as the speech itself.
+            speeches = [speeches]
+        if since is not None:
+            speeches = [i for i in speeches if (i.get("dok_datum") or since)[:10] >= since]
+        for n, speech in enumerate(speeches):
+            if speech.get("anforandetext") is None:
+                key = f"{speech['dok_id']}-{speech['anforande_nummer']}"
+                speeches[n] = self.get_json("speech", key, f"/anforande/{key}/json")["anforande"]
+        return speeches
+
+    def protocol_url(self, dok_id):
+        """Return the URL of the protocol PDF, or of the document if there is none."""
+        url = f"{self.base_url}/dokument/{dok_id}"
+        try:
+            for document in self.document(dok_id)["dokumentlista"]["dokument"]:
+                if document["dok_id"] == dok_id:
+                    for file in document["filbilaga"]["fil"]:
+                        if "prot" in file["namn"]:
+                            url = file["url"]
+        except Exception:  # If there is no url to PDF.
+            pass
+        return url
+
+    def person_url(self, intressent_id):
+        """Return the URL of a person's page at riksdagen.se."""
+        return member_url(self.person(intressent_id)["sorteringsnamn"], intressent_id)
+
+    def _prefetch(self, kind, key, fetch):
+        """Return the future of a prefetch, the one running if there is one."""
+        with self._pending_lock:
+            future = self.pending.get((kind, key))
+            if future is None:
+                future = self.executor.submit(fetch, key)
+                self.pending[(kind, key)] = future
+                future.add_done_callback(lambda _: self._done(kind, key))
+            return future
+
+    def _done(self, kind, key):
+        with self._pending_lock:
+            self.pending.pop((kind, key), None)
+
+    def prefetch(self, dok_ids=(), intressent_ids=()):
+        """Fetch documents and persons into the cache in background threads.
+
+        Returns the futures at once, errors are kept in them and not raised.
+        Those already being fetched get the future of that fetch, and those
+        in the cache are not fetched.
+        """
+        futures = []
+        for kind, keys, fetch in [
+            ("document", dok_ids, self.document),
+            ("person", intressent_ids, self.person),
+        ]:
+            for key in set(keys):
+                if not self._cached(kind, key):
+                    futures.append(self._prefetch(kind, key, fetch))
+        return futures
@@ -0,0 +1,491 @@
+""" Search backends that compile queries to SQL for different databases.
+
+All backends answer a query with exactly the same speeches: every backend
+keeps the LIKE patterns as the final check and only adds what makes them fast
+in its own database (an index, a full text prefilter or a table of talk_ids).
+The LIKE wildcards % and _ in search terms are escaped, so they only match
+themselves.
+
+Queries are compiled to parameterized SQL (a Plan) and the plans are kept in
+an LRU cache, keyed by the normalized query from query.py. Results can be
+fetched in pages with keyset pagination on (datum, anforande_nummer, talk_id).
+
+Run `python search_backends.py migrate` to build the indexes a backend needs,
+or `python search_backends.py copy-to-sqlite` to make a local SQLite copy of
+the database that the "sqlite" backend can run against without a server.
+"""
+
+import functools
+import hashlib
+import re
+import sys
+import time
+from typing import NamedTuple
+
+import pandas as pd
+import sqlalchemy
+
+import db
+from config import db_name, index_path, search_backend, sqlite_path
+from info import export_columns, light_columns
+from query import Term
+from search_index import SearchIndex
+
+# Number of compiled queries to keep per backend.
+plan_cache_size = 256
+
+# Order of the results, also the key for keyset pagination.
+order_columns = ["datum", "anforande_nummer", "talk_id"]
+
+# Characters of text to cut out around a search term, and max terms to cut for.
+excerpt_width = 400
+excerpt_terms = 3
+
+
+class Plan(NamedTuple):
+    """A compiled query, SQL with named parameters as (name, value) pairs."""
+
+    sql: str
+    params: tuple = ()
+
+    def statement(self):
+        """Return the SQL as a statement that can be executed with parameters()."""
+        statement = sqlalchemy.text(self.sql)
+        expanding = [
+            sqlalchemy.bindparam(name, expanding=True)
+            for name, value in self.params
+            if isinstance(value, tuple)
+        ]
+        return statement.bindparams(*expanding)
+
+    def parameters(self):
+        """Return the parameters as a dict."""
+        return dict(self.params)
+
+
+def add_param(params, value):
+    """Add a value to the parameter list and return its placeholder."""
+    name = f"p{len(params)}"
+    params.append((name, value))
+    return f":{name}"
+
+
+def term_text(term):
+    """Return the text a term matches in text_lower, e.g. energi* -> " energi"."""
+    start = "" if term.left_open else " "
+    end = "" if term.right_open else " "
+    return f"{start}{' '.join(term.words)}{end}"
+
+
+def escape_like(text):
+    """Escape the LIKE wildcards % and _, and the escape character itself."""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def like_pattern(term):
+    """Return the LIKE pattern for a term, e.g. energi* -> "% energi%"."""
+    return f"%{escape_like(term_text(term))}%"
+
+
+class SearchBackend:
+    """Base class for search backends.
+
+    A backend compiles queries into SQL and knows which engine and which
+    indexes (migrations) it needs. compile_page(), compile_aggregate() and
+    compile_export() share the cached WHERE clause of the query.
+
+    Args:
+        table (str): The table of speeches.
+        dialect (str): "postgresql" or "sqlite", default from config.py.
+    """
+
+    name = None
+    dialect = None
+
+    def __init__(self, table=db_name, dialect=None):
+        self.table = table
+        if dialect is not None:
+            self.dialect = dialect
+        elif self.dialect is None:
+            self.dialect = "sqlite" if sqlite_path else "postgresql"
+        self.data_version = None  # Of the data read, see reload().
+        # Equal queries share one compiled WHERE clause.
+        self._cached_where = functools.lru_cache(maxsize=plan_cache_size)(
+            self._compile_where
+        )
+
+    @property
+    def max_function(self):
+        """Name of the SQL function giving the largest of its arguments."""
+        return "max" if self.dialect == "sqlite" else "greatest"
+
+    def text_position(self, words, params):
+        """Return SQL for the position of words (as from term_text) in anforandetext, or 0.
+
+        The position is looked for in anforandetext itself, since positions
+        in text_lower are not those in anforandetext. In SQLite this is
+        db.find_words, in Postgres the characters between words are blanked
+        out, which keeps every character in its place.
+        """
+        if self.dialect == "sqlite":
+            return f"find_words(anforandetext, {add_param(params, words)})"
+        text = "' ' || regexp_replace(lower(anforandetext), '\\W|_', ' ', 'g') || ' '"
+        return f"strpos({text}, {add_param(params, words)})"
+
+    def create_engine(self):
+        """Return an engine for the database this backend searches."""
+        return db.create_engine()
+
+    def migrations(self):
+        """Return the SQL statements that build the indexes for this backend."""
+        return []
+
+    def replace_statements(self):
+        """Return SQL to run (before, after) the speeches with talk_id IN :ids are replaced.
+
+        Only indexes that the database does not keep current by itself need any.
+        """
+        return [], []
+
+    def text_predicate(self, term, params, column="text_lower", negate=False):
+        """Return the SQL condition for one search term."""
+        like = "NOT LIKE" if negate else "LIKE"
+        pattern = like_pattern(term)
+        # Only escaped patterns get an ESCAPE clause, FTS5 can't use its index with one.
+        escape = " ESCAPE '\\'" if "\\" in pattern else ""
+        return f"{column} {like} {add_param(params, pattern)}{escape}"
+
+    def text_where(self, query, params, column="text_lower"):
+        """Return the condition on the text for a query, or None if there is none."""
+        conditions = [self.text_predicate(i, params, column) for i in query.required]
+        for group in query.any_of:
+            predicates = [self.text_predicate(i, params, column) for i in group]
+            conditions.append(f"({' OR '.join(predicates)})")
+        conditions += [
+            self.text_predicate(i, params, column, negate=True) for i in query.excluded
+        ]
+        if conditions == []:
+            return None
+        return " AND ".join(conditions)
+
+    def where(self, query, params):
+        """Return the WHERE clause for a query.
+
+        Args:
+            query (Query): A query as returned by parse_query.
+            params (list): List to add the parameters of the clause to.
+
+        Returns:
+            str: A SQL condition.
+        """
+        if query.speaker is not None:
+            return f"talare = {add_param(params, query.speaker)}"
+        conditions = [self.text_where(query, params)]
+        if query.years is not None:
+            start, end = (add_param(params, i) for i in query.years)
+            conditions.append(f"year BETWEEN {start} AND {end}")
+        return " AND ".join(i for i in conditions if i is not None) or "1 = 1"
+
+    def excerpt(self, query, params):
+        """Return a SQL expression cutting out the text around the first hit of each term.
+
+        The excerpts are enough to make snippets from, so the full text only
+        has to be fetched when someone wants to read the whole speech. Hits
+        are looked for with text_position.
+        """
+        terms = [] if query.speaker is not None else list(query.required)
+        for group in query.any_of:
+            terms += group
+        if terms == []:
+            return f"substr(anforandetext, 1, {excerpt_width})"
+        excerpts = []
+        for term in terms[:excerpt_terms]:
+            position = self.text_position(term_text(term), params)
+            if len(term.words) > 1:
+                # If markup or punctuation splits the phrase, the first word will do.
+                first = self.text_position(term_text(Term(term.words[:1], term.left_open)), params)
+                position = f"COALESCE(NULLIF({position}, 0), {first})"
+            start = f"{self.max_function}({position} - {excerpt_width}, 1)"
+            excerpts.append(f"substr(anforandetext, {start}, {2 * excerpt_width})")
+        return " || ' ... ' || ".join(excerpts)
+
+    def plan_key(self):
+        """Return what a compiled WHERE clause depends on besides the query."""
+        return ()
+
+    def compile_where(self, query):
+        """Return the WHERE clause of a query as a Plan, compiled once per query and plan_key()."""
+        return self._cached_where(query, self.plan_key())
+
+    def clear_plans(self):
+        """Forget the compiled WHERE clauses."""
+        self._cached_where.cache_clear()
+
+    def reload(self, data_version=None):
+        """Forget what was read from the database, after sync.py changed it.
+
+        Args:
+            data_version (tuple): The version of the data now, see sync.data_version.
+        """
+        self.clear_plans()
+        self.data_version = data_version
+
+    def _compile_where(self, query, key):
+        params = []
+        where = self.where(query, params)
+        return Plan(where, tuple(params))
+
+    def compile_aggregate(self, query):
+        """Return a Plan counting the speeches matching the query per party, year and debate type keys."""
+        where = self.compile_where(query)
+        sql = f"""SELECT party_id AS "Parti", year AS "År", debate_type_id AS debatetype, COUNT(DISTINCT talk_id) AS "Antal"
+            FROM {self.table} WHERE {where.sql} GROUP BY party_id, year, debate_type_id"""
+        return Plan(sql, where.params)
+
+    def compile_page(self, query, page_size, after=None):
+        """Return a Plan for one page of speeches matching the query.
+
+        The page has the light columns and an excerpt instead of the full text.
+
+        Args:
+            query (Query): A query as returned by parse_query.
+            page_size (int): Max number of speeches on the page.
+            after (tuple): Values of order_columns for the last speech on the
+                previous page, or None for the first page.
+
+        Returns:
+            Plan: The compiled page query.
+        """
+        where = self.compile_where(query)
+        sql, params = where.sql, list(where.params)
+        if after is not None:
+            values = ", ".join(add_param(params, i) for i in after)
+            sql = f"({sql}) AND ({', '.join(order_columns)}) > ({values})"
+        columns = f"{light_columns}, {self.excerpt(query, params)} AS excerpt"
+        sql = f"SELECT {columns} FROM {self.table} WHERE {sql} ORDER BY {', '.join(order_columns)} LIMIT {int(page_size)}"
+        return Plan(sql, tuple(params))
+
+    def compile_export(self, query):
+        """Return a Plan for all speeches matching the query, with the full text, for export."""
+        where = self.compile_where(query)
+        sql = f"""SELECT {export_columns} FROM {self.table} WHERE {where.sql}
+            ORDER BY {', '.join(order_columns)}"""
+        return Plan(sql, where.params)
+
+    def compile_full_texts(self, talk_ids):
+        """Return a Plan fetching the full text of the given speeches."""
+        sql = f"SELECT talk_id, anforandetext FROM {self.table} WHERE talk_id IN :p0"
+        return Plan(sql, (("p0", tuple(talk_ids)),))
+
+
+class LikeBackend(SearchBackend):
+    """Plain LIKE scans over text_lower, works in any database."""
+
+    name = "like"
+
+
+class PostgresBackend(SearchBackend):
+    """Postgres with GIN indexes on text_lower.
+
+    Exact words and phrases get a tsvector prefilter, which the GIN index on
+    to_tsvector('simple', text_lower) answers. All LIKE patterns, including
+    affixes and exclusions, can use the pg_trgm index on text_lower.
+    """
+
+    name = "postgres"
+    dialect = "postgresql"
+    plain_word = re.compile(r"^\w+$")
+
+    def migrations(self):
+        return [
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+            f"CREATE INDEX IF NOT EXISTS {self.table}_text_lower_trgm ON {self.table} USING gin (text_lower gin_trgm_ops)",
+            f"CREATE INDEX IF NOT EXISTS {self.table}_text_lower_tsv ON {self.table} USING gin (to_tsvector('simple', text_lower))",
+            f"CREATE INDEX IF NOT EXISTS {self.table}_year ON {self.table} (year)",
+            f"CREATE INDEX IF NOT EXISTS {self.table}_order ON {self.table} ({', '.join(order_columns)})",
+            f"ANALYZE {self.table}",
+        ]
+
+    def text_predicate(self, term, params, column="text_lower", negate=False):
+        predicate = super().text_predicate(term, params, column, negate)
+        # Only exact words and phrases are tokenized the same way by to_tsvector.
+        if negate or term.left_open or term.right_open:
+            return predicate
+        if not all(self.plain_word.match(i) for i in term.words):
+            return predicate
+        # plainto_tsquery ignores word order, so it never removes a LIKE match.
+        tsquery = f"plainto_tsquery('simple', {add_param(params, ' '.join(term.words))})"
+        return f"(to_tsvector('simple', {column}) @@ {tsquery} AND {predicate})"
+
+
+class SQLiteBackend(SearchBackend):
+    """SQLite with an FTS5 trigram table, for running the app without a server.
+
+    The trigram tokenizer lets FTS5 answer the same LIKE patterns as pg_trgm
+    does in Postgres, so the hits are the same.
+    """
+
+    name = "sqlite"
+    dialect = "sqlite"
+
+    def create_engine(self):
+        if sqlite_path is None:
+            raise ValueError("The sqlite backend needs sqlite_path in config.py.")
+        return db.create_engine()
+
+    def migrations(self):
+        return [
+            f"DROP TABLE IF EXISTS {self.table}_fts",
+            f"CREATE VIRTUAL TABLE {self.table}_fts USING fts5(text_lower, content='{self.table}', tokenize='trigram')",
+            f"INSERT INTO {self.table}_fts(rowid, text_lower) SELECT rowid, text_lower FROM {self.table}",
+            f"CREATE INDEX IF NOT EXISTS {self.table}_year ON {self.table} (year)",
+            f"CREATE INDEX IF NOT EXISTS {self.table}_talk_id ON {self.table} (talk_id)",
+            f"CREATE INDEX IF NOT EXISTS {self.table}_order ON {self.table} ({', '.join(order_columns)})",
+        ]
+
+    def replace_statements(self):
+        # The FTS table has no content of its own, old text must be deleted explicitly.
+        fts = f"{self.table}_fts"
+        select = f"SELECT rowid, text_lower FROM {self.table} WHERE talk_id IN :ids"
+        return (
+            [f"INSERT INTO {fts}({fts}, rowid, text_lower) SELECT 'delete', rowid, text_lower FROM {self.table} WHERE talk_id IN :ids"],
+            [f"INSERT INTO {fts}(rowid, text_lower) {select}"],
+        )
+
+    def text_where(self, query, params, column="text_lower"):
+        # Match the text in the FTS table and look the rowids up in the list of
+        # matches. The + keeps SQLite from reading the table by that list, it
+        # reads it by the order index instead and stops after a page. Read by
+        # rowid, every match would be sorted, with its excerpt, on every page.
+        text_where = super().text_where(query, params, f"{self.table}_fts.text_lower")
+        if text_where is None:
+            return None
+        return f"+rowid IN (SELECT rowid FROM {self.table}_fts WHERE {text_where})"
+
+
+class IndexBackend(SearchBackend):
+    """Looks up the matching talk_ids in the search index (see search_index.py).
+
+    The talk_ids of a query are written once to the table {table}_hits and
+    the SQL reads them from there, so they are not sent with every page. They
+    are keyed by the query, the version of the index and the period they were
+    written in: an updated index gives new keys, and hits are removed two
+    periods after they were written, when no plan can use them any more.
+
+    Args:
+        table (str): The table of speeches.
+        dialect (str): "postgresql" or "sqlite", default from config.py.
+        index (SearchIndex): The index, default read from index_path in config.py.
+        engine (Engine): The database, default made by create_engine().
+    """
+
+    name = "index"
+    # Seconds new plans use the same hits.
+    hits_period = 6 * 3600
+
+    def __init__(self, table=db_name, dialect=None, index=None, engine=None):
+        super().__init__(table, dialect)
+        self.index = index or SearchIndex.load(index_path)
+        self.engine = engine
+        self.hits_table = f"{table}_hits"
+
+    def create_engine(self):
+        # One engine for the hits and the searches.
+        if self.engine is None:
+            self.engine = super().create_engine()
+        return self.engine
+
+    def hits_tables(self):
+        """Return the SQL creating the hits table, if it is not there."""
+        return [
+            f"CREATE TABLE IF NOT EXISTS {self.hits_table} (query_key VARCHAR, period INTEGER, talk_id VARCHAR)",
+            f"CREATE INDEX IF NOT EXISTS {self.hits_table}_key ON {self.hits_table} (query_key)",
+        ]
+
+    def migrations(self):
+        return self.hits_tables() + [
+            f"CREATE INDEX IF NOT EXISTS {self.table}_talk_id ON {self.table} (talk_id)",
+        ]
+
+    def reload(self, data_version=None):
+        """Read the index from index_path again, e.g. after sync.py updated it."""
+        self.index = SearchIndex.load(index_path)
+        super().reload(data_version)
+
+    def plan_key(self):
+        return self.index.version, int(time.time() // self.hits_period)
+
+    def store_hits(self, query, batch_size=10000):
+        """Write the talk_ids matching a query to the hits table, unless there, and return their key."""
+        period = int(time.time() // self.hits_period)
+        text = repr((self.index.version, period, tuple(query)))
+        key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        select = sqlalchemy.text(f"SELECT 1 FROM {self.hits_table} WHERE query_key = :key LIMIT 1")
+        insert = sqlalchemy.table(
+            self.hits_table, *(sqlalchemy.column(i) for i in ["query_key", "period", "talk_id"])
+        ).insert()
+        with self.create_engine().begin() as conn:
+            for statement in self.hits_tables():
+                conn.exec_driver_sql(statement)
+            if conn.execute(select, {"key": key}).first() is not None:
+                return key
+            conn.execute(
+                sqlalchemy.text(f"DELETE FROM {self.hits_table} WHERE period < :oldest"),
+                {"oldest": period - 2},
+            )
+            rows = [{"query_key": key, "period": period, "talk_id": i} for i in self.index.search(query)]
+            for n in range(0, len(rows), batch_size):
+                conn.execute(insert, rows[n : n + batch_size])
+        return key
+
+    def where(self, query, params):
+        if query.speaker is not None:
+            return super().where(query, params)
+        key = add_param(params, self.store_hits(query))
+        return f"talk_id IN (SELECT talk_id FROM {self.hits_table} WHERE query_key = {key})"
+
+
+backends = {
+    i.name: i for i in [LikeBackend, PostgresBackend, SQLiteBackend, IndexBackend]
+}
+
+
+def get_backend(name=search_backend):
+    """Return the search backend with the given name (default from config.py)."""
+    try:
+        return backends[name]()
+    except KeyError:
+        raise ValueError(f"Unknown search backend {name}, use one of {list(backends)}.")
+
+
+def migrate(backend):
+    """Build the indexes the backend needs."""
+    engine = backend.create_engine()
+    with engine.begin() as conn:
+        for statement in backend.migrations():
+            print(statement)
+            conn.exec_driver_sql(statement)
+
+
+def copy_to_sqlite(tables=(db_name, "persons"), chunksize=10000):
+    """Copy tables from the Postgres database to the SQLite file in config.py."""
+    source = db.create_engine(db.postgres_url())
+    target = SQLiteBackend().create_engine()
+    for table in tables:
+        if_exists = "replace"
+        with source.connect().execution_options(stream_results=True) as conn:
+            for chunk in pd.read_sql(
+                sqlalchemy.text(f"SELECT * FROM {table}"), conn, chunksize=chunksize
+            ):
+                chunk.to_sql(table, target, if_exists=if_exists, index=False)
+                if_exists = "append"
+                print(f"{table}: {len(chunk)} rows copied.")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    if command == "copy-to-sqlite":
+        copy_to_sqlite()
+        migrate(SQLiteBackend())
+    else:
+        migrate(get_backend(sys.argv[2] if len(sys.argv) > 2 else search_backend))
@@ -0,0 +1,265 @@
+""" Positional inverted index over the speeches.
+
+The index maps every word in text_lower to the speeches it occurs in and the
+token positions within each speech. It answers the same queries as the SQL
+search backends (see query.py) and returns talk_ids, so the database only has to
+fetch the matching rows by primary key instead of scanning the text column.
+
+Build it with `python search_index.py` and point config.index_path at the file.
+"""
+
+import bisect
+import os
+import pickle
+import uuid
+from array import array
+
+import pandas as pd
+import sqlalchemy
+
+import db
+from config import db_name, index_path
+
+
+class SearchIndex:
+    """Positional inverted index, word -> speeches -> token positions.
+
+    Speeches are tokenized by splitting text_lower on single blanks, the same
+    way the LIKE patterns in search_backends.py see the text, so a search gives
+    the same hits as the SQL query would. The version changes whenever
+    speeches are added or removed.
+    """
+
+    def __init__(self):
+        self.version = uuid.uuid4().hex
+        self.talk_ids = []  # Document number -> talk_id.
+        self.years = array("H")  # Document number -> year.
+        self.lengths = array("I")  # Document number -> number of tokens.
+        # Word -> (document numbers, start of each document in positions, positions).
+        self.postings = {}
+        self._building = {}
+        self._vocabulary = []
+        self._vocabulary_reversed = []
+
+    def __len__(self):
+        return len(self.talk_ids)
+
+    def add(self, talk_id, year, text_lower):
+        """Add one speech to the index. Call finish() when all are added."""
+        docno = len(self.talk_ids)
+        tokens = text_lower.split(" ")
+        self.talk_ids.append(talk_id)
+        self.years.append(int(year))
+        self.lengths.append(len(tokens))
+        for position, token in enumerate(tokens):
+            if token == "":
+                continue
+            docs = self._building.setdefault(token, {})
+            if docno in docs:
+                docs[docno].append(position)
+            else:
+                docs[docno] = array("I", [position])
+
+    def finish(self):
+        """Pack the postings into flat arrays and sort the vocabulary."""
+        for word, docs in self._building.items():
+            if word in self.postings:  # Merge with postings from an earlier build.
+                docs.update(self._unpack(word))
+            self.postings[word] = self._pack(docs)
+        self._building = {}
+        self._sort_vocabulary()
+        self.version = uuid.uuid4().hex
+
+    def remove(self, speeches):
+        """Remove speeches from the index, e.g. before adding new versions of them.
+
+        Args:
+            speeches (dict): talk_id -> the text_lower the speech was indexed with.
+        """
+        docnos = {i for i, talk_id in enumerate(self.talk_ids) if talk_id in speeches}
+        words = set()
+        for docno in docnos:
+            words.update(speeches[self.talk_ids[docno]].split(" "))
+            self.talk_ids[docno] = None  # The document number is not reused.
+        for word in words & self.postings.keys():
+            docs = {k: v for k, v in self._unpack(word).items() if k not in docnos}
+            if docs:
+                self.postings[word] = self._pack(docs)
+            else:
+                del self.postings[word]
+        self._sort_vocabulary()
+        self.version = uuid.uuid4().hex
+
+    def _unpack(self, word):
+        """Return {document number: positions} for a word."""
+        docnos, starts, positions = self.postings[word]
+        return {docno: positions[starts[i] : starts[i + 1]] for i, docno in enumerate(docnos)}
+
+    @staticmethod
+    def _pack(docs):
+        """Return {document number: positions} as flat arrays."""
+        docnos = array("I", sorted(docs))
+        starts = array("I", [0])
+        positions = array("I")
+        for docno in docnos:
+            positions.extend(docs[docno])
+            starts.append(len(positions))
+        return docnos, starts, positions
+
+    def _sort_vocabulary(self):
+        self._vocabulary = sorted(self.postings)
+        self._vocabulary_reversed = sorted(i[::-1] for i in self.postings)
+
+    def save(self, path):
+        """Write the index to disk, replacing the file at once so readers never see half an index."""
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            pickle.dump(
+                (self.talk_ids, self.years, self.lengths, self.postings, self.version),
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by save()."""
+        index = cls()
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        index.talk_ids, index.years, index.lengths, index.postings = data[:4]
+        if len(data) > 4:  # Indexes saved before versions were added keep a new one.
+            index.version = data[4]
+        index._sort_vocabulary()
+        return index
+
+    def _words(self, word, starts_with, ends_with):
+        """Return indexed words matching word, as a prefix and/or suffix if open."""
+        if starts_with and ends_with:
+            return [i for i in self._vocabulary if word in i]
+        if starts_with:
+            vocabulary = self._vocabulary
+        elif ends_with:
+            vocabulary = self._vocabulary_reversed
+            word = word[::-1]
+        else:
+            return [word] if word in self.postings else []
+        start = bisect.bisect_left(vocabulary, word)
+        end = bisect.bisect_left(vocabulary, word + "\uffff")
+        words = vocabulary[start:end]
+        return words if starts_with else [i[::-1] for i in words]
+
+    def _positions(self, words):
+        """Return {document number: set of positions} for any of the words."""
+        hits = {}
+        for word in words:
+            docnos, starts, positions = self.postings[word]
+            for i, docno in enumerate(docnos):
+                hits.setdefault(docno, set()).update(positions[starts[i] : starts[i + 1]])
+        return hits
+
+    def match_term(self, term):
+        """Return the set of document numbers matching a single search term.
+
+        A word without asterix must have a blank on both sides (as in the SQL
+        pattern '% word %'), so it can't be the first or last token of a speech.
+        """
+        words, left_open, right_open = term
+
+        # Find the matching positions for every word in the term.
+        parts = []
+        for n, word in enumerate(words):
+            first, last = n == 0, n == len(words) - 1
+            if first and last:
+                matching = self._words(word, right_open, left_open)
+            elif first:
+                matching = self._words(word, False, left_open)
+            elif last:
+                matching = self._words(word, right_open, False)
+            else:
+                matching = self._words(word, False, False)
+            parts.append(self._positions(matching))
+            if parts[-1] == {}:
+                return set()
+
+        docs = set(parts[0])
+        for part in parts[1:]:
+            docs &= part.keys()
+
+        # Check that the words are in sequence and have blanks around them.
+        hits = set()
+        for docno in docs:
+            last_position = self.lengths[docno] - 1
+            for position in parts[0][docno]:
+                if not left_open and position == 0:
+                    continue
+                if not right_open and position + len(words) - 1 >= last_position:
+                    continue
+                if all(position + n in part[docno] for n, part in enumerate(parts)):
+                    hits.add(docno)
+                    break
+        return hits
+
+    def search(self, query):
+        """Return the talk_ids of the speeches matching the query.
+
+        Args:
+            query (Query): A query as returned by parse_query.
+
+        Returns:
+            list: Matching talk_ids, in the order they were indexed.
+        """
+        docs = None
+        groups = [[term] for term in query.required] + list(query.any_of)
+        for group in groups:
+            hits = set()
+            for term in group:
+                hits |= self.match_term(term)
+            docs = hits if docs is None else docs & hits
+            if not docs:
+                return []
+        if docs is None:
+            docs = set(range(len(self)))
+
+        for term in query.excluded:
+            docs -= self.match_term(term)
+
+        if query.years is not None:
+            start, end = query.years
+            docs = {i for i in docs if start <= self.years[i] <= end}
+
+        return [self.talk_ids[i] for i in sorted(docs) if self.talk_ids[i] is not None]
+
+
+def build_index(engine, chunksize=10000, verbose=False):
+    """Build an index over all speeches in the database.
+
+    text_lower is assumed to be as ingest.normalize_text makes it: the words
+    of query.split_words joined by single blanks, with a blank at each end.
+    The words of the searches are split the same way, so a word next to
+    punctuation, e.g. "e-post" or "talman!", is found like in the SQL backends.
+
+    Args:
+        engine (Engine): SQLAlchemy engine for the database.
+        chunksize (int): Number of speeches to read at a time.
+        verbose (bool): Print the progress.
+
+    Returns:
+        SearchIndex: The finished index.
+    """
+    index = SearchIndex()
+    sql = f"SELECT talk_id, year, text_lower FROM {db_name}"
+    with engine.connect().execution_options(stream_results=True) as conn:
+        for chunk in pd.read_sql(sqlalchemy.text(sql), conn, chunksize=chunksize):
+            for talk_id, year, text_lower in chunk.itertuples(index=False):
+                # Speeches without a year get 0, like in sync.py (NULL is read as NaN).
+                index.add(talk_id, 0 if pd.isna(year) else year, text_lower or "")
+            if verbose:
+                print(f"{len(index)} speeches indexed.")
+    index.finish()
+    return index
+
+
+if __name__ == "__main__":
+    engine = db.create_engine()
+    build_index(engine, verbose=True).save(index_path or "search_index.pickle")
@@ -0,0 +1,264 @@
+""" Snippets, short and long extracts of speeches around the words searched for.
+
+All search terms are compiled into one regular expression, so each speech is
+scanned once for all terms and both snippets are cut from that single pass.
+"""
+
+import re
+
+from query import make_term
+
+# Phrases to remove from the start of speeches before making snippets.
+salutations = ["Fru talman! ", "Herr talman! "]
+
+
+def term_pattern(term):
+    """Return a regular expression for the words of a Term, without the word boundaries.
+
+    The words may be separated by anything that is not a word, as in
+    query.split_words. Starting with a literal lets the regex engine skip
+    quickly to possible matches, the boundaries are checked afterwards in
+    SnippetMatcher.
+    """
+    return r"[\W_]+".join(re.escape(i) for i in term.words)
+
+
+def context(text, start, end, words_before, words_after):
+    """Return the text from start to end with some words before and after."""
+    left = start
+    for _ in range(words_before):
+        i = text.rfind(" ", 0, max(left - 1, 0))
+        if i == -1:
+            left = 0
+            break
+        left = i + 1
+    right = end
+    for _ in range(words_after):
+        i = text.find(" ", right + 1)
+        if i == -1:
+            right = len(text)
+            break
+        right = i
+    return text[left:right].strip()
+
+
+class SnippetMatcher:
+    """Makes snippets for a set of search terms.
+
+    Args:
+        search_terms (list): Terms as returned by Query.snippet_terms, or "speaker"
+            to get the beginning of each speech.
+    """
+
+    def __init__(self, search_terms):
+        self.terms = []
+        if search_terms != "speaker":
+            self.terms = [i for i in (make_term(i) for i in search_terms) if i is not None]
+        self._patterns = {}
+        # Words of context, fewer per term the more terms there are.
+        self.words = max(int(8 / max(len(self.terms), 1)), 1)
+
+    def pattern(self, numbers, ignorecase=False):
+        """Return one regex matching any of the terms with the given numbers."""
+        key = (frozenset(numbers), ignorecase)
+        if key not in self._patterns:
+            # Longer terms first, so they win over terms they contain.
+            order = sorted(numbers, key=lambda n: -len(term_pattern(self.terms[n])))
+            self._patterns[key] = re.compile(
+                "|".join(f"(?P<t{n}>{term_pattern(self.terms[n])})" for n in order),
+                re.IGNORECASE if ignorecase else 0,
+            )
+        return self._patterns[key]
+
+    def finditer(self, text, numbers=None, pos=0, lower=None):
+        """Yield (start, end, term number) for the matches in the text.
+
+        A side of a term without asterix must be at a word boundary, an open
+        side is extended to the whole word. Matches overlapping an earlier
+        one, e.g. of another term in the same word, are skipped.
+
+        Args:
+            text (str): The text to search.
+            numbers (iterable): Numbers of the terms to look for, default all.
+            pos (int): Position in the text to start at.
+            lower (str): text.lower(), if already made.
+        """
+        numbers = range(len(self.terms)) if numbers is None else numbers
+        if len(numbers) == 0:
+            return
+        if lower is None:
+            lower = text.lower()
+        if len(lower) == len(text):
+            matches = self.pattern(numbers).finditer(lower, pos)
+        else:  # Lower case changed the length, so the positions would be wrong.
+            matches = self.pattern(numbers, ignorecase=True).finditer(text, pos)
+        previous_end = pos
+        for match in matches:
+            n = int(match.lastgroup[1:])
+            term = self.terms[n]
+            start, end = match.span()
+            if term.left_open:
+                while start > 0 and text[start - 1].isalnum():
+                    start -= 1
+            elif start > 0 and text[start - 1].isalnum():
+                continue
+            if term.right_open:
+                while end < len(text) and text[end].isalnum():
+                    end += 1
+            elif end < len(text) and text[end].isalnum():
+                continue
+            if start < previous_end:
+                continue
+            previous_end = end
+            yield start, end, n
+
+    def matches(self, text):
+        """Return (start, end, term number) for every match in the text."""
+        return list(self.finditer(text))
+
+    def first_matches(self, text):
+        """Return {term number: (start, end)} for the first match of each term.
+
+        The text is read once from the start. When a term is found the scan
+        goes on from there with a regex for the terms not found yet.
+        """
+        first = {}
+        remaining = set(range(len(self.terms)))
+        pos = 0
+        lower = text.lower()
+        while remaining:
+            for start, end, n in self.finditer(text, remaining, pos, lower):
+                first[n] = (start, end)
+                remaining.discard(n)
+                pos = end
+                break
+            else:
+                break
+        return first
+
+    def snippets(self, text):
+        """Return the short snippet, the long snippet and the matches for one text.
+
+        The matches are (start, end, term number) of the first match of each
+        term, in the text after the salutation is removed.
+        """
+        for salutation in salutations:
+            text = text.replace(salutation, "")
+        first = self.first_matches(text)
+        if first == {}:
+            short = text[:80] + ("..." if len(text) > 80 else "")
+            long = text[:300] + ("..." if len(text) > 300 else "")
+            return short, long, []
+
+        spans = [first[n] for n in sorted(first)]
+        short = "|".join(context(text, s, e, self.words, self.words // 2) for s, e in spans)
+        long = "|".join(context(text, s, e, self.words * 4, self.words * 2) for s, e in spans)
+        matches = [(*first[n], n) for n in sorted(first)]
+        return f"...{short}...", f"...{long}...", matches
+
+
+def make_snippets(texts, search_terms):
+    """Make short and long snippets for many texts.
+
+    Args:
+        texts (iterable): The texts, e.g. a column of a DataFrame.
+        search_terms (list): Terms as returned by Query.snippet_terms, or "speaker".
+
+    Returns:
+        tuple: List of short snippets and list of long snippets.
+    """
+    matcher = SnippetMatcher(search_terms)
+    short, long = [], []
+    for text in texts:
+        s, l, _ = matcher.snippets(text or "")
+        short.append(s)
+        long.append(l)
+    return short, long
+
+
+def highlight(text, matches, start_tag="<b>", end_tag="</b>"):
+    """Return the text with the matches (as from SnippetMatcher.matches) wrapped in tags."""
+    parts = []
+    position = 0
+    for start, end, _ in matches:
+        parts += [text[position:start], start_tag, text[start:end], end_tag]
+        position = end
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def make_snippet(text, search_terms, long=False):
+    """Find the word searched for and give it some context.
+
+    This is the original one-row-at-a-time version, kept as a reference for
+    benchmarks/bench_snippets.py. Use make_snippets instead.
+    """
+
+    text = text.replace("Fru talman! ", "").replace("Herr talman! ", "")
+    if search_terms == "speaker" or search_terms == []:
+        if long:
+            snippet = str(text[:300])
+            if len(text) > 300:
+                snippet += "..."
+        else:
+            snippet = str(text[:80]) + "..."
+            if len(text) > 80:
+                snippet += "..."
+    else:
+        snippet = []
+        text_lower = text.lower()
+        snippet_lenght = int(8 / len(search_terms))  # * Change to another value?
+        if long:
+            snippet_lenght = snippet_lenght * 4
+        # Make the whole text to a list in lower cases.
+        text_list = text.split(" ")
+        text_list_lower = text_lower.split(" ")
+        # Try to find each for searched for and add to the snippet.
+        for word in search_terms:
+            word = word.replace("*", "").strip().lower()
+            if word in text_list_lower:
+                position = text_list_lower.index(word)
+
+                position_start = position - snippet_lenght
+                if position_start < 0:
+                    position_start = 0
+
+                position_end = position + int(snippet_lenght / 2)
+                if position_end > len(text_list_lower):
+                    position_end = len(text_list_lower) - 1
+                word_context_list = text_list[position_start:position_end]
+
+                snippet.append(" ".join(word_context_list))
+
+            elif word in text_lower:
+                position = text_lower.find(word)
+                # Find start position.
+                if position - snippet_lenght * 5 < 0:
+                    start_snippet = 0
+                else:
+                    start_snippet = text_lower.find(" ", position - snippet_lenght * 5)
+                # Find end position.
+                if position + len(word) + snippet_lenght * 4 > len(text):
+                    end_snippet = len(text)
+                else:
+                    end_snippet = text_lower.find(
+                        " ", position + len(word) + snippet_lenght * 4
+                    )
+                text = text[start_snippet:end_snippet]
+                snippet.append(text)
+
+            else:
+                position = 0
+                for listword in text_list:
+                    position += 1
+                    if word in listword.lower():
+                        word_context_list = text_list[
+                            position
+                            - snippet_lenght : position
+                            + int(snippet_lenght / 2)
+                        ]
+                        snippet.append(" ".join(word_context_list))
+
+        snippet = "|".join(snippet)
+        snippet = f"...{snippet}..."
+    return snippet
@@ -0,0 +1,147 @@
+""" Index of the speakers' names, to tell if a search is for a member.
+
+SpeakerIndex is built once from the persons table. Names and the single words
+in them (e.g. surnames) are kept in a dict for exact lookups and in a sorted
+list for prefix lookups, and misspelled names are found through their
+trigrams and ranked by edit distance.
+"""
+
+import bisect
+
+
+def normalize(name):
+    """Return a name in lower case with single blanks."""
+    return " ".join(name.lower().split())
+
+
+def trigrams(text):
+    """Return the set of trigrams of a text, with blanks added at the ends."""
+    text = f"  {text} "
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def edit_distance(a, b, max_distance):
+    """Return the Levenshtein distance between a and b, or max_distance + 1 if larger."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            )
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+class SpeakerIndex:
+    """Lookups of speakers by name, surname, prefix or misspelled name.
+
+    Args:
+        names (iterable): Pairs of (name, speaker), as in the persons table,
+            where speaker is what the speeches are stored under.
+    """
+
+    def __init__(self, names):
+        self.speakers = {}  # Full name -> speakers.
+        self.words = {}  # Word in a name -> full names.
+        for name, speaker in names:
+            name = normalize(name)
+            if name == "":
+                continue
+            self.speakers.setdefault(name, set()).add(speaker)
+            for word in name.split():
+                self.words.setdefault(word, set()).add(name)
+        self.sorted_names = sorted(self.speakers)
+        # Trigram -> names and words, for finding misspelled ones.
+        self._trigrams = {}
+        for key in set(self.speakers) | set(self.words):
+            for trigram in trigrams(key):
+                self._trigrams.setdefault(trigram, []).append(key)
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build the index from a DataFrame with the columns name and speaker."""
+        return cls(zip(df["name"].astype(str), df["speaker"]))
+
+    def __len__(self):
+        return len(self.speakers)
+
+    def exact(self, text):
+        """Return the speakers with exactly this name, sorted."""
+        return sorted(self.speakers.get(normalize(text), ()))
+
+    def by_word(self, text):
+        """Return the speakers with this word in their name, e.g. a surname."""
+        names = self.words.get(normalize(text), ())
+        return sorted({i for name in names for i in self.speakers[name]})
+
+    def prefix(self, text, limit=10):
+        """Return up to limit names starting with text, in alphabetical order."""
+        text = normalize(text)
+        start = bisect.bisect_left(self.sorted_names, text)
+        names = []
+        for name in self.sorted_names[start : start + limit]:
+            if not name.startswith(text):
+                break
+            names.append(name)
+        return names
+
+    def fuzzy(self, text, limit=5, max_distance=None):
+        """Return up to limit (distance, name or word) close to text, closest first.
+
+        Candidates share at least a third of their trigrams with the text, and
+        are kept if their edit distance is at most max_distance (default a
+        quarter of the length of the text, at least 1).
+        """
+        text = normalize(text)
+        if max_distance is None:
+            max_distance = max(len(text) // 4, 1)
+        shared = {}
+        text_trigrams = trigrams(text)
+        for trigram in text_trigrams:
+            for key in self._trigrams.get(trigram, ()):
+                shared[key] = shared.get(key, 0) + 1
+        minimum = len(text_trigrams) / 3
+        candidates = [key for key, n in shared.items() if n >= minimum]
+        matches = []
+        for key in candidates:
+            distance = edit_distance(text, key, max_distance)
+            if distance <= max_distance:
+                matches.append((distance, key))
+        return sorted(matches)[:limit]
+
+    def find(self, text, min_fuzzy=4):
+        """Return the speakers a search may be for and whether the match is exact.
+
+        A full name is an exact match. Otherwise members with the text as a
+        word in their name, then members whose name starts with the text
+        (e.g. a first name and the start of the surname), and then members
+        with a name or word of a name close to the text, are suggested.
+        Texts shorter than min_fuzzy are not looked up by prefix or fuzzily.
+
+        Returns:
+            tuple: List of speakers and True if the name matched exactly.
+        """
+        speakers = self.exact(text)
+        if speakers != []:
+            return speakers, True
+        if len(normalize(text).split()) == 1:
+            speakers = self.by_word(text)
+            if speakers != []:
+                return speakers, False
+        speakers = []
+        if len(normalize(text)) < min_fuzzy:
+            return speakers, False
+        for name in self.prefix(text):
+            speakers += [i for i in sorted(self.speakers[name]) if i not in speakers]
+        if speakers != []:
+            return speakers, False
+        for _, key in self.fuzzy(text):
+            names = [key] if key in self.speakers else sorted(self.words[key])
+            for name in names:
+                speakers += [i for i in sorted(self.speakers[name]) if i not in speakers]
+        return speakers, False
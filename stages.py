@@ -0,0 +1,115 @@
+""" The steps of a search after the fetch, without Streamlit.
+
+app.py runs them, cached, on the speeches of a search, and
+benchmarks/bench_suite.py times the same functions.
+"""
+
+import pandas as pd
+
+from corpus_stats import per_thousand
+from info import party_colors
+from result_schema import compact
+from snippets import make_snippets
+
+parties = list(party_colors.keys())  # List of partycodes
+
+
+def decode_speeches(df, dimensions):
+    """Turn the keys of party, debate type and speaker into categoricals and keep the known parties."""
+    df = dimensions.decode(df)
+    return df.loc[df["Parti"].isin(parties)]
+
+
+def prepare_data(df, dimensions, search_terms):
+    """Decode a page of data from the DB and add snippets.
+
+    Args:
+        df (DataFrame): Speeches as fetched from the DB, with excerpts of the text.
+        dimensions (Dimensions): The dimension tables, to decode the keys with.
+        search_terms (list): Terms to make snippets from (or "speaker").
+
+    Returns:
+        DataFrame: Dataframe with some adjustments to the data fetched from the DB.
+    """
+    df = decode_speeches(df, dimensions)
+    # Add domain to url.
+    df = df.assign(url_session="https://riksdagen.se" + df["url_session"].astype(str))
+    df = df.sort_values(["Datum", "number"])
+
+    # Make snippets from the excerpts (short and long), the full text is fetched when needed.
+    df["Utdrag"], df["Utdrag_long"] = make_snippets(df["excerpt"], search_terms)
+    df = df.drop(columns="excerpt")
+
+    # One row per speech, with compact column types.
+    return compact(df)
+
+
+def count_speeches(df):
+    """Count speeches per party, year and debate type in a DataFrame of speeches."""
+    counts = (
+        df.groupby(["Parti", "År", "debatetype"], observed=True)["talk_id"]
+        .nunique()
+        .rename("Antal")
+        .reset_index()
+    )
+    # Plain columns like the counts from the DB, to not group on unused categories.
+    return counts.astype({"Parti": str, "År": int, "debatetype": str})
+
+
+def filter_rows(df, facets, selections):
+    """Return the speeches that pass the filters, numbered and in the order they are shown.
+
+    Args:
+        df (DataFrame): The speeches of a search.
+        facets (FacetIndex): The facet index of df.
+        selections (dict): Column -> values to keep.
+    """
+    df = df.loc[facets.mask(selections)]
+    df = df.sort_values(["Datum", "dok_id", "number"])
+    df.index = range(1, df.shape[0] + 1)
+    return df
+
+
+def short_table(df):
+    """Return the table with short snippets and its CSS, made for all cells at once."""
+    table = df[["Utdrag", "Parti"]]
+    colors = table["Parti"].astype(str).map(party_colors)
+    css = pd.DataFrame(
+        {
+            "Utdrag": "",
+            "Parti": ("background-color: " + colors + "; font-weight: 'bold'").fillna(""),
+        },
+        index=table.index,
+    )
+    return table, css
+
+
+def party_counts(counts):
+    """Return the speeches per party, the most first."""
+    return counts.groupby("Parti")["Antal"].sum().sort_values(ascending=False)
+
+
+def year_bars(counts):
+    """Return the speeches per year and party, for the bars of the chart of years."""
+    df_years = counts.groupby(["År", "Parti"], as_index=False)["Antal"].sum()
+    df_years["År"] = df_years["År"].astype(str)
+    df_years["color"] = df_years["Parti"].map(party_colors)
+    return df_years
+
+
+def year_lines(counts, stats, selections):
+    """Return the hits per 1 000 speeches per year and party, for the lines of the chart of years.
+
+    Args:
+        counts (DataFrame): Speeches per party, year and debate type, as from count_speeches.
+        stats (DataFrame): The corpus statistics, decoded like the counts.
+        selections (iterable): Pairs of (column, values to keep), the filters
+            to apply to the statistics too.
+    """
+    for column, values in selections:
+        if column in stats.columns:
+            stats = stats.loc[stats[column].isin(values)]
+    df_years = per_thousand(counts, stats)
+    df_years["År"] = df_years["År"].astype(str)
+    df_years["color"] = df_years["Parti"].map(party_colors)
+    return df_years
@@ -0,0 +1,238 @@
+""" Incremental sync of new speeches into a loaded corpus.
+
+The watermark is the latest (datum, dok_id) in the table. Only speeches from
+the day of the watermark on are read, from archive files or from the API of
+data.riksdagen.se, and of those only the ones that are new or changed are
+written. They are upserted by talk_id, so running a sync twice changes
+nothing. The search indexes and corpus_stats are updated in place, and only
+the cached results whose query matches a new or replaced speech are removed.
+The app notices a sync through data_version, and then reads the updated
+index and starts new searches instead of showing the results it has.
+
+Run `python sync.py anforande-202324.json.zip` to sync from an archive, or
+`python sync.py --riksmote 2023/24` to sync from the API.
+"""
+
+import argparse
+
+import sqlalchemy
+
+import db
+from config import db_name, index_path, result_cache_dir, search_backend
+from corpus_stats import update_stats
+from dimensions import Dimensions, create_tables
+from ingest import (
+    columns,
+    copy_rows,
+    create_table,
+    delete_rows,
+    insert_rows,
+    parse_archive,
+    parse_speech,
+)
+from query import query_from_json
+from result_cache import ResultCache
+from riksdagen import RiksdagenClient
+from search_backends import IndexBackend, get_backend
+from search_index import SearchIndex
+
+# Syncs started and finished, see data_version.
+version_table = "data_version"
+
+
+def watermark(engine, table=db_name):
+    """Return the latest (datum, dok_id) loaded, or None if the table is empty or missing."""
+    if not sqlalchemy.inspect(engine).has_table(table):
+        return None
+    sql = f"""SELECT datum, MAX(dok_id) FROM {table}
+        WHERE datum = (SELECT MAX(datum) FROM {table}) GROUP BY datum"""
+    with engine.connect() as conn:
+        row = conn.execute(sqlalchemy.text(sql)).first()
+    return None if row is None else (str(row[0])[:10], row[1])
+
+
+def newer(rows, mark):
+    """Return the rows from the day of the watermark on.
+
+    The whole day is read again, since speeches of a day can be published
+    after others of the same day. Unchanged ones are skipped when written.
+    """
+    if mark is None:
+        return rows
+    return [i for i in rows if i["datum"] >= mark[0]]
+
+
+def archive_rows(paths):
+    """Return the rows of the speeches in archive files."""
+    rows = {}
+    for path in paths:
+        rows.update((i["talk_id"], i) for i in parse_archive(path))
+    return list(rows.values())
+
+
+def api_rows(client, riksmoten, mark=None):
+    """Return the rows of the speeches of some riksmöten from the API.
+
+    Only speeches from the day of the watermark mark on are read, so the
+    texts of the older ones are not fetched.
+    """
+    since = None if mark is None else mark[0]
+    rows = {}
+    for riksmote in riksmoten:
+        for speech in client.speeches(riksmote, since=since):
+            row = parse_speech(speech)
+            if row is not None:
+                rows[row["talk_id"]] = row
+    return list(rows.values())
+
+
+def existing_rows(conn, table, talk_ids, batch_size=1000):
+    """Return talk_id -> row for the speeches that are already loaded."""
+    statement = sqlalchemy.text(
+        f"SELECT {', '.join(columns)} FROM {table} WHERE talk_id IN :ids"
+    ).bindparams(sqlalchemy.bindparam("ids", expanding=True))
+    existing = {}
+    for n in range(0, len(talk_ids), batch_size):
+        for row in conn.execute(statement, {"ids": talk_ids[n : n + batch_size]}).mappings():
+            existing[row["talk_id"]] = dict(row)
+    return existing
+
+
+def same(row, other):
+    """Return True if two rows have the same values, compared as text since dates may be typed."""
+    return other is not None and all(str(row[i]) == str(other[i]) for i in columns)
+
+
+def upsert(engine, backend, rows, table=db_name):
+    """Write the new and changed rows in one transaction.
+
+    Args:
+        engine (Engine): The database.
+        backend (SearchBackend): Backend whose indexes are kept current.
+        rows (list): Rows as made by ingest.parse_speech.
+        table (str): Table to write to.
+
+    Returns:
+        tuple: The rows written, and talk_id -> old row for the rows they replaced.
+    """
+    load = copy_rows if engine.dialect.name == "postgresql" else insert_rows
+    before, after = backend.replace_statements()
+    with engine.begin() as conn:
+        conn.exec_driver_sql(create_table.format(table=table))
+        for statement in create_tables:
+            conn.exec_driver_sql(statement)
+        Dimensions.load(conn).encode(conn, rows)
+        existing = existing_rows(conn, table, [i["talk_id"] for i in rows])
+        rows = [i for i in rows if not same(i, existing.get(i["talk_id"]))]
+        old = {i["talk_id"]: existing[i["talk_id"]] for i in rows if i["talk_id"] in existing}
+        ids = sqlalchemy.bindparam("ids", [i["talk_id"] for i in rows], expanding=True)
+        for sql in before:
+            conn.execute(sqlalchemy.text(sql).bindparams(ids))
+        delete_rows(conn, table, list(old))
+        load(conn, table, rows)
+        for sql in after:
+            conn.execute(sqlalchemy.text(sql).bindparams(ids))
+    return rows, old
+
+
+def update_index(index, rows, old, path=index_path):
+    """Replace the changed speeches in a search index and save it."""
+    index.remove({k: v["text_lower"] or "" for k, v in old.items()})
+    for row in rows:
+        index.add(row["talk_id"], row["year"] or 0, row["text_lower"])
+    index.finish()
+    index.save(path)
+
+
+def invalidate(cache, rows):
+    """Remove the cached results that a query could have got one of the rows in.
+
+    The rows are indexed on their own and every cached query is searched in
+    them, which gives exactly the hits the database would give. Entries that
+    have no query stored are removed too.
+
+    Returns:
+        int: Number of entries removed.
+    """
+    index = SearchIndex()
+    for row in rows:
+        index.add(row["talk_id"], row["year"] or 0, row["text_lower"] or "")
+    index.finish()
+    speakers = {i["talare"] for i in rows}
+
+    def stale(metadata):
+        if "query" not in metadata:
+            return True
+        query = query_from_json(metadata["query"])
+        if query.speaker is not None:
+            return query.speaker in speakers
+        return index.search(query) != []
+
+    return cache.invalidate(stale)
+
+
+def bump_version(engine, column):
+    """Count one more sync started or finished in the version table."""
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {version_table} (started INTEGER, finished INTEGER)"
+        )
+        if conn.exec_driver_sql(f"SELECT COUNT(*) FROM {version_table}").scalar() == 0:
+            conn.exec_driver_sql(f"INSERT INTO {version_table} VALUES (0, 0)")
+        conn.exec_driver_sql(f"UPDATE {version_table} SET {column} = {column} + 1")
+
+
+def data_version(engine):
+    """Return (syncs started, syncs finished), (0, 0) if there was none.
+
+    The version changes when a sync starts and when it is done, so a result
+    read while the version stayed the same and no sync was running is current.
+    """
+    if not sqlalchemy.inspect(engine).has_table(version_table):
+        return 0, 0
+    with engine.connect() as conn:
+        row = conn.exec_driver_sql(f"SELECT started, finished FROM {version_table}").first()
+    return (0, 0) if row is None else tuple(row)
+
+
+def sync(engine, rows, backend=None, cache=None, table=db_name):
+    """Upsert the speeches newer than the watermark and update what depends on them.
+
+    Args:
+        engine (Engine): The database.
+        rows (list): Rows as made by ingest.parse_speech, e.g. from archive_rows.
+        backend (SearchBackend): Backend whose indexes are kept current.
+        cache (ResultCache): Cache to remove stale results from, or None.
+        table (str): Table to sync.
+
+    Returns:
+        int: Number of speeches written.
+    """
+    backend = backend or get_backend()
+    bump_version(engine, "started")
+    try:
+        rows, old = upsert(engine, backend, newer(rows, watermark(engine, table)), table)
+        if rows == []:
+            return 0
+        changed = rows + list(old.values())
+        update_stats(engine, {i["year"] for i in changed}, table)
+        if isinstance(backend, IndexBackend):
+            update_index(backend.index, rows, old)
+        if cache is not None:
+            print(f"{invalidate(cache, changed)} cached results removed.")
+        return len(rows)
+    finally:
+        # Last, so the app reads the index when it is saved.
+        bump_version(engine, "finished")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync new speeches into the database.")
+    parser.add_argument("paths", nargs="*", help="Archives, e.g. anforande-202324.json.zip")
+    parser.add_argument("--riksmote", action="append", default=[], help="Riksmöte to read from the API, e.g. 2023/24.")
+    args = parser.parse_args()
+    engine = db.create_engine()
+    rows = archive_rows(args.paths) + api_rows(RiksdagenClient(), args.riksmote, watermark(engine))
+    cache = None if result_cache_dir is None else ResultCache()
+    written = sync(engine, rows, get_backend(search_backend), cache)
+    print(f"{written} speeches written.")
@@ -0,0 +1,148 @@
+""" Timing of each search and a log of the query plans of slow searches.
+
+Every search gets one row in search_timings, when all its speeches are
+loaded: the time spent compiling SQL, in the database and preparing the
+pages (from the ResultLoader), the rows and bytes fetched, and the stages of
+the app run that showed it (from its StageTimer). The rows are written by the
+EventWriter, next to the search log, so timing never waits for the database.
+
+Statements slower than slow_search_ms, any page of the speeches or the
+counts of a truncated result, also get their plan, from EXPLAIN (ANALYZE,
+BUFFERS) in Postgres or EXPLAIN QUERY PLAN in SQLite, in slow_queries. The
+slowest statement of a search is kept by its QueryHandle (see fetch.py). The
+plans are made in one background thread, once per statement. The app creates
+the tables before it logs the first timing, and logs none if it can't.
+"""
+
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from config import slow_search_ms
+from search_backends import Plan
+
+create_tables = [
+    """CREATE TABLE IF NOT EXISTS search_timings (
+        time TIMESTAMP,
+        search VARCHAR,
+        backend VARCHAR,
+        cached BOOLEAN,
+        rows INTEGER,
+        bytes BIGINT,
+        compile_ms REAL,
+        db_ms REAL,
+        prepare_ms REAL,
+        total_ms REAL,
+        stages TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS slow_queries (
+        time TIMESTAMP,
+        search VARCHAR,
+        backend VARCHAR,
+        statement_ms REAL,
+        sql TEXT,
+        plan TEXT
+    )""",
+]
+
+
+def create_telemetry_tables(engine):
+    """Create search_timings and slow_queries if they are not there."""
+    with engine.begin() as conn:
+        for statement in create_tables:
+            conn.exec_driver_sql(statement)
+
+
+def timing_row(search, backend, loader, timer):
+    """Return the search_timings row for a search.
+
+    Args:
+        search (str): The search as typed.
+        backend (SearchBackend): The backend that ran it.
+        loader (ResultLoader): The finished loader of the speeches.
+        timer (StageTimer): The stages of the app run that showed the result.
+    """
+    fetch = loader.timer.timings
+    stages = {**fetch, **timer.timings}
+    return {
+        "time": datetime.now(),
+        "search": search,
+        "backend": backend.name,
+        "cached": loader.cached,
+        "rows": loader.rows,
+        "bytes": loader.bytes,
+        "compile_ms": fetch.get("compile", 0),
+        "db_ms": fetch.get("db", 0),
+        "prepare_ms": fetch.get("prepare", 0),
+        "total_ms": round(loader.timer.total() + timer.total(), 1),
+        "stages": json.dumps(stages, ensure_ascii=False),
+    }
+
+
+def explain(engine, plan):
+    """Return the query plan of a Plan as text, with the time of each step in Postgres."""
+    if engine.dialect.name == "postgresql":
+        prefix, column = "EXPLAIN (ANALYZE, BUFFERS)", 0
+    else:
+        prefix, column = "EXPLAIN QUERY PLAN", -1
+    explained = Plan(f"{prefix} {plan.sql}", plan.params)
+    with engine.connect() as conn:
+        rows = conn.execute(explained.statement(), explained.parameters())
+        return "\n".join(str(i[column]) for i in rows)
+
+
+class SlowQueryLog:
+    """Logs the query plans of slow statements to slow_queries.
+
+    Args:
+        engine (Engine): The database the searches run in.
+        writer (EventWriter): Writer of the rows.
+        threshold_ms (float): Statements slower than this are logged, None for none.
+    """
+
+    def __init__(self, engine, writer, threshold_ms=slow_search_ms):
+        self.engine = engine
+        self.writer = writer
+        self.threshold_ms = threshold_ms
+        self.explained = set()
+        self._lock = threading.Lock()
+        # One thread, so plans of slow searches never pile up in the database.
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="explain")
+
+    def log(self, search, backend, handle):
+        """Queue the plan of the slowest statement of a search for logging if it was slow, and not logged before.
+
+        Args:
+            search (str): The search as typed.
+            backend (SearchBackend): The backend that compiled the statements.
+            handle (QueryHandle): The handle the statements ran through.
+        """
+        if self.threshold_ms is None or handle.slowest is None:
+            return False
+        ms, plan = handle.slowest
+        if ms < self.threshold_ms:
+            return False
+        with self._lock:
+            if (backend.name, plan) in self.explained:
+                return False
+            if len(self.explained) > 10000:  # Explain again after many others.
+                self.explained.clear()
+            self.explained.add((backend.name, plan))
+        self.executor.submit(self._log, search, backend, plan, ms)
+        return True
+
+    def _log(self, search, backend, plan, ms):
+        try:
+            text = explain(self.engine, plan)
+        except Exception as e:  # E.g. the statement timeout, log that instead.
+            text = f"EXPLAIN failed: {e}"
+        self.writer.log(
+            "slow_queries",
+            time=datetime.now(),
+            search=search,
+            backend=backend.name,
+            statement_ms=ms,
+            sql=plan.sql,
+            plan=text,
+        )
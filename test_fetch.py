@@ -0,0 +1,40 @@
+import threading
+import time
+
+import pytest
+import sqlalchemy
+
+import db
+from fetch import Cancelled, QueryHandle
+
+# Counts for far longer than the test waits.
+slow_sql = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+
+
+def test_cancel_interrupts_the_running_statement(tmp_path):
+    engine = db.create_engine(f"sqlite:///{tmp_path / 'fetch.db'}")
+    handle = QueryHandle(engine)
+    errors = []
+
+    def run():
+        try:
+            with handle.connect() as conn:
+                conn.execute(sqlalchemy.text(slow_sql))
+        except sqlalchemy.exc.OperationalError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    while handle._connection is None:
+        time.sleep(0.01)
+    time.sleep(0.2)  # Let the statement start.
+    start = time.perf_counter()
+    handle.cancel()
+    assert time.perf_counter() - start < 0.1  # The caller doesn't wait for the database.
+    thread.join(5)
+    assert not thread.is_alive()
+    assert "interrupted" in str(errors[0])
+    with pytest.raises(Cancelled):
+        with handle.connect():
+            pass
+    engine.dispose()
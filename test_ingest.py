@@ -0,0 +1,110 @@
+import json
+import zipfile
+
+import pandas as pd
+import pytest
+import sqlalchemy
+
+import db
+from config import db_name
+from fetch import keyset_pages
+from ingest import ingest
+from query import parse_query
+from result_schema import compact, concat
+from search_backends import LikeBackend
+from search_index import build_index
+from snippets import make_snippets
+
+speeches = [
+    {
+        "anforande_id": "a-1",
+        "dok_id": "H901",
+        "dok_datum": "2020-03-04 00:00:00",
+        "anforande_nummer": "1",
+        "kammaraktivitet": "ip",
+        "talare": "Anna Andersson (S)",
+        "parti": "S",
+        "anforandetext": "<p>Fru talman! Skicka en <b>e-post</b> om covid-19 &amp; vården.</p>",
+    },
+    {
+        "anforande_id": "a-2",
+        "dok_id": "H901",
+        "dok_datum": "2020-03-04 00:00:00",
+        "anforande_nummer": "2",
+        "kammaraktivitet": "ip",
+        "talare": "Bo Berg (M)",
+        "parti": "M",
+        "anforandetext": "<p>Herr talman! Jag håller med.</p><p>Tack.</p>",
+    },
+]
+
+
+@pytest.fixture
+def archive(tmp_path):
+    path = tmp_path / "anforande-201920.json.zip"
+    with zipfile.ZipFile(path, "w") as f:
+        for speech in speeches:
+            f.writestr(f"{speech['anforande_id']}.json", json.dumps({"anforande": speech}))
+        # The same speech again, the last one is loaded.
+        f.writestr("a-2-again.json", json.dumps({"anforande": speeches[1]}))
+    return str(path)
+
+
+def read_table(engine):
+    with engine.connect() as conn:
+        rows = conn.execute(sqlalchemy.text(f"SELECT talk_id, text_lower FROM {db_name}"))
+        return dict(rows.all())
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_ingest(tmp_path, archive, workers):
+    engine = db.create_engine(f"sqlite:///{tmp_path / 'ingest.db'}")
+    assert ingest(engine, [archive], workers=workers) == 2
+    rows = read_table(engine)
+    assert rows == {
+        "a-1": " fru talman skicka en e post om covid 19 vården ",
+        "a-2": " herr talman jag håller med tack ",
+    }
+    # Loading the archive again replaces the speeches.
+    assert ingest(engine, [archive], workers=workers) == 2
+    assert read_table(engine) == rows
+    engine.dispose()
+
+
+def test_hyphenated_words_are_found(tmp_path, archive):
+    engine = db.create_engine(f"sqlite:///{tmp_path / 'ingest.db'}")
+    ingest(engine, [archive], workers=1)
+    # Search -> text the snippet must have.
+    searches = {
+        "e-post": "e-post",
+        "covid-19": "covid-19",
+        '"om covid-19"': "om covid-19",
+        "E-POST*": "e-post",
+    }
+    for search, snippet in searches.items():
+        query = parse_query(search)
+        page = concat(list(keyset_pages(engine, LikeBackend(dialect="sqlite"), query, 100)))
+        assert list(page["talk_id"]) == ["a-1"], search
+        short, long = make_snippets(page["excerpt"], query.snippet_terms())
+        assert snippet in short[0], search
+    engine.dispose()
+
+
+def test_speeches_without_a_date(tmp_path):
+    path = tmp_path / "anforande-202324.json.zip"
+    undated = [
+        dict(speeches[0], anforande_id="u-1", dok_datum=None, rm="2023/24"),
+        dict(speeches[1], anforande_id="u-2", dok_datum=None),
+    ]
+    with zipfile.ZipFile(path, "w") as f:
+        for speech in undated:
+            f.writestr(f"{speech['anforande_id']}.json", json.dumps({"anforande": speech}))
+    engine = db.create_engine(f"sqlite:///{tmp_path / 'ingest.db'}")
+    assert ingest(engine, [str(path)], workers=1) == 2
+    page = concat(list(keyset_pages(engine, LikeBackend(dialect="sqlite"), parse_query("talman"), 100)))
+    years = compact(page).set_index("talk_id")["År"]
+    assert years["u-1"] == 2023
+    assert pd.isna(years["u-2"])
+    index = build_index(engine)
+    assert sorted(index.search(parse_query("talman"))) == ["u-1", "u-2"]
+    engine.dispose()
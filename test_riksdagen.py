@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from riksdagen import RiksdagenClient
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Answers with the next (status, data, delay) queued for the path, or the last one."""
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        self.server.requests.append(path)
+        answers = self.server.answers.get(path, [(404, {}, 0)])
+        status, data, delay = answers.pop(0) if len(answers) > 1 else answers[0]
+        time.sleep(delay)
+        body = json.dumps(data).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:  # The client gave up waiting.
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.answers = {}
+    server.requests = []
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def document(dok_id, files):
+    files = [{"namn": name, "url": url} for name, url in files]
+    return {"dokumentlista": {"dokument": [{"dok_id": dok_id, "filbilaga": {"fil": files}}]}}
+
+
+def test_retries_server_errors(server):
+    server.answers["/dokument/H1.json"] = [(503, {}, 0), (200, document("H1", []), 0)]
+    client = RiksdagenClient(server.url, cache_dir=None, retries=2)
+    assert client.document("H1") == document("H1", [])
+    assert server.requests == ["/dokument/H1.json"] * 2
+
+
+def test_gives_up_after_the_retries(server):
+    server.answers["/dokument/H1.json"] = [(500, {}, 0)]
+    client = RiksdagenClient(server.url, cache_dir=None, retries=1)
+    with pytest.raises(requests.RequestException):
+        client.document("H1")
+    assert len(server.requests) == 2
+
+
+def test_retries_after_a_timeout(server):
+    server.answers["/dokument/H1.json"] = [(200, {}, 1), (200, document("H1", []), 0)]
+    client = RiksdagenClient(server.url, cache_dir=None, timeout=0.2, retries=1)
+    assert client.document("H1") == document("H1", [])
+
+
+def test_timeout_without_retries_raises(server):
+    server.answers["/dokument/H1.json"] = [(200, document("H1", []), 1)]
+    client = RiksdagenClient(server.url, cache_dir=None, timeout=0.2, retries=0)
+    start = time.perf_counter()
+    with pytest.raises(requests.RequestException):
+        client.document("H1")
+    assert time.perf_counter() - start < 1
+
+
+def test_cached_answers_expire_after_the_ttl(server, tmp_path):
+    server.answers["/dokument/H1.json"] = [(200, document("H1", []), 0)]
+    client = RiksdagenClient(server.url, cache_dir=str(tmp_path), cache_ttl=60)
+    client.document("H1")
+    client.document("H1")
+    assert len(server.requests) == 1
+    path = client._cache_path("document", "H1")
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    client.document("H1")
+    assert len(server.requests) == 2
+    assert os.path.getmtime(path) > old
+
+
+def test_protocol_url_falls_back_to_the_document(server):
+    server.answers["/dokument/H1.json"] = [(200, document("H1", [("prot.pdf", "http://pdf/1")]), 0)]
+    server.answers["/dokument/H2.json"] = [(200, document("H2", [("bil.pdf", "http://pdf/2")]), 0)]
+    client = RiksdagenClient(server.url, cache_dir=None, retries=0)
+    assert client.protocol_url("H1") == "http://pdf/1"
+    assert client.protocol_url("H2") == f"{server.url}/dokument/H2"
+    # No answer for H3, the server says 404.
+    assert client.protocol_url("H3") == f"{server.url}/dokument/H3"
+
+
+def test_speeches_fetches_missing_texts(server, tmp_path):
+    listed = {"dok_id": "H1", "anforande_nummer": "2", "anforandetext": None}
+    server.answers["/anforandelista/"] = [(200, {"anforandelista": {"anforande": listed}}, 0)]
+    text = dict(listed, anforandetext="<p>Fru talman!</p>")
+    server.answers["/anforande/H1-2/json"] = [(200, {"anforande": text}, 0)]
+    client = RiksdagenClient(server.url, cache_dir=str(tmp_path))
+    assert client.speeches("2023/24") == [text]
+    assert client.speeches("2023/24") == [text]
+    # The list is fetched again, the speech is taken from the cache.
+    assert server.requests == ["/anforandelista/", "/anforande/H1-2/json", "/anforandelista/"]
+
+
+def test_speeches_since_a_date_fetch_no_older_texts(server):
+    old = {"dok_id": "H1", "anforande_nummer": "1", "dok_datum": "2023-09-01", "anforandetext": None}
+    new = {"dok_id": "H2", "anforande_nummer": "1", "dok_datum": "2023-10-02", "anforandetext": None}
+    server.answers["/anforandelista/"] = [(200, {"anforandelista": {"anforande": [old, new]}}, 0)]
+    text = dict(new, anforandetext="<p>Herr talman!</p>")
+    server.answers["/anforande/H2-1/json"] = [(200, {"anforande": text}, 0)]
+    client = RiksdagenClient(server.url, cache_dir=None)
+    assert client.speeches("2023/24", since="2023-10-02") == [text]
+    assert server.requests == ["/anforandelista/", "/anforande/H2-1/json"]
+
+
+def test_prefetch_fetches_each_document_once(server, tmp_path):
+    server.answers["/dokument/H1.json"] = [(200, document("H1", []), 0.3)]
+    client = RiksdagenClient(server.url, cache_dir=str(tmp_path))
+    futures = client.prefetch(["H1"]) + client.prefetch(["H1", "H1"])
+    assert len({id(i) for i in futures}) == 1  # The second gets the running fetch.
+    futures[0].result()
+    assert client.prefetch(["H1"]) == []  # In the cache.
+    assert server.requests == ["/dokument/H1.json"]
@@ -0,0 +1,121 @@
+import pytest
+
+import db
+from benchmarks.corpus import make_database
+from config import db_name
+from dimensions import Dimensions, create_tables
+from fetch import keyset_pages
+from ingest import create_table, insert_rows, parse_speech
+from query import parse_query
+from result_schema import concat
+from snippets import make_snippets
+from search_backends import IndexBackend, LikeBackend, SQLiteBackend
+from search_index import build_index
+
+searches = [
+    "energi",
+    "*kraft",
+    "skol* -vård",
+    "klimat or miljö år:2000-2010",
+    '"fru talman"',
+    "en_rgi",
+    "energi%",
+    "%",
+    "_",
+    "100%",
+]
+
+
+@pytest.fixture(scope="module")
+def engine(tmp_path_factory):
+    engine = make_database(tmp_path_factory.mktemp("corpus") / "corpus.db", 500)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(scope="module")
+def backends(engine):
+    return [
+        LikeBackend(dialect="sqlite"),
+        SQLiteBackend(),
+        IndexBackend(dialect="sqlite", index=build_index(engine), engine=engine),
+    ]
+
+
+def hits(engine, backend, query):
+    pages = list(keyset_pages(engine, backend, query, 100))
+    return set(concat(pages)["talk_id"]) if pages else set()
+
+
+@pytest.mark.parametrize("search", searches)
+def test_backends_give_the_same_hits(engine, backends, search):
+    query = parse_query(search)
+    like, *others = [hits(engine, i, query) for i in backends]
+    for backend, other in zip(backends[1:], others):
+        assert other == like, backend.name
+
+
+def test_wildcards_only_match_themselves(engine, backends):
+    assert hits(engine, backends[0], parse_query("en_rgi")) == set()
+    assert hits(engine, backends[0], parse_query("energi")) != set()
+
+
+def test_excerpt_has_the_hit_after_stripped_markup(tmp_path):
+    engine = db.create_engine(f"sqlite:///{tmp_path / 'long.db'}")
+    paragraph = "<p>Fru talman! Det här är &amp; ett <i>långt</i> stycke, med (skiljetecken); och ”citat”.</p>"
+    text = paragraph * 150 + "<p>Till sist: Kärnkraften och vattenkraften!</p>"
+    row = parse_speech({"anforande_id": "1", "dok_datum": "2020-01-01", "anforandetext": text})
+    with engine.begin() as conn:
+        conn.exec_driver_sql(create_table.format(table=db_name))
+        for statement in create_tables:
+            conn.exec_driver_sql(statement)
+        Dimensions.load(conn).encode(conn, [row])
+        insert_rows(conn, db_name, [row])
+    for search in ["kärnkraft*", '"kärnkraften och vattenkraften"']:
+        query = parse_query(search)
+        page = concat(list(keyset_pages(engine, LikeBackend(dialect="sqlite"), query, 100)))
+        excerpt = page["excerpt"].iloc[0]
+        assert "Kärnkraften" in excerpt
+        short, long = make_snippets(page["excerpt"], query.snippet_terms())
+        assert "Kärnkraften" in short[0]
+    engine.dispose()
+
+
+def test_backends_agree_on_words_next_to_punctuation(tmp_path):
+    engine = db.create_engine(f"sqlite:///{tmp_path / 'punctuation.db'}")
+    texts = [
+        "<p>Fru talman! Skicka ett e-post om covid-19, tack.</p>",
+        "<p>(Energi) och energi-politik; e_post.</p>",
+        "<p>Talmannen: epost och covid 19!</p>",
+    ]
+    rows = [
+        parse_speech({"anforande_id": str(n), "dok_datum": "2020-01-01", "anforandetext": text})
+        for n, text in enumerate(texts)
+    ]
+    with engine.begin() as conn:
+        conn.exec_driver_sql(create_table.format(table=db_name))
+        for statement in create_tables:
+            conn.exec_driver_sql(statement)
+        Dimensions.load(conn).encode(conn, rows)
+        insert_rows(conn, db_name, rows)
+        for statement in SQLiteBackend().migrations():
+            conn.exec_driver_sql(statement)
+    backends = [
+        LikeBackend(dialect="sqlite"),
+        SQLiteBackend(),
+        IndexBackend(dialect="sqlite", index=build_index(engine), engine=engine),
+    ]
+    expected = {
+        "talman": {"0"},
+        "talman*": {"0", "2"},
+        "e-post": {"0", "1"},
+        "covid-19": {"0", "2"},
+        '"om covid-19"': {"0"},
+        "energi": {"1"},
+        "energi*": {"1"},
+        "post": {"0", "1"},
+    }
+    for search, talk_ids in expected.items():
+        for backend in backends:
+            assert hits(engine, backend, parse_query(search)) == talk_ids, (search, backend.name)
+    engine.dispose()
@@ -0,0 +1,25 @@
+import re
+
+from snippets import SnippetMatcher, highlight
+
+
+def strip_tags(text):
+    return re.sub(r"</?b>", "", text)
+
+
+def test_affix_terms_in_the_same_word_are_highlighted_once():
+    text = "Vi talar om kärnkraften och vattenkraft, inte om kärnvapen."
+    matcher = SnippetMatcher(["kärn*", "*kraft*"])
+    matches = matcher.matches(text)
+    assert [text[s:e] for s, e, _ in matches] == ["kärnkraften", "vattenkraft", "kärnvapen"]
+    highlighted = highlight(text, matches)
+    assert strip_tags(highlighted) == text
+    assert highlighted.count("<b>") == 3
+
+
+def test_snippets_find_each_term():
+    matcher = SnippetMatcher(["kärn*", "*kraft"])
+    short, long, matches = matcher.snippets("Fru talman! Vi talar om kärnkraften och vattenkraft.")
+    assert "kärnkraften" in short
+    assert "vattenkraft" in long
+    assert len(matches) == 2
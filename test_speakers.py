@@ -0,0 +1,26 @@
+from speakers import SpeakerIndex
+
+names = [
+    ("Magdalena Andersson", "Magdalena Andersson (S)"),
+    ("Magnus Persson", "Magnus Persson (SD)"),
+    ("Ulf Kristersson", "Ulf Kristersson (M)"),
+]
+
+
+def test_find_exact_name_and_surname():
+    index = SpeakerIndex(names)
+    assert index.find("ulf  Kristersson") == (["Ulf Kristersson (M)"], True)
+    assert index.find("Andersson") == (["Magdalena Andersson (S)"], False)
+
+
+def test_find_partial_name():
+    index = SpeakerIndex(names)
+    assert index.find("magdalena and") == (["Magdalena Andersson (S)"], False)
+    assert index.find("magn") == (["Magnus Persson (SD)"], False)
+    # Too short to look up by prefix.
+    assert index.find("ma") == ([], False)
+
+
+def test_find_misspelled_name():
+    index = SpeakerIndex(names)
+    assert index.find("Kristerson") == (["Ulf Kristersson (M)"], False)
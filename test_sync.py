@@ -0,0 +1,39 @@
+import sqlalchemy
+
+from benchmarks.corpus import make_database
+from config import db_name
+from corpus_stats import read_stats
+from ingest import parse_speech
+from search_backends import SQLiteBackend
+from sync import data_version, sync
+
+
+def speech(talk_id, date, text):
+    return parse_speech(
+        {
+            "anforande_id": talk_id,
+            "dok_id": "H901",
+            "dok_datum": date,
+            "anforande_nummer": talk_id,
+            "kammaraktivitet": "ip",
+            "talare": "Anna Andersson (S)",
+            "parti": "S",
+            "anforandetext": text,
+        }
+    )
+
+
+def test_sync_counts_versions_and_skips_speeches_without_year(tmp_path):
+    engine = make_database(tmp_path / "sync.db", 0)
+    assert data_version(engine) == (0, 0)
+    rows = [speech("1", "2020-03-04", "<p>Energi.</p>"), speech("2", None, "<p>Utan datum.</p>")]
+    assert sync(engine, rows, SQLiteBackend()) == 2
+    assert data_version(engine) == (1, 1)
+    stats = read_stats(engine)
+    assert stats["År"].tolist() == [2020]
+    # Nothing new, the version changes anyway since a sync ran.
+    assert sync(engine, rows, SQLiteBackend()) == 0
+    assert data_version(engine) == (2, 2)
+    with engine.connect() as conn:
+        assert conn.execute(sqlalchemy.text(f"SELECT COUNT(*) FROM {db_name}")).scalar() == 2
+    engine.dispose()
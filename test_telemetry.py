@@ -0,0 +1,46 @@
+import pandas as pd
+import sqlalchemy
+
+from benchmarks.corpus import make_database
+from event_log import EventWriter
+from fetch import QueryHandle, keyset_pages, stream_frames
+from query import parse_query
+from search_backends import SQLiteBackend
+from telemetry import SlowQueryLog, create_telemetry_tables
+
+
+def test_slowest_page_and_aggregate_are_explained(tmp_path):
+    engine = make_database(tmp_path / "telemetry.db", 300)
+    create_telemetry_tables(engine)
+    backend = SQLiteBackend()
+    query = parse_query("fru talman")
+    pages = QueryHandle(engine)
+    assert len(list(keyset_pages(engine, backend, query, 50, handle=pages))) > 1
+    counts = QueryHandle(engine)
+    list(stream_frames(engine, backend.compile_aggregate(query), 100, counts))
+    assert counts.slowest[1] == backend.compile_aggregate(query)
+
+    writer = EventWriter(engine)
+    log = SlowQueryLog(engine, writer, threshold_ms=0)
+    assert log.log("fru talman", backend, pages)
+    assert log.log("fru talman", backend, counts)
+    assert not log.log("fru talman", backend, counts)  # Explained already.
+    log.executor.shutdown(wait=True)
+    writer.flush()
+    assert writer.failed == 0
+    with engine.connect() as conn:
+        rows = pd.read_sql(sqlalchemy.text("SELECT * FROM slow_queries"), conn)
+    assert rows["sql"].tolist() == [pages.slowest[1].sql, counts.slowest[1].sql]
+    assert rows["statement_ms"].tolist() == [pages.slowest[0], counts.slowest[0]]
+    assert not rows["plan"].str.startswith("EXPLAIN failed").any()
+    engine.dispose()
+
+
+def test_fast_statements_are_not_logged(tmp_path):
+    engine = make_database(tmp_path / "telemetry.db", 10)
+    handle = QueryHandle(engine)
+    log = SlowQueryLog(engine, EventWriter(engine), threshold_ms=60000)
+    assert not log.log("energi", SQLiteBackend(), handle)  # Nothing has run.
+    list(keyset_pages(engine, SQLiteBackend(), parse_query("energi"), 50, handle=handle))
+    assert not log.log("energi", SQLiteBackend(), handle)
+    engine.dispose()
@@ -0,0 +1,31 @@
+""" Timing of the stages of a search.
+
+A StageTimer is made for each run of the app script and every stage (fetch,
+filter, facets, table, charts, export...) is timed with it, so it is easy to
+see where the time of a rerun goes. A ResultLoader has one too, for the
+stages that run once per page in the background (compile, db, prepare).
+"""
+
+import contextlib
+import time
+
+
+class StageTimer:
+    """Keeps the time in milliseconds of each named stage, summed if a stage runs more than once."""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the code in a with block as the stage name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.timings[name] = round(self.timings.get(name, 0) + elapsed, 1)
+
+    def total(self):
+        """Return the sum of the stage times in milliseconds."""
+        return round(sum(self.timings.values()), 1)